@@ -0,0 +1,194 @@
+import io
+import time
+import threading
+import contextlib
+import collections
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait
+from GFOLD_run import N3, N4
+
+''' Anytime planning
+
+ solve_direct takes as long as p3 on N3 nodes and p4 on N4 nodes take; nothing
+ bounds that. anytime solves the same problem at several resolutions at once,
+ coarse to fine, and solve() returns after at most
+ deadline seconds with the finest solution finished by then (or as soon as the
+ finest resolution is in). A warm_up still running is waited for first, the
+ deadline starts after it. A coarse grid is a few times faster, so under load
+ there is still an answer in time, only a less fuel-optimal one.
+
+ Every resolution has a worker process of its own (a single-worker pool each),
+ so its problems are compiled once, by warm_up, and stay compiled in that
+ worker; a request's solves never wait behind each other.
+
+ The finer solves keep running after solve() returns. Each one that finishes
+ later, and is finer than what was returned, is an upgrade: it becomes best
+ and goes to on_upgrade(answer), on its pool's thread. Only the newest request
+ is upgraded; solves of older ones are still timed but dropped.
+
+ Every solve is timed per resolution: latency from submit to result, time in
+ the worker, whether it made the deadline. stats() / report() summarize the
+ last keep of each.
+
+'''
+
+RESOLUTIONS = ((30, 20), (80, 40), (N3, N4))  # (p3, p4) nodes, coarse to fine
+
+
+class answer:
+    def __init__(self, request, rank, resolution, result, path, latency, tag=None):
+        self.request = request  # number of the solve() call
+        self.rank = rank  # index in resolutions, higher is finer
+        self.resolution = resolution
+        self.result = result  # (tf, x, u, m, s, z) as returned by solver.solve_direct
+        self.path = path  # solver.path, to warm start the next solve
+        self.latency = latency  # wall time from solve() to the result
+        self.tag = tag  # what the caller passed to solve()
+
+
+def solve_resolution(v_data, resolution, backend, engine, options):
+    # runs in a worker: the result of one resolution and its timing
+    from GFOLD_run import solver
+    start = time.time()
+    gfold = solver(v_data, backend, False, engine)
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = gfold.solve_direct(resolution=resolution, **options)
+    return {'start': start, 'result': result, 'path': gfold.path if result is not None else None,
+            'solve_time': time.time() - start, 'phases': gfold.trace.durations()}
+
+
+class anytime:
+    def __init__(self, resolutions=RESOLUTIONS, backend='auto', engine='cvxpy', on_upgrade=None, keep=200):
+        self.resolutions = tuple(tuple(resolution) for resolution in resolutions)
+        self.backend = backend
+        self.engine = engine
+        self.on_upgrade = on_upgrade
+        self.pools = {resolution: ProcessPoolExecutor(max_workers=1) for resolution in self.resolutions}
+        self.condition = threading.Condition()
+        self.request = 0  # newest solve() call
+        self.remaining = 0  # its resolutions still running
+        self.deadline = None  # its deadline, time.time()
+        self.best = None  # finest answer of the newest request
+        self.futures = []
+        self.warming = []  # warm_up's solves
+        self.timing = {resolution: collections.deque(maxlen=keep) for resolution in self.resolutions}
+        self.upgrades = 0
+
+    def warm_up(self, v_data):
+        # start the workers and compile their problems, every one its resolution
+        self.warming = [self.pools[resolution].submit(solve_resolution, v_data, resolution, self.backend, self.engine, {})
+                        for resolution in self.resolutions]
+
+    def solve(self, v_data, deadline, tag=None, **options):
+        # every resolution at once; the finest answer after at most deadline seconds, None if no feasible one
+        # finished by then. options go to solve_direct (warm_start, warm_path, elapsed)
+        wait(self.warming)  # the deadline starts once the workers are up
+        self.warming = []
+        start = time.time()
+        with self.condition:
+            for future in self.futures:
+                future.cancel()  # a previous request's solves not started yet
+            self.request += 1
+            request = self.request
+            self.remaining = len(self.resolutions)
+            self.deadline = start + deadline
+            self.best = None
+            self.futures = []
+        for rank, resolution in enumerate(self.resolutions):
+            future = self.pools[resolution].submit(solve_resolution, v_data, resolution, self.backend, self.engine, options)
+            future.add_done_callback(lambda f, rank=rank: self.arrive(f, request, rank, start, deadline, tag))
+            self.futures.append(future)
+        finest = len(self.resolutions) - 1
+        with self.condition:
+            self.condition.wait_for(lambda: self.request != request or self.remaining == 0 or (
+                self.best is not None and self.best.rank == finest), max(0.0, self.deadline - time.time()))
+            return self.best if self.request == request else None
+
+    def arrive(self, future, request, rank, start, deadline, tag):
+        # runs on the resolution's pool thread as it finishes
+        resolution = self.resolutions[rank]
+        latency = time.time() - start
+        record = {'request': request, 'latency': latency, 'in_time': latency <= deadline, 'ok': False,
+                  'cancelled': future.cancelled()}
+        result = None
+        if not future.cancelled():
+            try:
+                outcome = future.result()
+                result = outcome['result']
+                record.update(ok=result is not None, solve_time=outcome['solve_time'], queue_time=outcome['start'] - start,
+                              phases=outcome['phases'])
+            except Exception as e:
+                record['error'] = repr(e)
+        upgrade = None
+        with self.condition:
+            self.timing[resolution].append(record)
+            if request != self.request:
+                return
+            self.remaining -= 1
+            if result is not None and (self.best is None or rank > self.best.rank):
+                self.best = answer(request, rank, resolution, result, outcome['path'], latency, tag)
+                if time.time() > self.deadline:
+                    upgrade = self.best
+                    self.upgrades += 1
+            self.condition.notify_all()
+        if upgrade is not None and self.on_upgrade is not None:
+            self.on_upgrade(upgrade)
+
+    def stats(self):
+        # per resolution: solves, feasible, made the deadline, latency and worker time (median, max)
+        stats = {}
+        for resolution, records in self.timing.items():
+            ran = [r for r in records if not r['cancelled']]
+            latency = [r['latency'] for r in ran]
+            solve_time = [r['solve_time'] for r in ran if 'solve_time' in r]
+            stats['%d/%d' % resolution] = {
+                'solves': len(ran), 'ok': sum(r['ok'] for r in ran), 'in_time': sum(r['in_time'] and r['ok'] for r in ran),
+                'cancelled': len(records) - len(ran),
+                'latency_median': float(np.median(latency)) if latency else None, 'latency_max': max(latency, default=None),
+                'solve_time_median': float(np.median(solve_time)) if solve_time else None}
+        return {'requests': self.request, 'upgrades': self.upgrades, 'resolutions': stats}
+
+    def report(self):
+        return report(self.stats())
+
+    def shutdown(self):
+        for pool in self.pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def report(stats):
+    # anytime.stats() as text
+    lines = ['%d anytime requests, %d upgrades after the deadline' % (stats['requests'], stats['upgrades'])]
+    for name, s in stats['resolutions'].items():
+        if s['solves']:
+            lines.append('  N=%-7s %3d solves, %3d feasible, %3d in time, latency median %7.1fms max %7.1fms, in the worker %7.1fms' % (
+                name, s['solves'], s['ok'], s['in_time'], s['latency_median'] * 1000, s['latency_max'] * 1000,
+                (s['solve_time_median'] or 0.0) * 1000))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    from GFOLD_run import test_vessel
+
+    upgrades = []
+    planner = anytime(engine='sparse', on_upgrade=upgrades.append)
+    planner.warm_up(test_vessel)
+    for deadline in (10.0, 0.2, 0.1, 0.05, 0.02):
+        start = time.time()
+        best = planner.solve(test_vessel, deadline, tag=deadline)
+        returned = time.time() - start
+        assert returned < deadline + 0.05, 'solve() overran its deadline'
+        if best is None:
+            print('deadline %5.0fms: nothing in %.0fms' % (deadline * 1000, returned * 1000))
+            continue
+        print('deadline %5.0fms: N=%d/%d after %.0fms (%.0fms after the deadline started), tf %.2fs, landing mass %.1fkg' % (
+            deadline * 1000, best.resolution[0], best.resolution[1], returned * 1000, best.latency * 1000, best.result[0],
+            best.result[3][-1]))
+        if deadline == 10.0:
+            assert best.rank == len(planner.resolutions) - 1 and best.latency < 2.0, 'the warmed up workers recompiled'
+    time.sleep(1.0)  # let the last request's finer solves arrive
+    for item in upgrades:
+        print('upgrade of the %.0fms request: N=%d/%d after %.0fms, landing mass %.1fkg' % (
+            item.tag * 1000, item.resolution[0], item.resolution[1], item.latency * 1000, item.result[3][-1]))
+    print(planner.report())
+    planner.shutdown()
@@ -0,0 +1,196 @@
+import os
+import io
+import time
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+''' Batch solves
+
+ solve_batch solves a list of v_data (several vessels, boosters, a scenario
+ sweep) on a process pool, one solver.solve_direct per item. The pool is kept
+ between batches, so every worker keeps its compiled problems per N
+ (problem_cache / structure_cache live per process) and only the first batch
+ pays for compiling.
+
+ Results come back as outcome objects, in input order (a list, once all are
+ done) or in completion order (an iterator, as each one finishes). Every
+ outcome carries its timing: solve_time in the worker, queue_time waiting for
+ a free one, the solve phases from the worker's trace. A failed solve has
+ result None and error saying why: the program that failed ('p3' / 'p4'), or
+ the exception raised in the worker.
+
+ The pool is shared with GFOLD_tf_search and GFOLD_divert (get_pool / submit).
+ A worker that dies breaks it for good: submit replaces a broken pool before
+ submitting, and whoever sees a BrokenProcessPool result discards it, so one
+ dead worker fails the items it took down, not every later batch.
+
+'''
+
+_pool = None
+_pool_workers = None
+
+
+def get_pool(workers=None):
+    global _pool, _pool_workers
+    workers = workers or os.cpu_count()
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = ProcessPoolExecutor(max_workers=workers)
+        _pool_workers = workers
+    return _pool
+
+
+def discard_pool(pool):
+    # forget pool if it is still the shared one (a worker died and broke it); the next get_pool starts a new one
+    global _pool
+    if _pool is pool and pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def submit(fn, *args, workers=None):
+    # fn(*args) on the shared pool, replacing it first if a dead worker broke it
+    pool = get_pool(workers)
+    try:
+        return pool.submit(fn, *args)
+    except BrokenProcessPool:
+        discard_pool(pool)
+        return get_pool(workers).submit(fn, *args)
+
+
+class outcome:
+    def __init__(self, index, v_data, submitted):
+        self.index = index  # position in the input list
+        self.v_data = v_data
+        self.submitted = submitted  # time.time() of the submit
+        self.result = None  # (tf, x, u, m, s, z) as returned by solver.solve_direct, None if it failed
+        self.path = None  # solver.path of the solve
+        self.error = None  # why it failed
+        self.solve_time = None  # wall time of the solve in the worker
+        self.queue_time = None  # wall time from submit to the worker picking it up
+        self.phases = {}  # total time per trace phase (GFOLD_trace.trace.durations)
+        self.cache_hit = None
+        self.worker = None  # pid
+
+    @property
+    def ok(self):
+        return self.result is not None
+
+    def update(self, record):
+        for name, value in record.items():
+            setattr(self, name, value)
+        self.queue_time = record['start'] - self.submitted
+        return self
+
+
+def solve_item(v_data, backend, engine, cache_dir, options):
+    # runs in a worker: the attributes of one outcome
+    from GFOLD_run import solver
+    start = time.time()
+    record = {'start': start, 'worker': os.getpid(), 'result': None, 'path': None, 'error': None}
+    cache = None
+    if cache_dir:
+        import GFOLD_cache
+        cache = GFOLD_cache.open_store(cache_dir)
+    gfold = solver(v_data, backend, False, engine)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = gfold.solve_direct(cache=cache, **options)
+        if result is None:
+            failed = [e['args']['failed'] for e in gfold.trace.events if 'failed' in e['args']]
+            record['error'] = 'infeasible: %s' % (failed[0] if failed else 'tf_search')
+        else:
+            record['result'], record['path'] = result, gfold.path
+    except Exception as e:
+        record['error'] = repr(e)
+    record['solve_time'] = time.time() - start
+    record['phases'] = gfold.trace.durations()
+    record['cache_hit'] = gfold.cache_hit
+    return record
+
+
+def solve_batch(v_data_list, ordered=True, workers=None, backend='auto', engine='cvxpy', cache_dir=None, **options):
+    # ordered: a list of outcomes in input order, else an iterator of them in completion order.
+    # options go to solve_direct (warm_start, tf_search, adaptive, ...); cache_dir is a
+    # GFOLD_cache store directory, opened once per worker
+    outcomes = {}
+    for i, v_data in enumerate(v_data_list):
+        submitted = time.time()
+        future = submit(solve_item, v_data, backend, engine, cache_dir, options, workers=workers)
+        outcomes[future] = outcome(i, v_data, submitted)
+    pool = get_pool(workers)
+
+    def collect(future):
+        item = outcomes[future]
+        try:
+            return item.update(future.result())
+        except BrokenProcessPool as e:  # a worker died: this item is lost, the next batch gets a new pool
+            discard_pool(pool)
+            item.error = repr(e)
+            return item
+        except Exception as e:  # the item could not be sent to the worker
+            item.error = repr(e)
+            return item
+
+    if ordered:
+        return [collect(future) for future in outcomes]
+    return (collect(future) for future in as_completed(outcomes))
+
+
+def summarize(outcomes):
+    # counts and solve time statistics of a batch
+    solve_times = sorted(item.solve_time for item in outcomes if item.solve_time is not None)
+    summary = {'items': len(outcomes), 'failed': sum(not item.ok for item in outcomes)}
+    if solve_times:
+        summary.update(solve_time_total=sum(solve_times), solve_time_median=solve_times[len(solve_times) // 2],
+                       solve_time_max=solve_times[-1])
+    return summary
+
+
+if __name__ == '__main__':
+    import numpy as np
+    from GFOLD_run import solver, test_vessel
+
+    rng = np.random.default_rng(0)
+    sweep = [dict(test_vessel, x0=test_vessel['x0'] + rng.normal(0, 1, 6) * (150, 80, 80, 10, 5, 5)) for _ in range(32)]
+    sweep.append(dict(test_vessel, T_max=30e3))  # cannot stop in time
+    sweep.append(dict(test_vessel, x0='nonsense'))  # raises in the worker
+
+    solve_batch(sweep[:os.cpu_count()], engine='sparse')  # start the workers and compile their problems
+    start = time.time()
+    outcomes = solve_batch(sweep, engine='sparse')
+    batch_time = time.time() - start
+    assert [item.index for item in outcomes] == list(range(len(sweep)))
+    for item in outcomes:
+        if not item.ok:
+            print('item %d failed: %s' % (item.index, item.error))
+    summary = summarize(outcomes)
+    print('%d items in %.2fs on %d workers, %d failed, median solve %.1fms, queued up to %.2fs' % (
+        summary['items'], batch_time, _pool_workers, summary['failed'], summary['solve_time_median'] * 1000,
+        max(item.queue_time for item in outcomes if item.queue_time is not None)))
+
+    start = time.time()
+    first = None
+    for item in solve_batch(sweep, ordered=False, engine='sparse'):
+        if first is None:
+            first = time.time() - start
+    print('completion order: first result after %.3fs' % first)
+
+    solver(sweep[0], engine='sparse').solve_direct()  # compile in this process too
+    start = time.time()
+    for v_data in sweep[:8]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            solver(v_data, engine='sparse').solve_direct()
+    print('serial: %.1fms per item' % ((time.time() - start) / 8 * 1000))
+
+    # a worker that dies fails what it took down; the next batch gets a new pool
+    try:
+        submit(os._exit, 1).result()
+        raise AssertionError('the worker survived os._exit')
+    except BrokenProcessPool:
+        pass
+    outcomes = solve_batch(sweep[:4], engine='sparse')
+    assert all(item.ok for item in outcomes), [item.error for item in outcomes]
+    print('after a dead worker: %d items solved on a new pool' % len(outcomes))
@@ -0,0 +1,174 @@
+import os
+import sys
+import json
+import time
+import platform
+import contextlib
+import io
+import numpy as np
+import cvxpy
+
+import GFOLD_direct_exec as solver_direct
+import GFOLD_backend as backends
+from GFOLD_run import solver, test_vessel
+
+''' Solver benchmark suite
+
+ For every N and program the time of the GFOLD_direct pipeline is split into
+   build         build_problem (cvxpy expression tree), once per N / program
+   compile       first get_problem_data: canonicalization and the DPP tensor, once
+   pack          solver.pack_data + param_values, per solve
+   canonicalize  get_problem_data with new parameter values, per solve
+   solve         the backend alone (solve_via_data)
+   extract       unpack_results and the trajectory arrays (x, u, m, s, z)
+ and the per-solve phases are measured for every scenario; solve_direct is
+ timed end to end for both engines on top. Times are medians over repeat runs.
+
+ Results go to bench_results.json next to this file; compare() flags every time more than
+ tolerance slower than the same entry of a stored baseline (bench_baseline.json,
+ written by python GFOLD_bench.py --save-baseline).
+
+'''
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_FILE = os.path.join(HERE, 'bench_results.json')
+BASELINE_FILE = os.path.join(HERE, 'bench_baseline.json')
+
+scenarios = {
+    'test_vessel': test_vessel,
+    'far': dict(test_vessel, x0=np.array([1500, 900, -700, -40, -30, 25])),  # large divert
+    'fast': dict(test_vessel, x0=np.array([2500, 200, 100, -120, 20, -10]), tf=50),  # high entry speed
+    'low_twr': dict(test_vessel, T_max=120e3, tf=50),  # thrust to weight about 1.8
+    'steep': dict(test_vessel, y_gs=np.radians(80), p_cs=np.radians(15), x0=np.array([1500, 60, 40, -50, 5, 5])),  # tight cones
+}
+
+
+def median_time(function, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples)), result
+
+
+def bench_structure(N, program, backend):
+    # build and first compile of a fresh problem
+    start = time.perf_counter()
+    cached = solver_direct.build_problem(N, program)
+    build = time.perf_counter() - start
+    packed_data = solver(test_vessel).pack_data(N)
+    solver_direct.set_params(cached, N, packed_data)
+    start = time.perf_counter()
+    cached.problem.get_problem_data(backend)
+    compile_time = time.perf_counter() - start
+    size = cached.problem.size_metrics
+    return cached, {'build': build, 'compile': compile_time, 'variables': size.num_scalar_variables,
+                    'eq_constraints': size.num_scalar_eq_constr, 'ineq_constraints': size.num_scalar_leq_constr}
+
+
+def bench_phases(cached, v_data, N, backend, repeat):
+    problem = cached.problem
+    opts = backends.BACKENDS.get(backend, {})
+
+    def pack():
+        packed_data = solver(v_data).pack_data(N)
+        return solver_direct.param_values(N, packed_data)
+
+    record = {}
+    record['pack'], values = median_time(pack, repeat)
+    for name, value in values.items():
+        cached.params[name].value = value
+    record['canonicalize'], (data, chain, inverse_data) = median_time(lambda: problem.get_problem_data(backend), repeat)
+    record['solve'], solution = median_time(lambda: chain.solve_via_data(problem, data, solver_opts=dict(opts)), repeat)
+
+    def extract():
+        problem.unpack_results(solution, chain, inverse_data)
+        if cached.z.value is None:
+            return None
+        return cached.x.value, cached.u.value, np.exp(cached.z.value), cached.s.value, cached.z.value
+
+    record['extract'], _ = median_time(extract, repeat)
+    record['status'] = problem.status
+    record['iterations'] = problem.solver_stats.num_iters
+    return record
+
+
+def bench_solve_direct(v_data, engine, backend, repeat):
+    # a fresh solver every run: solve_direct moves tf_ on, so a second call on one instance solves another problem
+    def solve_fresh():
+        return solver(v_data, backend, False, engine).solve_direct()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        solve_fresh()  # compile
+        elapsed, result = median_time(solve_fresh, repeat)
+    return {'time': elapsed, 'ok': result is not None}
+
+
+def run(Ns=(40, 80, 160, 320), programs=(3, 4), scenario_names=None, backend='ECOS', repeat=5):
+    scenario_names = scenario_names or list(scenarios)
+    results = {
+        'meta': {'backend': backend, 'repeat': repeat, 'cvxpy': cvxpy.__version__, 'numpy': np.__version__,
+                 'python': platform.python_version(), 'machine': platform.machine(), 'date': time.strftime('%Y-%m-%d %H:%M:%S')},
+        'structure': {},
+        'phases': {},
+        'solve_direct': {},
+    }
+    for N in Ns:
+        for program in programs:
+            key = 'N%d/p%d' % (N, program)
+            cached, results['structure'][key] = bench_structure(N, program, backend)
+            print('%s: build %.3fs, compile %.3fs' % (key, results['structure'][key]['build'], results['structure'][key]['compile']))
+            for name in scenario_names:
+                record = bench_phases(cached, scenarios[name], N, backend, repeat)
+                results['phases']['%s/%s' % (name, key)] = record
+                print('  %-12s pack %.4fs, canonicalize %.4fs, solve %.4fs, extract %.4fs (%s, %d iterations)' % (
+                    name, record['pack'], record['canonicalize'], record['solve'], record['extract'], record['status'], record['iterations']))
+    for name in scenario_names:
+        for engine in ('cvxpy', 'sparse'):
+            record = results['solve_direct']['%s/%s' % (name, engine)] = bench_solve_direct(scenarios[name], engine, backend, repeat)
+            print('solve_direct %s/%s: %.4fs' % (name, engine, record['time']))
+    return results
+
+
+def flatten(results, prefix=''):
+    # timing leaves as {'phases/test_vessel/N80/p3/solve': seconds, ...}
+    flat = {}
+    for key, value in results.items():
+        if key in ('meta', 'iterations', 'variables', 'eq_constraints', 'ineq_constraints'):
+            continue
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '/'))
+        elif isinstance(value, float):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results, baseline, tolerance=0.25, floor=1e-3):
+    # entries more than tolerance slower than baseline (and slower by floor seconds at least): [(key, baseline, now)]
+    now, before = flatten(results), flatten(baseline)
+    regressions = []
+    for key in sorted(now):
+        if key in before and now[key] > before[key] * (1 + tolerance) and now[key] - before[key] > floor:
+            regressions.append((key, before[key], now[key]))
+    return regressions
+
+
+def save(results, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    results = run()
+    save(results, RESULTS_FILE)
+    if '--save-baseline' in sys.argv:
+        save(results, BASELINE_FILE)
+    elif os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline)
+        for key, before, now in regressions:
+            print('slower: %s %.4fs -> %.4fs (%+.0f%%)' % (key, before, now, (now / before - 1) * 100))
+        print('%d regressions against %s (%s)' % (len(regressions), BASELINE_FILE, baseline['meta']['date']))
@@ -0,0 +1,254 @@
+import os
+import json
+import hashlib
+import contextlib
+import numpy as np
+from numpy.lib.format import open_memmap
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+''' Persistent solution store
+
+ Solutions of solver.solve_direct are kept in memory-mapped .npy files in one
+ directory, a fixed number of slots of fixed size (the p4 grid, N4 nodes), so a
+ store survives restarts and costs nothing to open.
+
+ Every solution is filed under its features x0, m_wet, T_max and tf, and under
+ a profile hash of everything else in v_data (Isp, limits, cones, g, ...);
+ solutions of another profile are never returned. Features are quantized with
+ steps to decide when a new solution replaces a stored one (same cell).
+
+ lookup() returns the stored solution nearest to v_data, measured in steps,
+ with 'hit' if it is within hit_cells in every feature (good enough to fly as
+ is) or 'warm' within warm_cells (a starting point for the solver). When the
+ store is full the least recently used slot is overwritten.
+
+ Every process on a directory (GFOLD_batch's workers each open it) maps the
+ same files: put() and lookup() hold a lock on store.lock, and the use clock is
+ the newest stamp in the file, not a count of this process. A store opened
+ with another layout (N, capacity, steps) than its files raises instead of
+ overwriting them.
+
+'''
+
+FEATURES = 9  # x0 (6), m_wet, T_max, tf
+steps_default = {'position': 5.0, 'velocity': 1.0, 'm_wet': 10.0, 'T_max': 1000.0, 'tf': 0.5}
+PROFILE_KEYS = ('Isp', 'G_max', 'V_max', 'y_gs', 'p_cs', 'throt', 'g', 'straight_fac')
+
+
+def features(v_data):
+    return np.concatenate((np.asarray(v_data['x0'], dtype=float).reshape(6), (v_data['m_wet'], v_data['T_max'], v_data['tf'])))
+
+
+def profile_hash(v_data):
+    values = np.concatenate([np.round(np.asarray(v_data[key], dtype=float).reshape(-1), 9) for key in PROFILE_KEYS])
+    return int.from_bytes(hashlib.blake2b(values.tobytes(), digest_size=8).digest(), 'little', signed=True)
+
+
+class store:
+    def __init__(self, path, N=80, capacity=4096, steps=None, hit_cells=1.0, warm_cells=50.0):
+        steps = dict(steps_default, **(steps or {}))
+        self.path = path
+        self.N = N
+        self.hit_cells = hit_cells
+        self.warm_cells = warm_cells
+        self.step = np.array([steps['position']] * 3 + [steps['velocity']] * 3 + [steps['m_wet'], steps['T_max'], steps['tf']])
+        layout = {'N': N, 'capacity': capacity, 'step': self.step.tolist()}
+        os.makedirs(path, exist_ok=True)
+        self.lock_file = os.path.join(path, 'store.lock')
+        info_file = os.path.join(path, 'store.json')
+        width = 2 + 12 * N  # tf_m, tf, x (6N), u (3N), m, s, z
+        with self.locked():
+            mode = 'w+'
+            if os.path.exists(info_file):
+                with open(info_file, 'r', encoding='utf-8') as f:
+                    stored = json.load(f)
+                if stored != layout:
+                    raise ValueError('solution store %s has layout %s, not %s; open it with that or use another directory' % (
+                        path, stored, layout))
+                mode = 'r+'
+
+            def array(name, dtype, shape):
+                file = os.path.join(path, name + '.npy')
+                if mode == 'r+':
+                    return open_memmap(file, mode='r+')
+                return open_memmap(file, mode='w+', dtype=dtype, shape=shape)
+
+            self.features = array('features', np.float64, (capacity, FEATURES))
+            self.cells = array('cells', np.int64, (capacity, FEATURES))
+            self.profile = array('profile', np.int64, (capacity,))
+            self.stamp = array('stamp', np.int64, (capacity,))  # last use, 0 = empty slot
+            self.solutions = array('solutions', np.float64, (capacity, width))
+            if mode == 'w+':
+                self.flush()
+                with open(info_file, 'w', encoding='utf-8') as f:
+                    json.dump(layout, f)
+        self.hits = self.warms = self.misses = 0
+
+    @contextlib.contextmanager
+    def locked(self):
+        # exclusive use of the store's files among all processes on the directory
+        with open(self.lock_file, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def tick(self):
+        # the next use stamp, shared by every process on the store (hold the lock)
+        return int(self.stamp.max()) + 1
+
+    def __len__(self):
+        return int(np.count_nonzero(self.stamp))
+
+    def encode(self, result, path):
+        tf_m = result[0]
+        tf, x, u, m, s, z = path
+        return np.concatenate(((tf_m, tf), x.reshape(-1), u.reshape(-1), m.reshape(-1), s.reshape(-1), z.reshape(-1)))
+
+    def decode(self, row):
+        N = self.N
+        tf_m, tf = row[0], row[1]
+        x = row[2:2 + 6 * N].reshape(6, N)
+        u = row[2 + 6 * N:2 + 9 * N].reshape(3, N)
+        m, s, z = row[2 + 9 * N:].reshape(3, N)
+        path = (tf, x.copy(), u.copy(), m.copy(), s.copy(), z.copy())
+        return (tf_m,) + path[1:], path
+
+    def put(self, v_data, result, path):
+        # file the solution of v_data; result as returned by solve_direct, path its solver.path
+        if path[1].shape[1] != self.N:
+            return False
+        f = features(v_data)
+        cell = np.round(f / self.step).astype(np.int64)
+        profile = profile_hash(v_data)
+        row = self.encode(result, path)
+        with self.locked():
+            same = np.flatnonzero((self.stamp > 0) & (self.profile == profile) & np.all(self.cells == cell, axis=1))
+            if len(same):
+                slot = same[0]
+            else:
+                slot = int(np.argmin(self.stamp))  # an empty slot, or the least recently used one
+            self.features[slot] = f
+            self.cells[slot] = cell
+            self.profile[slot] = profile
+            self.solutions[slot] = row
+            self.stamp[slot] = self.tick()
+            self.flush()
+        return True
+
+    def lookup(self, v_data):
+        # ('hit' | 'warm', result, path) of the nearest stored solution, or (None, None, None)
+        with self.locked():
+            candidates = np.flatnonzero((self.stamp > 0) & (self.profile == profile_hash(v_data)))
+            if len(candidates) == 0:
+                self.misses += 1
+                return None, None, None
+            distance = np.max(np.abs(self.features[candidates] - features(v_data)) / self.step, axis=1)
+            best = int(np.argmin(distance))
+            slot = candidates[best]
+            if distance[best] <= self.hit_cells:
+                kind = 'hit'
+                self.hits += 1
+            elif distance[best] <= self.warm_cells:
+                kind = 'warm'
+                self.warms += 1
+            else:
+                self.misses += 1
+                return None, None, None
+            self.stamp[slot] = self.tick()
+            result, path = self.decode(self.solutions[slot])
+        return kind, result, path
+
+    def flush(self):
+        for array in (self.features, self.cells, self.profile, self.stamp, self.solutions):
+            array.flush()
+
+
+_stores = {}
+
+
+def open_store(path, **kwargs):
+    # one store object per directory and process
+    if path not in _stores:
+        _stores[path] = store(path, **kwargs)
+    return _stores[path]
+
+
+def fill(path, k, count=100):
+    # the self-check's writer: count solutions into the store at path, every one filled with its x0[0] offset
+    from GFOLD_run import test_vessel
+    opener = store(path, capacity=16)
+    for i in range(count):
+        marker = float(1000 * k + i)
+        solution = (marker, np.full((6, 80), marker), np.full((3, 80), marker)) + (np.full(80, marker),) * 3
+        opener.put(dict(test_vessel, x0=test_vessel['x0'] + (marker, 0, 0, 0, 0, 0)), solution, solution)
+        opener.lookup(test_vessel)
+
+
+if __name__ == '__main__':
+    import io
+    import time
+    import shutil
+    import tempfile
+    import contextlib
+    from GFOLD_run import solver, test_vessel
+
+    directory = tempfile.mkdtemp()
+    try:
+        cache = store(directory, capacity=64)
+        rng = np.random.default_rng(0)
+        solve_time = []
+        lookup_time = []
+        # repeat landings at one pad: initial states scattered a little around the test vessel's
+        for i in range(60):
+            x0 = test_vessel['x0'] + np.round(rng.normal(0, 1, 6) * (6, 6, 6, 1, 1, 1))
+            v_data = dict(test_vessel, x0=x0)
+            gfold = solver(v_data, engine='sparse')
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = gfold.solve_direct(cache=cache)
+            elapsed = time.perf_counter() - start
+            (lookup_time if gfold.cache_hit == 'hit' else solve_time).append(elapsed)
+        print('%d hits, %d warm starts, %d misses, %d stored' % (cache.hits, cache.warms, cache.misses, len(cache)))
+        print('hit %.2fms, solve %.2fms (median)' % (np.median(lookup_time) * 1000, np.median(solve_time) * 1000))
+        # persistent: a new store on the same directory sees the same solutions
+        reopened = store(directory, capacity=64)
+        kind, result, path = reopened.lookup(test_vessel)
+        assert len(reopened) == len(cache) and kind is not None
+        # another profile never matches
+        assert reopened.lookup(dict(test_vessel, Isp=300))[0] is None
+        # another layout is refused, the stored solutions are kept
+        try:
+            store(directory, capacity=32)
+            raise AssertionError('store reopened with another layout')
+        except ValueError:
+            assert len(store(directory, capacity=64)) == len(cache)
+
+        # several openers filling one small store at once, as GFOLD_batch's workers do: every row stays
+        # whole and belongs to its features, and the use stamps stay unique
+        from concurrent.futures import ProcessPoolExecutor
+        shared = os.path.join(directory, 'shared')
+        store(shared, capacity=16)
+        with ProcessPoolExecutor(4) as pool:
+            list(pool.map(fill, [shared] * 4, range(4)))
+        filled = store(shared, capacity=16)
+        assert len(filled) == 16 and len(set(filled.stamp.tolist())) == 16
+        for slot in range(16):
+            marker = filled.features[slot, 0] - test_vessel['x0'][0]
+            assert np.all(filled.solutions[slot] == marker), 'torn row'
+        print('concurrent puts: 400 into 16 slots, rows whole, stamps unique')
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,334 @@
+import numpy as np
+
+''' Guidance and attitude kernel
+
+ The per-tick math of demo3_gfold.run, for a batch of vessels at once: the
+ gfold tracking law (path samples plus position / velocity feedback, clamped
+ to the thrust cone), the final descent law, and the pitch / yaw PIDs and roll
+ damping on the target direction in the vessel frame.
+
+ controller allocates everything once for size vessels. The caller writes the
+ tick's values into controller.state (one row per vessel: nav mode, telemetry,
+ the follower's samples for vessels in gfold mode), step() fills
+ controller.commands and returns it. The arrays are reused every tick; copy
+ what has to outlive it.
+
+ Where demo3_gfold built rotation matrices, inverted them, and measured angles
+ with cross products and normalizations, the kernel uses closed forms: the
+ rotation matrix is a fixed linear map of the quaternion's pairwise products
+ (one matrix product for the batch), its transpose is the inverse, and the
+ angles of the target direction t (vessel frame) about the vessel's x / z axes
+ are -atan2(t_z, t_y) and atan2(t_x, t_y). Only the nav modes present in the
+ batch are computed. The PIDs follow simple_pid (differential on error, no
+ output limits, sample_time 0.01s, no derivative on the first update), per
+ vessel.
+
+'''
+
+NAV_MODES = ('none', 'gfold', 'final')
+NONE, GFOLD, FINAL = range(3)
+SAMPLE_TIME = 0.01  # simple_pid's default
+
+
+class states:
+    # the inputs of one tick, one row per vessel
+    def __init__(self, size):
+        self.mode = np.zeros(size, dtype=np.int8)  # index in NAV_MODES
+        self.error = np.zeros((size, 3))  # position in the target frame
+        self.vel = np.zeros((size, 3))
+        self.avel = np.zeros((size, 3))  # surface frame
+        self.rotation = np.zeros((size, 4))  # quaternion (x, y, z, w), surface frame
+        self.rotation[:, 3] = 1.0
+        self.mass = np.ones(size)
+        self.max_thrust = np.ones(size)
+        self.dt = np.full(size, 0.02)  # game time since the last tick
+        self.n_i = np.zeros(size)  # path index, gfold mode
+        self.x_i = np.zeros((size, 3))  # follower samples at n_i
+        self.v_i = np.zeros((size, 3))
+        self.u_i = np.zeros((size, 3))
+        self.x_i_ = np.zeros((size, 3))  # ... and ahead of it
+        self.v_i_ = np.zeros((size, 3))
+        self.u_i_ = np.zeros((size, 3))
+
+
+class commands:
+    # the outputs of one tick
+    def __init__(self, size):
+        self.throttle = np.zeros(size)  # NaN: leave the throttle as it is
+        self.pitch = np.zeros(size)
+        self.yaw = np.zeros(size)
+        self.roll = np.zeros(size)
+        self.target_direction = np.zeros((size, 3))  # target frame
+        self.target_a = np.zeros((size, 3))  # gfold mode, after the clamp
+        self.target_a_ = np.zeros((size, 3))
+
+
+def conic_clamp(target, min_mag, max_mag, max_t, out=None):
+    # rows of target clamped to magnitudes [min_mag, max_mag] and at most max_t from vertical
+    out = np.empty_like(target) if out is None else out
+    a_hor = np.sqrt(target[:, 1] * target[:, 1] + target[:, 2] * target[:, 2])
+    sin_t, cos_t, tan_t = np.sin(max_t), np.cos(max_t), np.tan(max_t)
+    a_ver_min = np.where(a_hor < min_mag * sin_t, np.sqrt(np.maximum(min_mag * min_mag - a_hor * a_hor, 0)), cos_t * min_mag)
+    a_ver_max = np.where(a_hor < max_mag * sin_t, np.sqrt(np.maximum(max_mag * max_mag - a_hor * a_hor, 0)), cos_t * max_mag)
+    out[:, 0] = np.minimum(np.maximum(target[:, 0], a_ver_min), a_ver_max)
+    scale = np.minimum(a_hor, out[:, 0] * tan_t) / a_hor
+    scale[a_hor == 0] = 0.0
+    np.multiply(target[:, 1:3], scale[:, np.newaxis], out=out[:, 1:3])
+    return out
+
+
+# demo3_gfold.rotation_mat as a linear map of the quaternion's products q_i q_j (x, y, z, w)
+QUATERNION_PRODUCTS = np.zeros((16, 9))
+for (i, j, entry), weight in {(1, 1, 0): -2, (2, 2, 0): -2, (0, 1, 1): 2, (3, 2, 1): 2, (0, 2, 2): 2, (3, 1, 2): -2,
+                              (0, 1, 3): 2, (3, 2, 3): -2, (0, 0, 4): -2, (2, 2, 4): -2, (1, 2, 5): 2, (3, 0, 5): 2,
+                              (0, 2, 6): 2, (3, 1, 6): 2, (1, 2, 7): 2, (3, 0, 7): -2, (0, 0, 8): -2, (1, 1, 8): -2}.items():
+    QUATERNION_PRODUCTS[4 * i + j, entry] = weight
+IDENTITY = np.eye(3).reshape(9)
+
+
+class controller:
+    def __init__(self, params, size=1):
+        deg2rad = np.pi / 180
+        self.size = size
+        self.g0 = params['g0']
+        self.max_tilt = params['max_tilt'] * deg2rad
+        self.throttle_limit_ctrl = params['throttle_limit_ctrl']
+        self.k_x, self.k_v = params['k_x'], params['k_v']
+        self.final_throttle, self.final_kp = params['final_throttle'], params['final_kp']
+        self.kp, self.ki, self.kd = params['ctrl_xz_rot.kp'], params['ctrl_xz_rot.ki'], params['ctrl_xz_rot.kd']
+        self.roll_kp = params['ctrl_y_avel_kp']
+        self.state = states(size)
+        self.commands = commands(size)
+        # pitch / yaw PID memory per vessel
+        self.integral = np.zeros((size, 2))
+        self.last_error = np.zeros((size, 2))
+        self.last_output = np.zeros((size, 2))
+        self.primed = np.zeros(size, dtype=bool)
+        # scratch
+        self.products = np.zeros((size, 4, 4))
+        self.rot = np.zeros((size, 9))
+        self.local = np.zeros((size, 3))
+        self.feedback = np.zeros((size, 3))
+        self.target = np.zeros((size, 3))
+        self.target_ = np.zeros((size, 3))
+        self.direction = np.zeros((size, 3))
+        self.error = np.zeros((size, 2))
+        self.output = np.zeros((size, 2))
+
+    def reset(self, vessels=slice(None)):
+        # forget the PID memory (a vessel replaced in the batch)
+        self.integral[vessels] = 0.0
+        self.last_error[vessels] = 0.0
+        self.last_output[vessels] = 0.0
+        self.primed[vessels] = False
+
+    def step(self, state=None):
+        self.guidance(state)
+        return self.attitude(state)
+
+    def guidance(self, state=None):
+        # target direction and throttle per vessel; only the modes present are computed
+        s = self.state if state is None else state
+        c = self.commands
+        acc = s.max_thrust / s.mass
+        gfold = s.mode == GFOLD
+        final = s.mode == FINAL
+        none = s.mode == NONE
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if gfold.any():
+                self.track(s, c, acc)
+            if not gfold.all():
+                c.target_a[~gfold] = np.nan
+                c.target_a_[~gfold] = np.nan
+            if final.any():
+                self.descend(s, c, acc, final)
+            if none.any():
+                c.target_direction[none] = -s.vel[none]
+                c.throttle[none] = 0.0
+        return c
+
+    def track(self, s, c, acc):
+        # gfold mode: the path samples plus position / velocity feedback, clamped to the thrust cone (all rows)
+        low, high = self.throttle_limit_ctrl
+        np.subtract(s.x_i, s.error, out=self.feedback)
+        self.feedback *= self.k_x
+        np.subtract(s.v_i, s.vel, out=self.target)
+        self.target *= self.k_v
+        self.target += s.u_i
+        self.target += self.feedback
+        np.subtract(s.v_i_, s.vel, out=self.target_)
+        self.target_ *= self.k_v
+        self.target_ += s.u_i_
+        self.target_ += self.feedback
+        conic_clamp(self.target, low * acc, high * acc, self.max_tilt, out=c.target_a)
+        conic_clamp(self.target_, low * acc, high * acc, self.max_tilt, out=c.target_a_)
+        before = s.n_i < 0
+        if before.any():
+            c.target_a[before] = s.u_i[before]
+            c.target_a[before, 0] += self.g0
+        np.divide(c.target_a_, np.sqrt(np.einsum('ij,ij->i', c.target_a_, c.target_a_))[:, np.newaxis], out=c.target_direction)
+        np.divide(np.sqrt(np.einsum('ij,ij->i', c.target_a, c.target_a)), acc, out=c.throttle)
+        c.throttle[s.n_i <= 0] = np.nan
+
+    def descend(self, s, c, acc, rows):
+        # final mode: vertical speed on an estimated stopping height, horizontal pd on the target
+        low, high = self.throttle_limit_ctrl
+        max_acc = high * acc - self.g0
+        max_acc_low = high * self.final_throttle * acc - self.g0
+        vel_sq = s.vel[:, 0] * s.vel[:, 0]
+        est_h = s.error[:, 0] - vel_sq / (2 * max_acc)
+        est_h_low = s.error[:, 0] - vel_sq / (2 * max_acc_low)
+        t = -est_h_low / (est_h - est_h_low) * (1 + self.final_kp)
+        throttle = np.minimum(np.maximum(t * high + (1 - t) * (high * self.final_throttle), low), high)
+        d = self.direction
+        d[:, 0] = 1.0
+        np.multiply(s.error[:, 1:3], -0.03, out=d[:, 1:3])
+        d[:, 1:3] -= s.vel[:, 1:3] * 0.06
+        d /= np.sqrt(np.einsum('ij,ij->i', d, d))[:, np.newaxis]
+        conic_clamp(d, 1.0, 1.0, self.max_tilt, out=d)
+        c.target_direction[rows] = d[rows]
+        c.throttle[rows] = throttle[rows]
+
+    def attitude(self, state=None):
+        # pitch / yaw PIDs on the target direction in the vessel frame, roll damping
+        s = self.state if state is None else state
+        c = self.commands
+        np.multiply(s.rotation[:, :, np.newaxis], s.rotation[:, np.newaxis, :], out=self.products)
+        np.matmul(self.products.reshape(-1, 16), QUATERNION_PRODUCTS, out=self.rot)
+        self.rot += IDENTITY
+        r = self.rot.reshape(-1, 3, 3)  # vessel to surface; its transpose is the inverse
+        np.einsum('ijk,ik->ij', r, c.target_direction, out=self.local)
+        # angles about the vessel's x and z axes from its y axis; simple_pid error = setpoint 0 - angle
+        e = self.error
+        np.arctan2(self.local[:, 2], self.local[:, 1], out=e[:, 0])
+        np.arctan2(self.local[:, 0], self.local[:, 1], out=e[:, 1])
+        np.negative(e[:, 1], out=e[:, 1])
+
+        dt = s.dt[:, np.newaxis]
+        update = ~self.primed | (s.dt >= SAMPLE_TIME)
+        o = self.output
+        np.subtract(e, self.last_error, out=o)
+        o[~self.primed] = 0.0
+        o *= self.kd
+        o /= dt
+        o += self.kp * e
+        if update.all():
+            self.integral += self.ki * e * dt
+            o += self.integral
+            self.last_output[:] = o
+            self.last_error[:] = e
+        else:
+            self.integral[update] += (self.ki * e * dt)[update]
+            o += self.integral
+            self.last_output[update] = o[update]
+            self.last_error[update] = e[update]
+        self.primed |= update
+        np.negative(np.minimum(np.maximum(self.last_output[:, 0], -1), 1), out=c.pitch)
+        np.negative(np.minimum(np.maximum(self.last_output[:, 1], -1), 1), out=c.yaw)
+        np.multiply(np.einsum('ij,ij->i', r[:, 1], s.avel), self.roll_kp, out=c.roll)
+        np.minimum(np.maximum(c.roll, -1, out=c.roll), 1, out=c.roll)
+        return c
+
+
+if __name__ == '__main__':
+    import time
+    import simple_pid
+    import demo3_gfold
+    from demo3_gfold import load_params, conic_clamp as conic_clamp_1, rotation_mat, angle_around_axis, form_v3
+
+    params = load_params()
+    rng = np.random.default_rng(0)
+    size = 1000
+    kernel = controller(params, size)
+    s = kernel.state
+    s.mode[:] = rng.integers(0, 3, size)
+    s.error[:] = rng.normal(0, 1, (size, 3)) * (300, 100, 100)
+    s.error[:, 0] = np.abs(s.error[:, 0])
+    s.vel[:] = rng.normal(0, 1, (size, 3)) * (30, 10, 10)
+    s.avel[:] = rng.normal(0, 0.1, (size, 3))
+    q = rng.normal(0, 1, (size, 4))
+    s.rotation[:] = q / np.linalg.norm(q, axis=1)[:, np.newaxis]
+    s.mass[:] = 9000 + rng.normal(0, 500, size)
+    s.max_thrust[:] = 300e3
+    s.n_i[:] = rng.uniform(-2, 70, size)
+    for name in ('x_i', 'x_i_'):
+        getattr(s, name)[:] = s.error + rng.normal(0, 5, (size, 3))
+    for name in ('v_i', 'v_i_'):
+        getattr(s, name)[:] = s.vel + rng.normal(0, 2, (size, 3))
+    for name in ('u_i', 'u_i_'):
+        getattr(s, name)[:] = (15, 0, 0) + rng.normal(0, 2, (size, 3))
+
+    # the per-tick math of demo3_gfold, one vessel at a time, as the loop did it
+    deg2rad = np.pi / 180
+    max_tilt = params['max_tilt'] * deg2rad
+    low, high = params['throttle_limit_ctrl']
+    g0, k_x, k_v = params['g0'], params['k_x'], params['k_v']
+
+    def reference(i, pids):
+        error, vel, mass, max_thrust = s.error[i], s.vel[i], s.mass[i], s.max_thrust[i]
+        throttle = None
+        if s.mode[i] == GFOLD:
+            target_a = s.u_i[i] + (s.v_i[i] - vel) * k_v + (s.x_i[i] - error) * k_x
+            target_a_ = s.u_i_[i] + (s.v_i_[i] - vel) * k_v + (s.x_i[i] - error) * k_x
+            target_a = conic_clamp_1(target_a, low * (max_thrust / mass), high * (max_thrust / mass), max_tilt)
+            target_a_ = conic_clamp_1(target_a_, low * (max_thrust / mass), high * (max_thrust / mass), max_tilt)
+            if s.n_i[i] < 0:
+                target_a = np.array([g0, 0, 0]) + s.u_i[i]
+            target_direction = target_a_ / np.linalg.norm(target_a_)
+            if s.n_i[i] > 0:
+                throttle = np.linalg.norm(target_a) / (max_thrust / mass)
+        elif s.mode[i] == FINAL:
+            max_acc = high * (max_thrust / mass) - g0
+            max_acc_low = high * params['final_throttle'] * (max_thrust / mass) - g0
+            est_h = error[0] - vel[0] ** 2 / (2 * max_acc)
+            est_h_low = error[0] - vel[0] ** 2 / (2 * max_acc_low)
+            throttle = np.clip(demo3_gfold.lerp(high * params['final_throttle'], high, -est_h_low / (est_h - est_h_low) * (1 + params['final_kp'])), low, high)
+            target_direction = -form_v3(0, error[1], error[2]) * 0.03 - form_v3(0, vel[1], vel[2]) * 0.06 + form_v3(1, 0, 0)
+            target_direction /= np.linalg.norm(target_direction)
+            target_direction = conic_clamp_1(target_direction, 1, 1, max_tilt)
+        else:
+            target_direction = -vel
+            throttle = 0.0
+        rotation_srf2local = np.linalg.inv(rotation_mat(s.rotation[i]))
+        local = target_direction @ rotation_srf2local
+        avel_local = s.avel[i] @ rotation_srf2local
+        pitch = -np.clip(pids[0](angle_around_axis(local, form_v3(0, 1, 0), form_v3(1, 0, 0)), s.dt[i]), -1, 1)
+        yaw = -np.clip(pids[1](angle_around_axis(local, form_v3(0, 1, 0), form_v3(0, 0, 1)), s.dt[i]), -1, 1)
+        roll = np.clip(avel_local[1] * params['ctrl_y_avel_kp'], -1, 1)
+        return throttle, pitch, yaw, roll
+
+    def pid():
+        return simple_pid.PID(Kp=params['ctrl_xz_rot.kp'], Kd=params['ctrl_xz_rot.kd'], Ki=params['ctrl_xz_rot.ki'], differential_on_measurement=False)
+
+    pids = [(pid(), pid()) for i in range(size)]
+    worst = 0.0
+    for tick in range(3):  # a few ticks, so the PID memory is compared too
+        c = kernel.step()
+        for i in range(size):
+            throttle, pitch, yaw, roll = reference(i, pids[i])
+            assert (throttle is None) == np.isnan(c.throttle[i])
+            got = (c.pitch[i], c.yaw[i], c.roll[i]) + (() if throttle is None else (c.throttle[i],))
+            want = (pitch, yaw, roll) + (() if throttle is None else (throttle,))
+            worst = max(worst, np.max(np.abs(np.subtract(got, want))))
+        s.error += s.vel * 0.02
+    print('kernel against the loop\'s math: %d vessels x 3 ticks, largest difference %.2e' % (size, worst))
+    assert worst < 1e-9
+
+    # per tick cost: the loop's math for one vessel, the kernel for one, the kernel per vessel of a batch
+    start = time.perf_counter()
+    for k in range(200):
+        reference(k % size, pids[k % size])
+    one_by_one = (time.perf_counter() - start) / 200
+    single = controller(params, 1)
+    for name in vars(single.state):
+        getattr(single.state, name)[:] = getattr(s, name)[:1]
+    start = time.perf_counter()
+    for k in range(2000):
+        single.step()
+    kernel_one = (time.perf_counter() - start) / 2000
+    start = time.perf_counter()
+    for k in range(50):
+        kernel.step()
+    kernel_batch = (time.perf_counter() - start) / 50
+    print('per tick: loop math %.1fus, kernel %.1fus; batch of %d: %.1fus per call, %.2fus per vessel' % (
+        one_by_one * 1e6, kernel_one * 1e6, size, kernel_batch * 1e6, kernel_batch / size * 1e6))
@@ -1,5 +1,8 @@
+import time
 import numpy as np
 from cvxpy import *
+import GFOLD_backend as backends
+import GFOLD_trace
 
 ''' As defined in the paper...
 
@@ -23,34 +26,54 @@ from cvxpy import *
 '''
 
 
-def GFOLD_direct(N, pmark, packed_data):  # PRIMARY GFOLD SOLVER
+# compiled problems, keyed by (N, program); cvxpy only canonicalizes each one once (DPP)
+problem_cache = {}
 
-    program = 3  # default
-    if pmark == 'p3':
-        program = 3
-    elif pmark == 'p4':
-        program = 4
 
-    x0, z0_term_inv, z0_term_log, g, sparse_params = packed_data
-    alpha_dt, G_max, V_max, y_gs_cot, p_cs_cos, m_wet_log, r1, r2, tf_, straight_fac = sparse_params
+class cached_problem:
+    def __init__(self, problem, x, u, z, s, params):
+        self.problem = problem
+        self.x = x
+        self.u = u
+        self.z = z
+        self.s = s
+        self.params = params
+        self.size = None  # GFOLD_trace.problem_size, filled in on the first traced solve
 
-    dt = tf_ * (1 / N)  # Integration dt
-
-    print('N = ', N)
 
+def build_problem(N, program):
+    # every value that changes between solves is a Parameter, so the problem stays DPP
+    # and the compiled form is reused; products of two parameters are precomputed in set_params
     x = Variable([6, N], name='var_x')  # state vector (3position,3velocity)
     u = Variable([3, N], name='var_u')  # u = Tc/mass because Tc[:,n]/m[n] is not allowed by DCP
     z = Variable(N, name='var_z')  # z = ln(mass)
     s = Variable(N, name='var_s')  # thrust slack parameter
 
+    params = {
+        'x0': Parameter(6, name='x0'),
+        'dt_g': Parameter((3, N - 1), name='dt_g'),  # dt * g, per interval
+        'half_dt': Parameter(N - 1, nonneg=True, name='half_dt'),  # dt * 0.5, per interval
+        'half_alpha_dt': Parameter(N - 1, nonneg=True, name='half_alpha_dt'),  # alpha * dt * 0.5, per interval
+        'z0_term_log': Parameter(N, name='z0_term_log'),
+        'mu_1_inv': Parameter(N, pos=True, name='mu_1_inv'),  # 1 / (r1 * z0_term_inv)
+        'mu_2_inv': Parameter(N, pos=True, name='mu_2_inv'),  # 1 / (r2 * z0_term_inv)
+        'm_wet_log': Parameter(name='m_wet_log'),
+        'V_max': Parameter(nonneg=True, name='V_max'),
+        'y_gs_cot': Parameter(nonneg=True, name='y_gs_cot'),
+        'p_cs_cos': Parameter(name='p_cs_cos'),
+        'weights': Parameter(N, nonneg=True, name='weights'),  # objective weight of every node
+        'straight_weights': Parameter(N, nonneg=True, name='straight_weights'),  # straight_fac * weights
+    }
+    p = params
+
     con = []  # CONSTRAINTS LIST
-    con += [x[:, 0] == x0]  # initial pos and vel
+    con += [x[:, 0] == p['x0']]  # initial pos and vel
     con += [x[3:6, N - 1] == np.array([0, 0, 0])]  # don't forget to slow down, buddy!
 
     con += [s[N - 1] == 0]  # thrust at the end must be zero
     con += [u[:, 0] == s[0] * np.array([1, 0, 0])]  # thrust direction starts straight
     con += [u[:, N - 1] == s[N - 1] * np.array([1, 0, 0])]  # and ends straight
-    con += [z[0] == m_wet_log]  # convexified (7)
+    con += [z[0] == p['m_wet_log']]  # convexified (7)
 
     if program == 3:
         con += [x[0, N - 1] == 0]
@@ -58,75 +81,207 @@ def GFOLD_direct(N, pmark, packed_data):  # PRIMARY GFOLD SOLVER
     elif program == 4:
         con += [x[0:3, N - 1] == np.array([0, 0, 0])]  # force landing point equal to O
 
-    for n in range(0, N - 1):
+    # the whole horizon is written as a handful of sliced constraints instead of a loop over
+    # nodes, so the expression tree (and the DPP tensor) does not grow with N
+    a = slice(0, N - 1)  # node n
+    b = slice(1, N)  # node n + 1
+    c = slice(1, N - 1)  # nodes with thrust bounds
 
-        con += [x[3:6, n + 1] == x[3:6, n] + (dt * 0.5) * ((u[:, n] + g) + (u[:, n + 1] + g))]
-        con += [x[0:3, n + 1] == x[0:3, n] + (dt * 0.5) * (x[3:6, n + 1] + x[3:6, n])]
+    half_dt = reshape(p['half_dt'], (1, N - 1), order='F')  # broadcast over the rows
+    con += [x[3:6, b] == x[3:6, a] + multiply(half_dt, u[:, a] + u[:, b]) + p['dt_g']]
+    con += [x[0:3, b] == x[0:3, a] + multiply(half_dt, x[3:6, b] + x[3:6, a])]
 
-        # glideslope cone
-        con += [norm((x[0:3, n])[1:3]) - y_gs_cot * (x[0, n]) <= 0]
+    # glideslope cone
+    con += [norm(x[1:3, a], axis=0) - p['y_gs_cot'] * x[0, a] <= 0]
 
-        con += [norm(x[3:6, n]) <= V_max]  # velocity
-        # con += [norm(u[:,n+1]-u[:,n]) <= dt*T_max/m_dry * 3]
-        con += [z[n + 1] == z[n] - (alpha_dt * 0.5) * (s[n] + s[n + 1])]  # mass decreases
-        con += [norm(u[:, n]) <= s[n]]  # limit thrust magnitude & also therefore, mass
+    con += [norm(x[3:6, a], axis=0) <= p['V_max']]  # velocity
+    # con += [norm(u[:,n+1]-u[:,n]) <= dt*T_max/m_dry * 3]
+    con += [z[b] == z[a] - multiply(p['half_alpha_dt'], s[a] + s[b])]  # mass decreases
+    con += [norm(u[:, a], axis=0) <= s[a]]  # limit thrust magnitude & also therefore, mass
 
-        # Thrust pointing constraint
-        con += [u[0, n] >= p_cs_cos * s[n]]
+    # Thrust pointing constraint
+    con += [u[0, a] >= p['p_cs_cos'] * s[a]]
+
+    # https://www.desmos.com/calculator/wtcfgnepe1
+    # s >= mu_1 * (...) and s <= mu_2 * (...), divided through by mu so they stay DPP
+    dz = z[c] - p['z0_term_log'][c]
+    con += [multiply(p['mu_1_inv'][c], s[c]) >= 1 - dz + square(dz) * 0.5]  # lower thrust bound
+    con += [multiply(p['mu_2_inv'][c], s[c]) <= 1 - dz]  # upper thrust bound
+
+    # con += [x[0,0:N-1] >= 0] # no
+
+    if program == 3:
+        # objective=Minimize(norm(x[0:3,N-1]-rf))
+        expression = norm(x[0:3, :], axis=0) @ p['weights']  # - rf[0:3,0]
+    else:
+        # objective=Maximize(z[0,N-1])
+        expression = norm(x[4:6, :], axis=0) @ p['straight_weights']
+        expression += -z[N - 1] * N
+    problem = Problem(Minimize(expression), con)
+    return cached_problem(problem, x, u, z, s, params)
+
+
+def get_problem(N, program):
+    key = (N, program)
+    if key not in problem_cache:
+        problem_cache[key] = build_problem(N, program)
+    return problem_cache[key]
+
+
+def build_problem_loop(N, program, packed_data):
+    # the original node-by-node formulation with the data baked in as constants; only used
+    # by check_vectorized to make sure build_problem still solves the same problem (uniform grid)
+    x0, z0_term_inv, z0_term_log, g, sparse_params, t = packed_data
+    alpha_dt, G_max, V_max, y_gs_cot, p_cs_cos, m_wet_log, r1, r2, tf_, straight_fac = sparse_params[:, 0]
+
+    dt = tf_ * (1 / N)  # Integration dt
 
+    x = Variable([6, N], name='var_x')
+    u = Variable([3, N], name='var_u')
+    z = Variable(N, name='var_z')
+    s = Variable(N, name='var_s')
+
+    con = []
+    con += [x[:, 0] == x0]
+    con += [x[3:6, N - 1] == np.array([0, 0, 0])]
+    con += [s[N - 1] == 0]
+    con += [u[:, 0] == s[0] * np.array([1, 0, 0])]
+    con += [u[:, N - 1] == s[N - 1] * np.array([1, 0, 0])]
+    con += [z[0] == m_wet_log]
+
+    if program == 3:
+        con += [x[0, N - 1] == 0]
+    elif program == 4:
+        con += [x[0:3, N - 1] == np.array([0, 0, 0])]
+
+    for n in range(0, N - 1):
+        con += [x[3:6, n + 1] == x[3:6, n] + (dt * 0.5) * ((u[:, n] + g) + (u[:, n + 1] + g))]
+        con += [x[0:3, n + 1] == x[0:3, n] + (dt * 0.5) * (x[3:6, n + 1] + x[3:6, n])]
+        con += [norm((x[0:3, n])[1:3]) - y_gs_cot * (x[0, n]) <= 0]
+        con += [norm(x[3:6, n]) <= V_max]
+        con += [z[n + 1] == z[n] - (alpha_dt * 0.5) * (s[n] + s[n + 1])]
+        con += [norm(u[:, n]) <= s[n]]
+        con += [u[0, n] >= p_cs_cos * s[n]]
         if n > 0:
             z0 = z0_term_log[n]
             mu_1 = r1 * (z0_term_inv[n])
             mu_2 = r2 * (z0_term_inv[n])
+            con += [s[n] >= mu_1 * (1 - (z[n] - z0) + (z[n] - z0) ** 2 * 0.5)]
+            con += [s[n] <= mu_2 * (1 - (z[n] - z0))]
 
-            # https://www.desmos.com/calculator/wtcfgnepe1
-            con += [s[n] >= mu_1 * (1 - (z[n] - z0) + (z[n] - z0) ** 2 * 0.5)]  # lower thrust bound
-            con += [s[n] <= mu_2 * (1 - (z[n] - z0))]  # upper thrust bound
-
-    # con += [x[0,0:N-1] >= 0] # no
-
+    expression = 0
     if program == 3:
-        print('-----------------------------')
-        # objective=Minimize(norm(x[0:3,N-1]-rf))
-        expression = 0
         for i in range(N):
-            expression += norm(x[0:3, i]) * (i / N)  # - rf[0:3,0]
-        objective = Minimize(expression)
-        problem = Problem(objective, con)
-        print('solving p3')
-        obj_opt = problem.solve(solver=MOSEK, verbose=True)#, feastol=5e-20)  # solver=SCS,max_iters=5000,verbose=True,use_indirect=False)
-        # print(x.value)
-        print('-----------------------------')
-        # print(z.value)
-    elif program == 4:
-        print('-----------------------------')
-        # objective=Maximize(z[0,N-1])
-        expression = 0
+            expression += norm(x[0:3, i]) * (i / N)
+    else:
         for i in range(N):
-            expression += norm(x[4:6, i]) * (i / N)  # - rf[0:3,0]
+            expression += norm(x[4:6, i]) * (i / N)
         expression *= straight_fac
         expression += -z[N - 1] * N
-        objective = Minimize(expression)
-        problem = Problem(objective, con)
-        print('solving p4')
-        obj_opt = problem.solve(solver=MOSEK, verbose=True)  # solver=SCS,max_iters=5000,verbose=True,use_indirect=False,warm_start=True # OK to warm start b/c p1 gave us a decent answer probably
-        print('-----------------------------')
+    return cached_problem(Problem(Minimize(expression), con), x, u, z, s, {})
 
-    if program == 3:
-        # return obj_opt,(N/dt),x[0:3,N-1]
-        if z.value is not None:
-            # m     = map(np.exp,z.value.tolist()[0]) # make a mass iterable fm z
-            # m = np.array([np.exp(v) for v in z.value[0,:]])
-            m = np.exp(z.value)
-            return obj_opt, x.value, u.value, m, s.value, z.value  # N/dt is tf
-        else:
-            return None, None, None, None, None, None  #
-    elif program == 4:
-        if z.value is not None:
-            # m     = map(np.exp,z.value.tolist()[0]) # make a mass iterable fm z
-            # print(np.exp(z.value))
-            # m = np.array([np.exp(v) for v in z.value[0,:]])
-            m = np.exp(z.value)
-            return obj_opt, x.value, u.value, m, s.value, z.value  # N/dt is tf
-        else:
-            return None, None, None, None, None, None
+
+def node_weights(t, tf_):
+    # objective weight of every node: its time t / tf times its share of the horizon, relative
+    # to a uniform grid (n / N on a uniform grid of N nodes over tf)
+    dts = np.diff(t)
+    share = np.concatenate((dts[:1], dts)) + np.concatenate((dts, dts[-1:]))
+    return t / tf_ * share * 0.5 / (tf_ / len(t))
+
+
+def param_values(N, packed_data):
+    # packed_data (solver.pack_data) -> values of the problem Parameters, by name
+    x0, z0_term_inv, z0_term_log, g, sparse_params, t = packed_data
+    alpha_dt, G_max, V_max, y_gs_cot, p_cs_cos, m_wet_log, r1, r2, tf_, straight_fac = sparse_params[:, 0]
+
+    dts = np.diff(t)  # Integration dt of every interval
+    weights = node_weights(t, tf_)
+
+    return {
+        'x0': x0,
+        'dt_g': np.outer(g, dts),
+        'half_dt': dts * 0.5,
+        'half_alpha_dt': alpha_dt * 0.5 * dts / (tf_ / N),
+        'z0_term_log': z0_term_log,
+        'mu_1_inv': 1 / (r1 * z0_term_inv),
+        'mu_2_inv': 1 / (r2 * z0_term_inv),
+        'm_wet_log': m_wet_log,
+        'V_max': V_max,
+        'y_gs_cot': y_gs_cot,
+        'p_cs_cos': p_cs_cos,
+        'weights': weights,
+        'straight_weights': straight_fac * weights,
+    }
+
+
+def set_params(cached, N, packed_data):
+    for name, value in param_values(N, packed_data).items():
+        cached.params[name].value = value
+
+
+def GFOLD_direct(N, pmark, packed_data, backend='auto', verbose=False, warm=None, trace=None):  # PRIMARY GFOLD SOLVER
+    # warm: optional (x, u, z, s) guess on this N grid, e.g. from solver.resample_path
+    # trace: GFOLD_trace.trace to record the phases in (solver.solve_direct passes its own)
+
+    program = 3  # default
+    if pmark == 'p3':
+        program = 3
+    elif pmark == 'p4':
+        program = 4
+
+    trace = trace or GFOLD_trace.trace('GFOLD_direct')
+    with trace.phase('p%d' % program, N=N, engine='cvxpy') as info:
+        with trace.phase('set_params'):
+            cached = get_problem(N, program)
+            set_params(cached, N, packed_data)
+        problem = cached.problem
+        x, u, z, s = cached.x, cached.u, cached.z, cached.s
+        if cached.size is None:
+            cached.size = GFOLD_trace.problem_size(problem)
+        info.update(cached.size)
+
+        if warm is not None:
+            x.value, u.value, z.value, s.value = warm
+
+        with trace.phase('solve', warm_start=warm is not None) as solve_info:
+            obj_opt, used = backends.solve(problem, N, backend, verbose, warm_start=warm is not None)
+            solve_info.update(GFOLD_trace.solver_stats(problem))
+        info.update(backend=used, status=problem.status, objective=obj_opt)
+
+        with trace.phase('extract'):
+            if z.value is not None:
+                # m     = map(np.exp,z.value.tolist()[0]) # make a mass iterable fm z
+                # m = np.array([np.exp(v) for v in z.value[0,:]])
+                m = np.exp(z.value)
+                return obj_opt, x.value, u.value, m, s.value, z.value  # N/dt is tf
+            else:
+                return None, None, None, None, None, None
+
+
+def check_vectorized(v_data, N, program, solver=ECOS):
+    # solve the same case with the node-by-node and the vectorized formulation and
+    # return both optima and the largest state difference
+    from GFOLD_run import solver as gfold_solver
+    packed_data = gfold_solver(v_data).pack_data(N)
+
+    start = time.time()
+    loop = build_problem_loop(N, program, packed_data)
+    loop_build = time.time() - start
+    start = time.time()
+    vec = build_problem(N, program)
+    vec_build = time.time() - start
+    set_params(vec, N, packed_data)
+
+    loop_opt = loop.problem.solve(solver=solver)
+    vec_opt = vec.problem.solve(solver=solver)
+    print('N = %d p%d: build loop %.3fs, vectorized %.3fs' % (N, program, loop_build, vec_build))
+    print('optimum loop %f, vectorized %f' % (loop_opt, vec_opt))
+    return loop_opt, vec_opt, np.max(np.abs(loop.x.value - vec.x.value))
+
+
+if __name__ == '__main__':
+    from GFOLD_run import test_vessel
+    for N, program in ((40, 3), (40, 4), (80, 3), (80, 4)):
+        loop_opt, vec_opt, x_diff = check_vectorized(test_vessel, N, program)
+        assert np.isclose(loop_opt, vec_opt, rtol=1e-6), 'vectorized formulation changed the optimum'
+        print('max |x_loop - x_vectorized| = %g' % x_diff)
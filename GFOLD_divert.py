@@ -0,0 +1,194 @@
+import time
+import threading
+import numpy as np
+import numpy.linalg as npl
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from GFOLD_batch import get_pool, discard_pool, submit, outcome, solve_item
+
+''' Divert planning
+
+ The landing target is one pad; when p3 finds no way to it there is no plan.
+ plan_divert solves a list of candidate pads at once on GFOLD_batch's process
+ pool (one solver.solve_direct per pad, the workers keep their compiled
+ problems) and ranks the ones that can be reached.
+
+ Each pad gets its own x0: the state in its own target frame, the same kind of
+ frame demo3_gfold builds for the primary target (origin at the pad, axes of
+ the vessel's surface frame, velocity relative to the body). site_states turns
+ the state in the primary target's frame into that from the pads' positions
+ in the body frame, site_position(body, lat, lon, height).
+
+ A feasible plan always ends on its pad (p4 pins the last node there, and p3,
+ its glideslope cone anchored at the pad, is infeasible rather than landing
+ beside it), so there is no landing error to rank by: a site is acceptable if
+ its plan leaves at least min_mass, and the feasible sites rank by landing mass
+ (the most left first), the acceptable ones ahead. With early_exit, the first
+ acceptable site to finish ends the search: the pads not started yet are
+ cancelled, the ones already running finish in their workers and are dropped.
+
+ diverter runs plan_divert on a thread for the control loop: request() once,
+ then take() every tick until the ranking is there. warm_up() starts the
+ workers and compiles their problems beforehand.
+
+'''
+
+
+def site_position(body, lat, lon, height):
+    # body frame position of a pad (lat, lon in degrees, height above the surface as target_height)
+    lat, lon = np.radians(lat), np.radians(lon)
+    axis = height + body.surface_height(np.degrees(lat), np.degrees(lon)) + body.equatorial_radius
+    return np.array((np.cos(lon) * np.cos(lat), np.sin(lat), np.sin(lon) * np.cos(lat))) * axis
+
+
+def surface_axes(position):
+    # rows: up, north, east at a body frame position (kRPC's surface reference frame)
+    up = position / npl.norm(position)
+    lat, lon = np.arcsin(up[1]), np.arctan2(up[2], up[0])
+    north = np.array((-np.cos(lon) * np.sin(lat), np.cos(lat), -np.sin(lon) * np.sin(lat)))
+    east = np.array((-np.sin(lon), 0.0, np.cos(lon)))
+    return np.array((up, north, east))
+
+
+def site_states(x0, target, sites):
+    # x0 (position, velocity) in the frame of the target at body position target -> x0 in the frame of every site
+    axes = surface_axes(target)
+    for _ in range(3):  # the axes are the vessel's: find where it is
+        vessel = target + axes.T @ x0[0:3]
+        axes = surface_axes(vessel)
+    return [np.concatenate((x0[0:3] + axes @ (target - site), x0[3:6])) for site in sites]
+
+
+def plan_divert(v_data, sites, names=None, min_mass=0.0, early_exit=False, workers=None,
+                backend='auto', engine='cvxpy', cache_dir=None, **options):
+    # sites: x0 of v_data for every pad (site_states); options go to solve_direct.
+    # returns {'ranked': acceptable outcomes best first then the other feasible ones,
+    #          'failed': infeasible outcomes, 'cancelled': pads never solved, 'time': wall time}
+    start = time.time()
+    names = names or ['site %d' % i for i in range(len(sites))]
+    outcomes = {}
+    for i, x0 in enumerate(sites):
+        v_data_site = dict(v_data, x0=np.asarray(x0, dtype=float))
+        future = submit(solve_item, v_data_site, backend, engine, cache_dir, options, workers=workers)
+        item = outcomes[future] = outcome(i, v_data_site, time.time())
+        item.name = names[i]
+        item.landing_mass = None
+        item.acceptable = False
+    pool = get_pool(workers)
+
+    done = []
+    pending = set(outcomes)
+    while pending:
+        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            item = outcomes[future]
+            try:
+                item.update(future.result())
+            except BrokenProcessPool as e:  # a worker died: this site is lost, the next divert gets a new pool
+                discard_pool(pool)
+                item.error = repr(e)
+            except Exception as e:  # the item could not be sent to the worker
+                item.error = repr(e)
+            if item.ok:
+                item.landing_mass = float(item.result[3][-1])
+                item.acceptable = item.landing_mass >= min_mass
+            done.append(item)
+        if early_exit and any(item.acceptable for item in done):
+            break
+    cancelled = [outcomes[future] for future in pending if future.cancel()]
+
+    feasible = [item for item in done if item.ok]
+    ranked = sorted(feasible, key=lambda item: (not item.acceptable, -item.landing_mass))
+    return {'ranked': ranked, 'failed': [item for item in done if not item.ok], 'cancelled': cancelled,
+            'time': time.time() - start}
+
+
+class diverter:
+    # plan_divert on a thread: request() starts it, take() is the ranking once it is done
+    def __init__(self, names=None, **options):
+        self.names = names
+        self.options = options  # of plan_divert
+        self.warming = None
+        self.thread = None
+        self.result = None
+
+    @property
+    def requested(self):
+        return self.thread is not None
+
+    def warm_up(self, v_data, sites):
+        # a throwaway divert from v_data, one solve per site, on the thread
+        self.warming = threading.Thread(target=plan_divert, args=(v_data, [v_data['x0']] * len(sites)),
+                                        kwargs=self.options, daemon=True)
+        self.warming.start()
+
+    def request(self, v_data, target, sites):
+        # target, sites: body frame positions; x0 of v_data is in the target's frame
+        x0s = site_states(v_data['x0'], target, sites)
+        self.thread = threading.Thread(target=self.run, args=(v_data, x0s), daemon=True)
+        self.thread.start()
+
+    def run(self, v_data, x0s):
+        if self.warming is not None:
+            self.warming.join()
+        self.result = plan_divert(v_data, x0s, self.names, **self.options)
+
+    def wait(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def take(self):
+        result, self.result = self.result, None
+        return result
+
+
+if __name__ == '__main__':
+    from GFOLD_run import solver, test_vessel
+    from GFOLD_sim import body
+
+    # a vessel 900m north of its target and flying away from it, pads around, on the sim's body
+    moon = body()
+    v_data = dict(test_vessel, x0=np.array([600, 900, 0, -80, 60, 0]))
+    target = site_position(moon, 0.0, 0.0, 0.0)
+    pads = [(0.0, 0.0, 0.0), (0.1, 0.0, 0.0), (0.13, 0.03, 0.0), (0.09, -0.03, 10.0), (0.17, 0.0, 0.0), (0.06, 0.0, 0.0), (0.1, 0.08, 0.0)]
+    names = ['target'] + ['pad %d' % i for i in range(1, len(pads))]
+    sites = site_states(v_data['x0'], target, [site_position(moon, *pad) for pad in pads])
+    for name, x0 in zip(names, sites):
+        print('%-6s x0 %s' % (name, np.round(x0[0:3], 1)))
+
+    plan_divert(v_data, sites, engine='sparse', workers=len(sites))  # start the workers and compile their problems
+    for early_exit in (False, True):
+        result = plan_divert(v_data, sites, names, early_exit=early_exit, engine='sparse', workers=len(sites))
+        print('early_exit=%s: %.2fs, %d feasible, %d infeasible, %d cancelled' % (
+            early_exit, result['time'], len(result['ranked']), len(result['failed']), len(result['cancelled'])))
+        for item in result['ranked']:
+            print('  %-6s %s landing mass %.1fkg, solved in %.3fs' % (
+                item.name, 'ok ' if item.acceptable else '-- ', item.landing_mass, item.solve_time))
+        for item in result['failed']:
+            print('  %-6s %s' % (item.name, item.error))
+    assert result['ranked'][0].acceptable and all(item.name != 'target' for item in result['ranked'])
+
+    # every pad's frame puts the vessel at the same body frame position
+    vessel = target + surface_axes(target).T @ v_data['x0'][0:3]
+    for _ in range(3):
+        vessel = target + surface_axes(vessel).T @ v_data['x0'][0:3]
+    for pad, x0 in zip(pads, sites):
+        assert npl.norm(site_position(moon, *pad) + surface_axes(vessel).T @ x0[0:3] - vessel) < 1e-6
+
+    # a flight that cannot reach its target from where planning starts (700m off, the glide slope allows ~470m)
+    import io
+    import contextlib
+    from GFOLD_sim import fly
+    from demo3_gfold import load_params
+
+    params = load_params()
+    params['solver_engine'] = 'sparse'
+    params['divert_sites'] = [(params['target_lat'] + d, params['target_lon'], params['target_height']) for d in (0.03, 0.06, 0.1, 0.15)]
+    for early_exit in (True, False):
+        params['divert_early_exit'] = early_exit
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            result = fly(params, {'x0': np.array([1400, 700, 0, -40, 0, 0])})
+        print('flight, early_exit=%s: %s' % (early_exit, next(line for line in output.getvalue().splitlines() if line.startswith('divert'))))
+        print('  landed in %s mode %.2fm from the pad, mass %.1fkg' % (result['nav_mode'], npl.norm(result['error'][1:3]), result['mass']))
+        assert result['nav_mode'] == 'final'
@@ -0,0 +1,113 @@
+import numpy as np
+
+''' kRPC debug lines
+
+ Every start / end / color assignment on a kRPC line is a remote call, and
+ they all go through the same connection as the control loop's. Drawing the
+ whole 80 node path is 2 * (2N - 1) calls per plan, and the follower's lines
+ add 6 more every tick; with debug_lines on, the flight being debugged no
+ longer had the timing of the flight without it.
+
+ debug_drawing creates its lines once: segments path segments and segments + 1
+ thrust directions at evenly spaced nodes of the plan (decimated), plus named
+ markers. set_path / set only record where the lines should be. flush sends, at
+ most rate times a second of game time and at most max_calls calls at once,
+ just the endpoints that moved more than tol since they were last sent, markers
+ first; what did not fit goes out on a later flush.
+
+'''
+
+
+class debug_drawing:
+    def __init__(self, conn, reference_frame, markers=None, segments=20, rate=10.0, tol=0.05, max_calls=40):
+        # markers: {name: color} of single lines moved with set
+        self.segments = segments
+        self.period = 1.0 / rate
+        self.tol = tol
+        self.max_calls = max_calls
+        self.lines = []
+        self.names = {}
+        for name, color in (markers or {}).items():
+            self.names[name] = self.add(conn, reference_frame, color)
+        self.path = [self.add(conn, reference_frame, (1, 1, 1)) for _ in range(segments)]
+        self.directions = [self.add(conn, reference_frame, (0, 1, 0)) for _ in range(segments + 1)]
+        self.sent = np.zeros((len(self.lines), 2, 3))  # endpoints as the game has them
+        self.wanted = np.zeros((len(self.lines), 2, 3))  # endpoints as they should be
+        self.next_flush = -np.inf
+        self.calls = 0  # remote calls made
+
+    def add(self, conn, reference_frame, color):
+        line = conn.drawing.add_line((0, 0, 0), (0, 0, 0), reference_frame)
+        line.color = color
+        self.lines.append(line)
+        return len(self.lines) - 1
+
+    def set(self, name, start, end):
+        self.wanted[self.names[name]] = (start, end)
+
+    def set_path(self, x, u, m_u):
+        # the plan's positions x and thrust accelerations u, m_u the acceleration at full thrust
+        nodes = np.linspace(0, x.shape[1] - 1, self.segments + 1).round().astype(int)
+        r = x[0:3, nodes].T
+        self.wanted[self.path, 0] = r[:-1]
+        self.wanted[self.path, 1] = r[1:]
+        self.wanted[self.directions, 0] = r
+        self.wanted[self.directions, 1] = r + u[:, nodes].T * 5 / m_u
+
+    def flush(self, ut, force=False):
+        # send what moved, rate limited unless force
+        if not force and ut < self.next_flush:
+            return 0
+        self.next_flush = ut + self.period
+        moved = np.argwhere(np.max(np.abs(self.wanted - self.sent), axis=2) > self.tol)
+        for i, end in moved[:self.max_calls]:
+            setattr(self.lines[i], ('start', 'end')[end], tuple(self.wanted[i, end]))
+            self.sent[i, end] = self.wanted[i, end]
+        self.calls += min(len(moved), self.max_calls)
+        return min(len(moved), self.max_calls)
+
+    def remove(self):
+        for line in self.lines:
+            line.remove()
+        self.lines = []
+
+
+if __name__ == '__main__':
+    import GFOLD_sim
+    from GFOLD_run import solver, test_vessel
+
+    # a vessel following a plan for 20s at 50 frames a second, a slightly different plan every second,
+    # drawn the old way and with debug_drawing
+    path = solver(test_vessel).solve_direct()
+    tf, plan, u = path[0], path[1], path[2]
+    frames = 1000
+    conn = GFOLD_sim.sim()
+    lines = [conn.drawing.add_line((0, 0, 0), (0, 0, 0), None) for i in range(plan.shape[1] - 1)]
+    directions = [conn.drawing.add_line((0, 0, 0), (1, 0, 0), None) for i in range(plan.shape[1])]
+    markers = [conn.drawing.add_line((0, 0, 0), (1, 0, 0), None) for i in range(3)]
+    conn.drawing.calls = 0
+    for k in range(frames):
+        if k % 50 == 0:
+            x = plan * (1 + k / 5e4)
+            for i in range(x.shape[1] - 1):
+                lines[i].start, lines[i].end = x[0:3, i], x[0:3, i + 1]
+            for i in range(x.shape[1]):
+                directions[i].start, directions[i].end = x[0:3, i], x[0:3, i] + u[:, i] * 5 / 20
+        n = k * x.shape[1] // frames
+        for line in markers:
+            line.start, line.end = x[0:3, n] + 0.1, x[0:3, n]
+    print('every line every tick: %d calls in %d frames' % (conn.drawing.calls, frames))
+
+    conn = GFOLD_sim.sim()
+    draw = debug_drawing(conn, None, {'target': (0, 0, 1), 'target2': (0, 0, 1), 'head': (0, 1, 1)})
+    conn.drawing.calls = 0
+    for k in range(frames):
+        if k % 50 == 0:
+            x = plan * (1 + k / 5e4)
+            draw.set_path(x, u, 20)
+        n = k * x.shape[1] // frames
+        for name in ('target', 'target2', 'head'):
+            draw.set(name, x[0:3, n] + 0.1, x[0:3, n])
+        draw.flush(k * 0.02)
+    assert draw.calls == conn.drawing.calls
+    print('debug_drawing: %d calls in %d frames, at most %d in one' % (conn.drawing.calls, frames, draw.max_calls))
@@ -0,0 +1,125 @@
+import time
+import numpy as np
+
+''' Trajectory following
+
+ follower is built once per solution. Position, velocity and thrust are cubic
+ Hermite interpolants over the node index: position uses the solved velocity as
+ its derivative, velocity and thrust use finite differences (one-sided at the
+ ends). The per-interval coefficients are precomputed, so sample() is a table
+ lookup and one cubic.
+
+ update() tracks the vessel along the path: the nearest node is searched in a
+ small window ahead of the last index, then refined by projecting the offset on
+ the path's velocity, as find_nearest_index did. The index never goes back
+ (regress, in nodes per second, allows it); that is what made the vessel climb
+ near the ground, where the nodes bunch up and an earlier node could be the
+ nearest one. If the best node is at the window's far edge or further than
+ lost metres, the whole remaining path is searched at once.
+
+ Indices are in nodes; past the last node the path is over and sample() holds a
+ hover (zero position and velocity, thrust g0 up).
+
+'''
+
+
+def hermite(p, d):
+    # per-interval coefficients of the cubic through p[:, i], p[:, i + 1] with slopes d (per node):
+    # value = c0 + c1 f + c2 f^2 + c3 f^3, f in [0, 1]; shape (N - 1, 4, dims)
+    p0, p1, d0, d1 = p[:, :-1].T, p[:, 1:].T, d[:, :-1].T, d[:, 1:].T
+    return np.stack((p0, d0, 3 * (p1 - p0) - 2 * d0 - d1, 2 * (p0 - p1) + d0 + d1), axis=1)
+
+
+def slopes(p):
+    # finite-difference derivative per node, central inside
+    return np.gradient(p, axis=1)
+
+
+class follower:
+    def __init__(self, path, g0=9.807, window=8, lost=50.0, regress=0.0):
+        self.tf, x, u = path[0], path[1], path[2]
+        self.N = x.shape[1]
+        self.dt = self.tf / self.N
+        self.g0 = g0
+        self.window = window
+        self.lost = lost
+        self.regress = regress
+        self.r = np.ascontiguousarray(x[0:3].T)  # nodes, for the nearest search
+        self.v = np.ascontiguousarray(x[3:6].T)
+        self.u1 = u[:, 1].copy()
+        self.coef_r = hermite(x[0:3], x[3:6] * self.dt)
+        self.coef_v = hermite(x[3:6], slopes(x[3:6]))
+        self.coef_u = hermite(u, slopes(u))
+        self.index = -1.0
+        self.searches = 0  # full-path fallbacks
+
+    def nearest(self, r):
+        # nearest node at or after the last index, windowed
+        first = max(int(self.index), 0)
+        last = min(first + self.window, self.N)
+        distance = np.einsum('ij,ij->i', self.r[first:last] - r, self.r[first:last] - r)
+        i = int(np.argmin(distance))
+        if (i == last - first - 1 and last < self.N) or distance[i] > self.lost ** 2:
+            self.searches += 1
+            distance = np.einsum('ij,ij->i', self.r[first:] - r, self.r[first:] - r)
+            i = int(np.argmin(distance))
+        return first + i
+
+    def update(self, r, game_delta_time=0.0):
+        # continuous path index of the vessel at r, never behind the last one (beyond regress)
+        i = self.nearest(r)
+        v = self.v[i]
+        v_norm = np.sqrt(v @ v)
+        frac = 0.0
+        if v_norm > 1e-6:
+            frac = np.clip((r - self.r[i]) @ v / v_norm / (self.dt * v_norm), -0.5, 0.5)
+        self.index = max(self.index - game_delta_time * self.regress, i + frac)
+        return self.index
+
+    def sample(self, index):
+        # (position, velocity, thrust acceleration) at a continuous index
+        if index >= self.N - 1:
+            return np.zeros(3), np.zeros(3), np.array([self.g0, 0, 0])
+        if index < 0:
+            # before the first node: extrapolate the first interval linearly
+            r = self.r[0] + (self.r[1] - self.r[0]) * index
+            v = self.v[0] + (self.v[1] - self.v[0]) * index
+            return r, v, self.u1.copy()
+        i = int(index)
+        f = index - i
+        basis = np.array((1.0, f, f * f, f * f * f))
+        return basis @ self.coef_r[i], basis @ self.coef_v[i], basis @ self.coef_u[i]
+
+    def time_to_go(self, index=None):
+        return (self.N - (self.index if index is None else index)) * self.dt
+
+
+if __name__ == '__main__':
+    import contextlib
+    import io
+    from GFOLD_run import solver, test_vessel
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        path = solver(test_vessel).solve_direct()
+    follow = follower(path)
+    tf, x, u = path[0], path[1], path[2]
+    # interpolants hit the nodes
+    for i in range(follow.N - 1):
+        r, v, a = follow.sample(float(i))
+        assert np.allclose(r, x[0:3, i]) and np.allclose(v, x[3:6, i]) and np.allclose(a, u[:, i])
+    # walk along the path with noise, then back up: the index must never decrease
+    rng = np.random.default_rng(0)
+    previous = -1.0
+    start = time.perf_counter()
+    queries = 0
+    for k in np.linspace(0, follow.N - 1.5, 400):
+        r, v, a = follow.sample(k)
+        index = follow.update(r + rng.normal(0, 0.5, 3), 0.02)
+        follow.sample(index + 1.5)
+        assert index >= previous
+        previous = index
+        queries += 1
+    for k in np.linspace(follow.N - 1.5, follow.N - 10, 20):
+        assert follow.update(follow.sample(k)[0]) >= previous
+    elapsed = (time.perf_counter() - start) / queries
+    print('%d nodes: %.1fus per update + 2 samples, %d full searches, final index %.2f' % (follow.N, elapsed * 1e6, follow.searches, previous))
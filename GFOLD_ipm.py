@@ -0,0 +1,459 @@
+import time
+import numpy as np
+import scipy.sparse as sp
+from scipy.linalg.lapack import dgbtrf, dgbtrs
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+import GFOLD_trace
+from GFOLD_sparse import get_structure, NV
+
+''' Banded interior point solver for the GFOLD problems
+
+ A primal-dual interior point method (Mehrotra predictor-corrector,
+ Nesterov-Todd scaling, as in CVXOPT / ECOS) on the standard form GFOLD_sparse
+ assembles,
+
+     minimize c'x  s.t.  A x = b,  G x + s = h,  s in K = R+^l x Q^q1 x ... x Q^qk
+
+ that only exploits how the transcription is laid out: every row of G (a
+ bound or a cone) touches the variables of one node, every row of A the
+ variables of one node or of two neighbouring ones (the dynamics).
+
+ The Newton system of every iteration, in the scaled variables of CVXOPT
+ (W the Nesterov-Todd scaling, dz~ = W dz; W^2 itself reaches condition
+ numbers of 1e20 near the optimum and is never formed),
+
+     [0       A'  G'W^-1] [dx ]   [bx]
+     [A       0   0     ] [dy ] = [by]
+     [W^-1 G  0   -I    ] [dz~]   [bz]
+
+ is reduced to [H A'; A 0] [dx; dy] with H = G' W^-2 G, block diagonal: one
+ NV x NV block per node, built for all cones of a dimension at once. Its rows
+ only connect a node to its neighbours, so reverse Cuthill-McKee orders it
+ into a band of fixed width (about 22 for p4) whatever N is, factored by
+ LAPACK's banded LU (dgbtrf) with partial pivoting: H is singular on the
+ variables that are in no cone (z0, q0), which rules out the Cholesky of
+ the Schur complement A H^-1 A'. An iteration costs O(N), against the
+ general sparse LDL of ECOS / Clarabel; every solve is refined against the
+ residuals of the full system.
+
+ There is no homogeneous embedding: a problem that does not converge in
+ max_iters iterations (an infeasible tf) is reported as failed, like ECOS's
+ exit flags, but only after all of them (about 0.7s at N=160).
+
+ It is an experiment, not a solver_engine: every iteration assembles and
+ factors the whole band again from Python, 10-12ms at N=160 where ECOS spends
+ about 3ms, so it is 3 to 5 times slower than GFOLD_sparse on ECOS at every N.
+ __main__ compares the two.
+
+'''
+
+SETTINGS = {'feastol': 1e-7, 'abstol': 1e-7, 'reltol': 1e-7, 'max_iters': 60, 'step': 0.99, 'refine': 2}
+
+banded_cache = {}  # (N, program) -> banded
+last_iterations = {}  # (N, program) -> iterations of the last solve
+
+
+class group:
+    # the cones of one dimension d (d = 1: the linear inequalities), k of them
+    def __init__(self, rows, node):
+        self.rows = rows  # (k, d) rows of G / entries of s and z
+        self.node = node  # (k,) node every cone belongs to
+        self.k, self.d = rows.shape
+        self.G = np.zeros((self.k, self.d, NV))  # G rows on the node's variables
+        self.index = None  # flat positions in self.G of the G data entries in self.data
+        self.data = None
+        e = np.zeros(self.d)
+        e[0] = 1.0
+        self.e = e  # identity of the cone
+        self.H_index = (node[:, np.newaxis] * NV * NV + np.arange(NV * NV)).ravel()
+
+
+class banded:
+    # what the solver needs of structure (N, program), beyond GFOLD_sparse.structure
+    def __init__(self, st):
+        self.st = st
+        N = st.N
+        self.N = N
+        n_ineq = st.n_ineq
+        col_node = np.arange(st.n_var) // NV
+
+        # ---- cones, grouped by dimension
+        G = st.G.matrix
+        data_row = G.indices
+        data_col = np.repeat(np.arange(G.shape[1]), np.diff(G.indptr))
+        row_node = np.full(n_ineq, -1)
+        row_node[data_row] = col_node[data_col]
+        dims = [1] * st.dims['l'] + list(st.dims['q'])
+        starts = np.concatenate(([0], np.cumsum(dims)))
+        cone_node = np.array([row_node[a:b].max() for a, b in zip(starts[:-1], starts[1:])])
+        assert (cone_node >= 0).all()
+        self.groups = []
+        row_group, row_k, row_i = np.zeros(n_ineq, int), np.zeros(n_ineq, int), np.zeros(n_ineq, int)
+        for d in sorted(set(dims)):
+            cones = np.flatnonzero(np.array(dims) == d)
+            rows = starts[cones][:, np.newaxis] + np.arange(d)
+            g = group(rows, cone_node[cones])
+            row_group[rows] = len(self.groups)
+            row_k[rows] = np.arange(g.k)[:, np.newaxis]
+            row_i[rows] = np.arange(d)
+            self.groups.append(g)
+        assert (cone_node[np.repeat(np.arange(len(dims)), dims)][data_row] == col_node[data_col]).all(), \
+            'a cone spans two nodes'
+        for j, g in enumerate(self.groups):
+            mine = np.flatnonzero(row_group[data_row] == j)
+            g.data = mine
+            g.index = (row_k[data_row[mine]] * g.d + row_i[data_row[mine]]) * NV + data_col[mine] % NV
+        self.degree = st.dims['l'] + len(st.dims['q'])
+        # block diagonal matrices on the cones (W, W^-1), fixed CSR pattern filled group by group
+        block_i = np.concatenate([np.repeat(g.rows, g.d, axis=1).ravel() for g in self.groups])
+        block_j = np.concatenate([np.tile(g.rows, g.d).ravel() for g in self.groups])
+        order = sp.csr_matrix((np.arange(1, len(block_i) + 1, dtype=float), (block_i, block_j)), shape=(n_ineq, n_ineq))
+        self.block = order.copy()
+        self.block_perm = order.data.astype(int) - 1
+
+        # ---- the KKT matrix [H A'; A 0]: H has a block per node, the pattern of the columns its cones share,
+        # an equality row touches one node or two neighbouring ones. Reverse Cuthill-McKee orders it into a
+        # band whose width does not depend on N
+        A = st.A.matrix
+        data_row = A.indices
+        data_col = np.repeat(np.arange(A.shape[1]), np.diff(A.indptr))
+        n_eq = st.n_eq
+        first = np.full(n_eq, N)
+        last = np.full(n_eq, -1)
+        np.minimum.at(first, data_row, col_node[data_col])
+        np.maximum.at(last, data_row, col_node[data_col])
+        assert (last - first <= 1).all(), 'an equality spans more than two nodes'
+        H_mask = np.zeros((N, NV, NV), bool)
+        for g in self.groups:
+            used = np.zeros(g.k * g.d * NV, bool)
+            used[g.index] = True
+            used = used.reshape(g.k, g.d, NV).any(axis=1)
+            np.logical_or.at(H_mask, g.node, used[:, :, np.newaxis] & used[:, np.newaxis, :])
+        H_mask |= np.eye(NV, dtype=bool)
+        node, H_i, H_j = np.nonzero(H_mask)
+        H_i, H_j = node * NV + H_i, node * NV + H_j
+        self.H_entries = np.flatnonzero(H_mask)
+        self.size = st.n_var + n_eq
+        pattern = sp.csr_matrix((np.ones(len(H_i) + 2 * len(data_row)),
+                                 (np.concatenate((H_i, st.n_var + data_row, data_col)),
+                                  np.concatenate((H_j, data_col, st.n_var + data_row)))), shape=(self.size, self.size))
+        position = np.empty(self.size, int)
+        position[reverse_cuthill_mckee(pattern, symmetric_mode=True)] = np.arange(self.size)
+        self.x_position, self.y_position = position[:st.n_var], position[st.n_var:]
+        H_i, H_j = position[H_i], position[H_j]
+        A_i, A_j = self.y_position[data_row], self.x_position[data_col]
+        self.l = int(max(np.abs(H_i - H_j).max(), np.abs(A_i - A_j).max()))  # lower = upper bandwidth
+        # LAPACK's banded storage, with room for the fill of pivoting: ab[2l + i - j, j] = M[i, j]
+        self.H_index = (2 * self.l + H_i - H_j) * self.size + H_j
+        self.A_index = np.concatenate(((2 * self.l + A_i - A_j) * self.size + A_j,
+                                       (2 * self.l + A_j - A_i) * self.size + A_i))
+        self.ab_size = (3 * self.l + 1) * self.size
+        self.n_eq = n_eq
+
+    def block_diagonal(self, mats):
+        # the (k, d, d) matrices of every group as one sparse matrix
+        block = self.block.copy()
+        block.data = np.concatenate([m.ravel() for m in mats])[self.block_perm]
+        return block
+
+    def load(self, pvec):
+        # the problem data for pvec
+        st = self.st
+        self.c = st.c.update(pvec)
+        self.b = st.b.update(pvec)
+        self.h = st.h.update(pvec)
+        self.A = st.A.update(pvec).copy()
+        self.AT = self.A.T.tocsr()
+        self.G = st.G.update(pvec).copy()
+        self.GT = self.G.T.tocsr()
+        self.ab_A = np.bincount(self.A_index, np.concatenate((self.A.data, self.A.data)), minlength=self.ab_size)
+        for g in self.groups:
+            g.G = np.zeros(g.k * g.d * NV)
+            g.G[g.index] = self.G.data[g.data]
+            g.G = g.G.reshape(g.k, g.d, NV)
+
+
+# ---- cone arithmetic, per group; vectors of a group are (k, d)
+
+def jordan(g, u, v):
+    # u o v
+    if g.d == 1:
+        return u * v
+    return np.concatenate(((u * v).sum(axis=1, keepdims=True), u[:, :1] * v[:, 1:] + v[:, :1] * u[:, 1:]), axis=1)
+
+
+def jordan_solve(g, lam, d):
+    # x with lam o x = d
+    if g.d == 1:
+        return d / lam
+    l0, l1, d0, d1 = lam[:, 0], lam[:, 1:], d[:, 0], d[:, 1:]
+    x0 = (l0 * d0 - (l1 * d1).sum(axis=1)) / (l0 * l0 - (l1 * l1).sum(axis=1))
+    return np.concatenate((x0[:, np.newaxis], (d1 - x0[:, np.newaxis] * l1) / l0[:, np.newaxis]), axis=1)
+
+
+def max_step(g, s, ds):
+    # largest a with s + a ds in the cones (inf if any a is)
+    if g.d == 1:
+        with np.errstate(divide='ignore'):
+            ratio = np.where(ds < 0, -s / ds, np.inf)
+        return ratio.min() if len(ratio) else np.inf
+    a = ds[:, 0] ** 2 - (ds[:, 1:] ** 2).sum(axis=1)
+    b = s[:, 0] * ds[:, 0] - (s[:, 1:] * ds[:, 1:]).sum(axis=1)
+    c = np.maximum(s[:, 0] ** 2 - (s[:, 1:] ** 2).sum(axis=1), 0.0)
+    disc = b * b - a * c
+    with np.errstate(divide='ignore', invalid='ignore'):
+        q = -(b + np.copysign(np.sqrt(np.maximum(disc, 0.0)), b))
+        roots = np.stack((q / a, c / q))
+    roots = np.where((roots > 0) & (disc >= 0), roots, np.inf)
+    # a linear f (a = 0) leaves where 2 b t + c = 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        linear = np.where((a == 0) & (b < 0), -c / (2 * b), np.inf)
+    return min(roots.min(), linear.min()) if len(a) else np.inf
+
+
+def shift_into(g, s):
+    # smallest a with s + a e in the cones (negative if s is inside)
+    if g.d == 1:
+        return -s.min() if len(s) else -np.inf
+    return (np.sqrt((s[:, 1:] ** 2).sum(axis=1)) - s[:, 0]).max() if len(s) else -np.inf
+
+
+def nt_scaling(g, s, z):
+    # W and W^-1 (k, d, d), lam = W z = W^-1 s
+    if g.d == 1:
+        w = np.sqrt(s / z)
+        return w[:, :, np.newaxis], (1 / w)[:, :, np.newaxis], np.sqrt(s * z)
+    s_j = s[:, 0] ** 2 - (s[:, 1:] ** 2).sum(axis=1)
+    z_j = z[:, 0] ** 2 - (z[:, 1:] ** 2).sum(axis=1)
+    s_bar = s / np.sqrt(s_j)[:, np.newaxis]
+    z_bar = z / np.sqrt(z_j)[:, np.newaxis]
+    gamma = np.sqrt((1 + (s_bar * z_bar).sum(axis=1)) / 2)
+    w0 = (s_bar[:, 0] + z_bar[:, 0]) / (2 * gamma)
+    w1 = (s_bar[:, 1:] - z_bar[:, 1:]) / (2 * gamma)[:, np.newaxis]
+    eta = (s_j / z_j) ** 0.25
+    core = np.eye(g.d - 1) + w1[:, :, np.newaxis] * w1[:, np.newaxis, :] / (1 + w0)[:, np.newaxis, np.newaxis]
+    W = np.empty((g.k, g.d, g.d))
+    W[:, 0, 0] = w0
+    W[:, 0, 1:] = w1
+    W[:, 1:, 0] = w1
+    W[:, 1:, 1:] = core
+    W_inv = W.copy()
+    W_inv[:, 0, 1:] = -w1
+    W_inv[:, 1:, 0] = -w1
+    W *= eta[:, np.newaxis, np.newaxis]
+    W_inv /= eta[:, np.newaxis, np.newaxis]
+    return W, W_inv, np.einsum('kij,kj->ki', W, z)
+
+
+def apply(mats, v):
+    # block diagonal (k, d, d) matrices times (k, d) vectors
+    return np.einsum('kij,kj->ki', mats, v)
+
+
+class kkt:
+    # the Newton system for one scaling, factored; in the scaled variables of CVXOPT, W dz and W^-T bz,
+    # so that W^2 (condition numbers of 1e20 near the end) is never formed
+    def __init__(self, bd, W_inv):
+        self.bd = bd
+        self.W_inv = bd.block_diagonal(W_inv)
+        N = bd.N
+        H = np.zeros(N * NV * NV)
+        for g, w_inv in zip(bd.groups, W_inv):
+            WG = np.matmul(w_inv, g.G)
+            H += np.bincount(g.H_index, np.matmul(WG.transpose(0, 2, 1), WG).ravel(), minlength=N * NV * NV)
+        ab = bd.ab_A + np.bincount(bd.H_index, H[bd.H_entries], minlength=bd.ab_size)
+        self.lu, self.piv, info = dgbtrf(ab.reshape(-1, bd.size), bd.l, bd.l, overwrite_ab=1)
+        if info > 0:
+            raise np.linalg.LinAlgError('singular KKT system')
+
+    def solve_reduced(self, bx, by, bz):
+        # [H A'; A 0] [dx; dy] = [bx + G' W^-1 bz; by], dz = W^-1 G dx - bz
+        bd = self.bd
+        rhs = np.empty(bd.size)
+        rhs[bd.x_position] = bx + bd.GT @ (self.W_inv @ bz)
+        rhs[bd.y_position] = by
+        sol, _ = dgbtrs(self.lu, bd.l, bd.l, rhs, self.piv)
+        dx, dy = sol[bd.x_position], sol[bd.y_position]
+        dz = self.W_inv @ (bd.G @ dx) - bz
+        return dx, dy, dz
+
+    def solve(self, bx, by, bz, refine):
+        # A' dy + G' W^-1 dz = bx, A dx = by, W^-1 G dx - dz = bz, refined against the residuals
+        bd = self.bd
+        dx, dy, dz = self.solve_reduced(bx, by, bz)
+        for _ in range(refine):
+            ex = bx - bd.AT @ dy - bd.GT @ (self.W_inv @ dz)
+            ey = by - bd.A @ dx
+            ez = bz - self.W_inv @ (bd.G @ dx) + dz
+            cx, cy, cz = self.solve_reduced(ex, ey, ez)
+            dx += cx
+            dy += cy
+            dz += cz
+        return dx, dy, dz
+
+
+def solve(bd, settings=None, verbose=False):
+    # (x, y, s, z, stats) of the problem loaded in bd; x is None if it did not converge
+    opts = dict(SETTINGS, **(settings or {}))
+    groups = bd.groups
+    c, b, h = bd.c, bd.b, bd.h
+    m = len(h)
+
+    def per_group(v):
+        return [v[g.rows] for g in groups]
+
+    def cone_vector(parts):
+        out = np.empty(m)
+        for g, p in zip(groups, parts):
+            out[g.rows] = p
+        return out
+
+    e = cone_vector([np.broadcast_to(g.e, (g.k, g.d)) for g in groups])
+
+    def shifted(v):
+        # v moved into the interior of the cones
+        a = max(shift_into(g, p) for g, p in zip(groups, per_group(v)))
+        if a < -1e-8 * max(np.linalg.norm(v), 1.0):
+            return v
+        return v + (1 + a) * e
+
+    # starting point: least squares primal and dual with W = I, shifted into the cones
+    identity = [np.broadcast_to(np.eye(g.d), (g.k, g.d, g.d)) for g in groups]
+    system = kkt(bd, identity)
+    x, y, z_ls = system.solve(np.zeros(len(c)), b, h, opts['refine'])
+    s = shifted(-z_ls)
+    _, y, z = system.solve(-c, np.zeros(len(b)), np.zeros(m), opts['refine'])
+    z = shifted(z)
+
+    scale_c, scale_b, scale_h = max(1.0, np.linalg.norm(c)), max(1.0, np.linalg.norm(b)), max(1.0, np.linalg.norm(h))
+    status = 'max_iters'
+    for iteration in range(opts['max_iters'] + 1):
+        rx = c + bd.AT @ y + bd.GT @ z
+        ry = bd.A @ x - b
+        rz = bd.G @ x + s - h
+        gap = s @ z
+        mu = gap / bd.degree
+        pcost, dcost = c @ x, -b @ y - h @ z
+        pres = max(np.linalg.norm(ry) / scale_b, np.linalg.norm(rz) / scale_h)
+        dres = np.linalg.norm(rx) / scale_c
+        if verbose:
+            print('%3d  pcost %13.6e  dcost %13.6e  gap %9.2e  pres %9.2e  dres %9.2e' % (iteration, pcost, dcost, gap, pres, dres))
+        if pres < opts['feastol'] and dres < opts['feastol'] and (
+                gap < opts['abstol'] or gap < opts['reltol'] * min(abs(pcost), abs(dcost))):
+            status = 'optimal'
+            break
+        if iteration == opts['max_iters'] or not np.isfinite(gap):
+            break
+
+        scaling = [nt_scaling(g, sg, zg) for g, sg, zg in zip(groups, per_group(s), per_group(z))]
+        W = [w for w, _, _ in scaling]
+        W_inv = [w_inv for _, w_inv, _ in scaling]
+        lam = [l for _, _, l in scaling]
+        try:
+            system = kkt(bd, W_inv)
+        except np.linalg.LinAlgError:
+            status = 'singular'
+            break
+
+        def direction(d_s):
+            # Newton direction for lam o (W dz + W^-1 ds) = -d_s; the system gives W dz
+            q = [jordan_solve(g, l, d) for g, l, d in zip(groups, lam, d_s)]
+            bz = cone_vector([apply(w_inv, p) + qi for w_inv, p, qi in zip(W_inv, per_group(-rz), q)])
+            dx, dy, dz_scaled = system.solve(-rx, -ry, bz, opts['refine'])
+            dz_scaled = per_group(dz_scaled)
+            dz = cone_vector([apply(w_inv, p) for w_inv, p in zip(W_inv, dz_scaled)])
+            ds = -cone_vector([apply(w, qi + p) for w, qi, p in zip(W, q, dz_scaled)])
+            return dx, dy, dz, ds, dz_scaled
+
+        def step_length(ds, dz):
+            return min(min(max_step(g, sg, dg) for g, sg, dg in zip(groups, per_group(s), per_group(ds))),
+                       min(max_step(g, zg, dg) for g, zg, dg in zip(groups, per_group(z), per_group(dz))))
+
+        # predictor
+        lam_sq = [jordan(g, l, l) for g, l in zip(groups, lam)]
+        dx, dy, dz, ds, dz_scaled = direction(lam_sq)
+        alpha = min(1.0, step_length(ds, dz))
+        sigma = (max(0.0, (s + alpha * ds) @ (z + alpha * dz)) / gap) ** 3
+        # corrector
+        ds_scaled = [apply(w_inv, p) for w_inv, p in zip(W_inv, per_group(ds))]
+        d_s = [ls + jordan(g, a, bb) - sigma * mu * g.e for g, ls, a, bb in zip(groups, lam_sq, ds_scaled, dz_scaled)]
+        dx, dy, dz, ds, _ = direction(d_s)
+        alpha = min(1.0, opts['step'] * step_length(ds, dz))
+        x += alpha * dx
+        y += alpha * dy
+        z += alpha * dz
+        s += alpha * ds
+    stats = {'status': status, 'iterations': iteration, 'pcost': pcost, 'dcost': dcost, 'gap': gap, 'pres': pres, 'dres': dres}
+    return (x if status == 'optimal' else None), y, s, z, stats
+
+
+def get_banded(N, program):
+    key = (N, program)
+    if key not in banded_cache:
+        banded_cache[key] = banded(get_structure(N, program))
+    return banded_cache[key]
+
+
+def GFOLD_banded(N, pmark, packed_data, backend='auto', verbose=False, warm=None, trace=None):
+    # the signature of GFOLD_direct / GFOLD_sparse; backend and warm are accepted and ignored
+    program = 4 if pmark == 'p4' else 3
+
+    trace = trace or GFOLD_trace.trace('GFOLD_banded')
+    with trace.phase('p%d' % program, N=N, engine='banded') as info:
+        with trace.phase('assemble'):
+            bd = get_banded(N, program)
+            pvec = bd.st.pvec(N, packed_data)
+            bd.load(pvec)
+        info.update(variables=bd.st.n_var, eq_constraints=bd.n_eq, ineq_constraints=bd.st.n_ineq, bandwidth=bd.l)
+
+        with trace.phase('solve', warm_start=False) as solve_info:
+            start = time.perf_counter()
+            sol, y, s, z, stats = solve(bd, verbose=verbose)
+            stats.update(solver='BANDED', solve_time=time.perf_counter() - start)
+            solve_info.update(stats)
+        last_iterations[(N, program)] = stats['iterations']
+        info.update(backend='BANDED', status=stats['status'])
+
+        with trace.phase('extract'):
+            if sol is None:
+                return None, None, None, None, None, None
+            x, u, z, s = bd.st.unpack(sol)
+            obj_opt = bd.c @ sol
+            info['objective'] = obj_opt
+            return obj_opt, x, u, np.exp(z), s, z
+
+
+if __name__ == '__main__':
+    import io
+    import contextlib
+    import GFOLD_sparse
+    from GFOLD_run import solver, test_vessel
+
+    # against ECOS on the same standard form: same optimum, time per iteration linear in N
+    gfold = solver(test_vessel)
+    print('problem     banded             ECOS               objective  landing mass  per iteration')
+    for N, pmark in ((40, 'p3'), (40, 'p4'), (80, 'p4'), (160, 'p3'), (160, 'p4'), (320, 'p4'), (640, 'p4')):
+        program = 4 if pmark == 'p4' else 3
+        packed_data = gfold.pack_data(N)
+        times = {}
+        results = {}
+        for name, engine in (('banded', GFOLD_banded), ('ECOS', GFOLD_sparse.GFOLD_sparse)):
+            with contextlib.redirect_stdout(io.StringIO()):
+                engine(N, pmark, packed_data, 'ECOS')  # build the structures
+                start = time.perf_counter()
+                results[name] = engine(N, pmark, packed_data, 'ECOS')
+            times[name] = time.perf_counter() - start
+        res, ref = results['banded'], results['ECOS']
+        assert res[0] is not None and np.isclose(res[0], ref[0], rtol=1e-6), 'banded solver changed the optimum'
+        iterations = last_iterations[(N, program)]
+        mass = '%9.2ekg' % abs(res[3][-1] - ref[3][-1]) if program == 4 else '        -'  # p3's mass is not unique
+        print('N=%-3d %s %7.1fms %3d it  %7.1fms %3d it  %9.2e  %s  %6.2fms (bandwidth %d)' % (
+            N, pmark, times['banded'] * 1000, iterations, times['ECOS'] * 1000, GFOLD_sparse.last_iterations[(N, program)],
+            abs(res[0] - ref[0]) / abs(ref[0]), mass, times['banded'] / iterations * 1000, get_banded(N, program).l))
+
+    # no infeasibility certificate: a tf too short fails, but only once max_iters are spent
+    packed_data = solver(dict(test_vessel, tf=3)).pack_data(80)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert GFOLD_banded(80, 'p4', packed_data)[0] is None
+    print('infeasible tf: failed after %d iterations, %.3fs' % (last_iterations[(80, 4)], time.perf_counter() - start))
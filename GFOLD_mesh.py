@@ -0,0 +1,124 @@
+import numpy as np
+
+''' Non-uniform time grids for the GFOLD transcription
+
+ The transcription integrates velocity and position with the trapezoid rule,
+ node to node. Velocity is exact for a thrust acceleration that is linear over
+ an interval, position is not: flown exactly, the vessel ends the interval
+
+     dt^2 / 12 * |u[k + 1] - u[k]|
+
+ away from the next node (defects). That is the discretization error: nothing
+ where the thrust holds still (coasting, or after touchdown on the p3 grid), a
+ lot where it turns or throttles fast, near touchdown.
+
+ refine() places N nodes so that every interval gets the same share of it: the
+ density of nodes follows |du/dt|^(1/3), blended with a uniform one so no
+ interval grows more than 1 / blend times the mean. Grids are node positions in
+ [0, 1], as solver.pack_data takes them (mesh), over the (N - 1) / N * tf the
+ N nodes span. On the coarse p3 grids tf_m is taken where the vessel first
+ rests on the ground (touchdown), not where it is also on the target.
+
+ propagate() flies the planned thrust exactly from the first node; its distance
+ to the planned nodes (drift) and to the planned landing point (landing_miss) is
+ what a plan is really worth, whatever its grid.
+
+ With N3_mesh / N4_mesh nodes an adaptive plan is 15-45% faster to solve but
+ less accurate than the uniform N3 / N4 one on the bench scenarios: flown
+ exactly it misses its landing point by 0.1-0.4m (uniform: 0), its largest
+ defect reaches 0.58m on a fast entry (uniform: 0.2m), and tf_m, found on the
+ coarse p3 grid, comes out up to 1.4s later. __main__ checks these bounds.
+
+'''
+
+
+def propagate(t, x, u, g):
+    # states at the node times t of a vessel flying the piecewise linear thrust u from x[:, 0]
+    dts = np.diff(t)
+    du = np.diff(u, axis=1)
+    g = np.reshape(g, (3, 1))
+    dv = (u[:, :-1] + 0.5 * du + g) * dts
+    v = x[3:6, :1] + np.concatenate((np.zeros((3, 1)), np.cumsum(dv, axis=1)), axis=1)
+    dr = v[:, :-1] * dts + (u[:, :-1] + g) * (0.5 * dts ** 2) + du * (dts ** 2 / 6)
+    r = x[0:3, :1] + np.concatenate((np.zeros((3, 1)), np.cumsum(dr, axis=1)), axis=1)
+    return np.vstack((r, v))
+
+
+def defects(t, u):
+    # position error of every interval flown exactly from its first node
+    dts = np.diff(t)
+    return np.linalg.norm(np.diff(u, axis=1), axis=0) * dts ** 2 / 12
+
+
+def drift(t, x, u, g):
+    # largest position distance of the exactly flown plan to its planned nodes
+    flown = propagate(t, x, u, g)
+    return np.max(np.linalg.norm(flown[0:3] - x[0:3], axis=0))
+
+
+def landing_miss(t, x, u, g):
+    # (position, velocity) distance of the exactly flown plan to its planned last node
+    flown = propagate(t, x, u, g)
+    return np.linalg.norm(flown[0:3, -1] - x[0:3, -1]), np.linalg.norm(flown[3:6, -1] - x[3:6, -1])
+
+
+def touchdown(t, x, tol=0.3):
+    # time of the first node at rest on the ground (altitude + speed below tol), None if there is none;
+    # coarse p3 solutions creep sideways over the last metres, which |r| + |v| < 0.1 would wait out
+    rest = np.abs(x[0]) + np.linalg.norm(x[3:6], axis=0) < tol
+    return t[np.argmax(rest)] if rest.any() else None
+
+
+def refine(t, u, N, t_end=None, blend=0.25):
+    # N node positions over [t[0], t_end] equidistributing the defects of the solution (t, u)
+    t_end = t[-1] if t_end is None else t_end
+    dts = np.diff(t)
+    rate = np.linalg.norm(np.diff(u, axis=1), axis=0) / dts
+    density = np.cbrt(rate)
+    mean = density @ dts / (t[-1] - t[0])
+    if not mean > 0:
+        return np.linspace(0, 1, N)
+    density = (1 - blend) * density + blend * mean
+    if t_end > t[-1]:
+        # past the solution: keep the last interval's density
+        t = np.append(t, t_end)
+        density = np.append(density, density[-1])
+        dts = np.diff(t)
+    share = np.concatenate(([0], np.cumsum(density * dts)))
+    levels = np.linspace(0, np.interp(t_end, t, share), N)
+    mesh = (np.interp(levels, share, t) - t[0]) / (t_end - t[0])
+    mesh[0], mesh[-1] = 0.0, 1.0
+    return mesh
+
+
+if __name__ == '__main__':
+    import time
+    from GFOLD_run import solver, N3, N4, N3_mesh, N4_mesh
+    from GFOLD_bench import scenarios
+
+    print('uniform N3 = %d, N4 = %d; adaptive N3 = %d, N4 = %d' % (N3, N4, N3_mesh, N4_mesh))
+    for name, v_data in scenarios.items():
+        uniform_tf = None
+        for adaptive in (False, True):
+            solver(v_data, engine='sparse').solve_direct(adaptive=adaptive)  # build the structures
+            gfold = solver(v_data, engine='sparse')
+            start = time.perf_counter()
+            result = gfold.solve_direct(adaptive=adaptive)
+            elapsed = time.perf_counter() - start
+            if result is None:
+                print('%-12s %-8s failed' % (name, 'adaptive' if adaptive else 'uniform'))
+                continue
+            if adaptive:
+                t, x, u = gfold.mesh_path[0:3]
+            else:
+                tf, x, u = gfold.path[0:3]
+                t = np.arange(x.shape[1]) * (tf / x.shape[1])
+            print('%-12s %-8s %6.1fms  tf_m %5.2fs  landing mass %7.1fkg  max defect %.3fm  drift %.3fm  miss %.3fm' % (
+                name, 'adaptive' if adaptive else 'uniform', elapsed * 1000, result[0], result[3][-1],
+                defects(t, u).max(), drift(t, x, u, v_data['g']), landing_miss(t, x, u, v_data['g'])[0]))
+            if not adaptive:
+                uniform_tf = result[0]
+            elif uniform_tf is not None:
+                # the accuracy given away for the speed, as stated above
+                assert landing_miss(t, x, u, v_data['g'])[0] < 0.5 and defects(t, u).max() < 0.6, name
+                assert abs(result[0] - uniform_tf) < 1.5, name
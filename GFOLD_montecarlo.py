@@ -0,0 +1,185 @@
+import io
+import os
+import sys
+import json
+import time
+import contextlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+''' Monte Carlo dispersion campaign over solver.solve_direct
+
+ Initial conditions and vehicle parameters are dispersed around a v_data
+ profile (gaussian, one sigma given per key in dispersion: absolute for x0,
+ relative for the scalars and for |g|), all samples are drawn up front from one
+ seed so a campaign is reproducible whatever the number of workers.
+
+ Samples are solved in chunks on a process pool (every worker keeps its
+ compiled problems), and every result is appended to a JSON lines file as soon
+ as its chunk completes, so a long campaign can be watched or cut short. A
+ sample whose solve raises is recorded as failed, with the exception in
+ 'error', and the campaign goes on.
+ summarize() turns the records (or a file of them, see load) into the success
+ rate and percentiles of landing error, fuel and solve time.
+
+ The solved path itself always ends on the target (p4 pins its last node), so
+ the landing error is measured by flying it: fly_plan runs the control law of
+ demo3_gfold.run (follower and controller.guidance in gfold mode, the final
+ descent near the ground) with the sample's thrust and tilt limits on
+ point-mass dynamics with the sample's gravity, Isp and mass, and records where
+ and how fast the vessel touches down. Only samples with a path have one.
+
+'''
+
+dispersion_default = {
+    'x0': np.array([100, 50, 50, 5, 5, 5]),
+    'm_wet': 0.02,
+    'T_max': 0.03,
+    'Isp': 0.02,
+    'g': 0.005,
+}
+
+PERCENTILES = (50, 90, 99)
+
+
+def sample(v_data, dispersion, rng):
+    v_data = dict(v_data)
+    for key, sigma in dispersion.items():
+        if key == 'x0':
+            v_data['x0'] = v_data['x0'] + rng.normal(0, 1, 6) * sigma
+        else:
+            v_data[key] = v_data[key] * (1 + rng.normal() * sigma)
+    return v_data
+
+
+def load_gains(path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'params.txt')):
+    # the tracking gains and limits fly_plan uses, from params.txt
+    from demo3_gfold import load_params
+    return load_params(path)
+
+
+def fly_plan(v_data, path, params, dt=0.02):
+    # flies path from v_data's x0 as demo3_gfold.run does: gfold mode, then the final descent inside final_radius /
+    # final_height; thrust at the commanded throttle along the target direction (no attitude lag).
+    # (position, velocity) at touchdown, or where it was after twice tf
+    from GFOLD_follow import follower
+    from GFOLD_control import controller, GFOLD, FINAL
+    g = np.asarray(v_data['g'], dtype=float)
+    # demo3_gfold plans with 0.85 of the tilt the controller may use
+    kernel = controller(dict(params, g0=-g[0], max_tilt=np.degrees(v_data['p_cs']) / 0.85))
+    follow = follower(path, -g[0])
+    s, c = kernel.state, kernel.commands
+    s.mode[0], s.max_thrust[0], s.dt[0] = GFOLD, v_data['T_max'], dt
+    r, v = np.array(v_data['x0'][0:3], dtype=float), np.array(v_data['x0'][3:6], dtype=float)
+    m = float(v_data['m_wet'])
+    throttle = np.linalg.norm(path[2][:, 0]) * m / v_data['T_max']
+    for _ in range(int(2 * path[0] / dt)):
+        if s.mode[0] == GFOLD and np.linalg.norm(r[1:3]) < params['final_radius'] and abs(r[0]) < params['final_height']:
+            s.mode[0] = FINAL
+        s.error[0], s.vel[0], s.mass[0] = r, v, m
+        if s.mode[0] == GFOLD:
+            n_i = follow.update(r, dt)
+            s.n_i[0] = n_i
+            s.x_i[0], s.v_i[0], s.u_i[0] = follow.sample(n_i)
+            s.x_i_[0], s.v_i_[0], s.u_i_[0] = follow.sample(n_i + min(1.5 / follow.dt, np.linalg.norm(v) / 50 / follow.dt))
+        kernel.guidance()
+        if not np.isnan(c.throttle[0]):  # NaN: the throttle is left as it is
+            throttle = c.throttle[0]
+        a = throttle * v_data['T_max'] / m * c.target_direction[0]
+        v += (a + g) * dt
+        r += v * dt
+        m -= throttle * v_data['T_max'] / (v_data['Isp'] * 9.80665) * dt
+        if r[0] <= 0:
+            break
+    return r, v
+
+
+def solve_samples(samples, backend, engine, params):
+    # runs in a worker: one record per (index, v_data), params: gains for fly_plan
+    from GFOLD_run import solver
+    records = []
+    for i, v_data in samples:
+        record = {
+            'i': i,
+            'ok': False,
+            'x0': v_data['x0'].tolist(),
+            'm_wet': v_data['m_wet'],
+            'T_max': v_data['T_max'],
+            'Isp': v_data['Isp'],
+            'g': v_data['g'].tolist(),
+        }
+        start = time.time()
+        try:
+            gfold = solver(v_data, backend, False, engine)
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = gfold.solve_direct()
+            record['solve_time'] = time.time() - start
+            record['ok'] = result is not None
+            if result is not None:
+                tf, x, u, m, s, z = result
+                record['tf'] = tf
+                record['fuel'] = float(m[0] - m[-1])
+                r, v = fly_plan(v_data, gfold.path, params)
+                record['landing_error'] = float(np.linalg.norm(r[1:3]))
+                record['landing_speed'] = float(np.linalg.norm(v))
+        except Exception as e:
+            record['solve_time'] = time.time() - start
+            record['error'] = repr(e)
+        records.append(record)
+    return records
+
+
+def campaign(v_data, samples=1000, out='campaign.jsonl', seed=0, dispersion=None, workers=None, chunk=8, backend='auto', engine='cvxpy', params=None):
+    # runs the campaign, streaming records to out, and returns summarize() of it; params: gains for fly_plan
+    rng = np.random.default_rng(seed)
+    dispersion = dispersion_default if dispersion is None else dispersion
+    params = load_gains() if params is None else params
+    draws = [(i, sample(v_data, dispersion, rng)) for i in range(samples)]
+    chunks = [draws[i:i + chunk] for i in range(0, samples, chunk)]
+    records = []
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool, open(out, 'w', encoding='utf-8') as f:
+        futures = [pool.submit(solve_samples, c, backend, engine, params) for c in chunks]
+        for future in as_completed(futures):
+            for record in future.result():
+                f.write(json.dumps(record) + '\n')
+                records.append(record)
+            f.flush()
+            print('%d/%d solved, %.1f solves/h' % (len(records), samples, len(records) / (time.time() - start) * 3600))
+    return summarize(records)
+
+
+def load(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(records):
+    ok = [r for r in records if r['ok']]
+    summary = {'samples': len(records), 'success_rate': len(ok) / len(records) if records else 0.0,
+               'errors': sum('error' in r for r in records)}
+    for key in ('landing_error', 'landing_speed', 'fuel', 'solve_time'):
+        values = [r[key] for r in records if key in r]
+        if values:
+            summary[key] = {'p%d' % p: float(np.percentile(values, p)) for p in PERCENTILES}
+            summary[key]['mean'] = float(np.mean(values))
+            summary[key]['max'] = float(np.max(values))
+    return summary
+
+
+if __name__ == '__main__':
+    from GFOLD_run import test_vessel
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    # the landing error comes from flying the path, a sample that raises is a failed record
+    params = load_gains()
+    draws = [(i, sample(test_vessel, dispersion_default, np.random.default_rng(i))) for i in range(3)]
+    draws.append((3, dict(draws[0][1], Isp=None)))
+    records = solve_samples(draws, 'auto', 'sparse', params)
+    for record in records[:3]:
+        assert record['ok'] and 'error' not in record, record
+        assert 0 < record['landing_error'] < params['final_radius'] and record['landing_speed'] < 10, record
+        print('sample %d: lands %.2fm from the target at %.2fm/s' % (record['i'], record['landing_error'], record['landing_speed']))
+    assert not records[3]['ok'] and 'TypeError' in records[3]['error'], records[3]
+    summary = campaign(test_vessel, samples, engine='sparse', params=params)
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import numpy as np
+from numpy.lib.format import open_memmap
+from GFOLD_control import NAV_MODES
+
+''' Flight recorder
+
+ recorder keeps one row per control tick: the telemetry snapshot, the nav mode,
+ the plan version and path index n_i, the follower's samples and targets, and
+ the commanded controls. Rows live in a preallocated structured array (ring);
+ next() hands out the next row, blanked to NaN, and the loop assigns fields
+ into it in place. Whenever half of the ring is full it is copied in one block
+ into ticks.npy, a memory-mapped file sized for max_rows ticks. Each new plan is
+ stored in plans.npy the same way; recording.json holds the row counts and the
+ params of the flight, so a recording cut short by a crash still loads up to
+ the last block.
+
+ load() reads a recording back; replay() runs the follower and the control
+ kernel the flight ran (GFOLD_follow.follower, GFOLD_control.controller) on
+ the recorded telemetry, plans and tick lengths, and compares with what the
+ flight did:
+
+     python GFOLD_record.py <recording directory>
+
+'''
+
+TELEMETRY = (('ut', np.float64, ()), ('frame', np.int64, ()), ('error', np.float64, 3), ('vel', np.float64, 3),
+             ('avel', np.float64, 3), ('rotation', np.float64, 4), ('moment_of_inertia', np.float64, 3),
+             ('mass', np.float64, ()), ('max_thrust', np.float64, ()), ('specific_impulse', np.float64, ()),
+             ('acceleration', np.float64, 3))
+TICK = np.dtype(list(TELEMETRY) + [
+    ('wall', np.float64),  # time.perf_counter() when the snapshot arrived
+    ('dt', np.float64),  # game time since the last tick
+    ('loop_time', np.float64),  # snapshot to controls sent
+    ('nav_mode', np.int8),  # index in NAV_MODES
+    ('plan', np.int32),  # version of the plan followed
+    ('n_i', np.float64),
+    ('x_i', np.float64, 3), ('v_i', np.float64, 3), ('u_i', np.float64, 3),
+    ('x_i_', np.float64, 3), ('v_i_', np.float64, 3), ('u_i_', np.float64, 3),
+    ('target_a', np.float64, 3), ('target_a_', np.float64, 3),  # after conic_clamp
+    ('target_direction', np.float64, 3),
+    ('throttle', np.float64), ('pitch', np.float64), ('yaw', np.float64), ('roll', np.float64)])
+
+
+class recorder:
+    def __init__(self, path, params=None, N=80, capacity=1024, max_rows=1 << 16, max_plans=256):
+        self.path = path
+        self.N = N
+        self.half = capacity // 2
+        self.ring = np.zeros(2 * self.half, TICK)
+        self.blank = np.zeros((), TICK)
+        for name in TICK.names:
+            if TICK[name].base.kind == 'f':
+                self.blank[name] = np.nan
+        self.telemetry = [name for name, _, _ in TELEMETRY]
+        os.makedirs(path, exist_ok=True)
+        self.ticks = open_memmap(os.path.join(path, 'ticks.npy'), mode='w+', dtype=TICK, shape=(max_rows,))
+        self.plans = open_memmap(os.path.join(path, 'plans.npy'), mode='w+', dtype=np.float64, shape=(max_plans, 3 + 9 * N))
+        self.info = {'rows': 0, 'plans': 0, 'dropped': 0, 'N': N, 'params': params or {}}
+        self.count = 0  # rows handed out
+        self.row = None
+
+    def next(self):
+        # the row of this tick, all NaN; assign its fields in place
+        if self.count and self.count % self.half == 0:
+            self.store()
+        i = self.count % len(self.ring)
+        self.ring[i] = self.blank
+        self.row = self.ring[i]
+        self.count += 1
+        return self.row
+
+    def snapshot(self, vessel_d):
+        # the telemetry fields of this tick
+        for name in self.telemetry:
+            self.row[name] = vessel_d[name]
+
+    def controls(self, commanded):
+        # the controls last commanded (controls.commanded)
+        for name in ('throttle', 'pitch', 'yaw', 'roll'):
+            if name in commanded:
+                self.row[name] = commanded[name]
+
+    def store(self, rows=None):
+        # copy the half of the ring that just filled (or the first rows of the current half) to the file
+        rows = self.half if rows is None else rows
+        first = (self.count - 1) // self.half % 2 * self.half
+        space = min(rows, len(self.ticks) - self.info['rows'])
+        self.ticks[self.info['rows']:self.info['rows'] + space] = self.ring[first:first + space]
+        self.info['rows'] += space
+        self.info['dropped'] += rows - space
+        self.write_info()
+
+    def plan(self, version, ut, path):
+        # a new plan, path (tf, x, u, ...) on N nodes
+        tf, x, u = path[0], path[1], path[2]
+        if self.info['plans'] == len(self.plans) or x.shape[1] != self.N:
+            return
+        row = self.plans[self.info['plans']]
+        row[0:3] = version, ut, tf
+        row[3:3 + 6 * self.N] = x.reshape(-1)
+        row[3 + 6 * self.N:] = u.reshape(-1)
+        self.info['plans'] += 1
+
+    def write_info(self):
+        with open(os.path.join(self.path, 'recording.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.info, f)
+
+    def close(self):
+        if self.count:
+            self.store((self.count - 1) % self.half + 1)
+        self.ticks.flush()
+        self.plans.flush()
+
+
+def load(path):
+    # (ticks, {version: (ut, path)}, params) of a recording
+    with open(os.path.join(path, 'recording.json'), 'r', encoding='utf-8') as f:
+        info = json.load(f)
+    ticks = np.load(os.path.join(path, 'ticks.npy'), mmap_mode='r')[:info['rows']]
+    N = info['N']
+    plans = {}
+    for row in np.load(os.path.join(path, 'plans.npy'), mmap_mode='r')[:info['plans']]:
+        x = np.array(row[3:3 + 6 * N]).reshape(6, N)
+        u = np.array(row[3 + 6 * N:]).reshape(3, N)
+        plans[int(row[0])] = (row[1], (row[2], x, u))
+    return ticks, plans, info['params']
+
+
+def replay(path):
+    # rerun the follower and GFOLD_control.controller on a recording; the largest differences to the flight
+    from GFOLD_control import controller
+    from GFOLD_follow import follower
+
+    ticks, plans, params = load(path)
+    kernel = controller(params)
+    state, commands = kernel.state, kernel.commands
+    if 'dt' in ticks.dtype.names:
+        dts = ticks['dt']
+    else:  # recorded before dt was: the first tick has none and is skipped
+        dts = np.diff(ticks['ut'], prepend=np.nan)
+    follow = None
+    version = None
+    worst = {name: 0.0 for name in ('n_i', 'target_direction', 'throttle', 'pitch', 'yaw', 'roll')}
+    replayed = 0
+    for tick, dt in zip(ticks, dts):
+        if not np.isfinite(dt):
+            continue
+        mode = tick['nav_mode']
+        state.mode[0] = mode
+        state.error[0], state.vel[0], state.avel[0], state.rotation[0] = tick['error'], tick['vel'], tick['avel'], tick['rotation']
+        state.mass[0], state.max_thrust[0], state.dt[0] = tick['mass'], tick['max_thrust'], dt
+        if mode == NAV_MODES.index('gfold'):
+            if tick['plan'] not in plans:
+                continue
+            if tick['plan'] != version:
+                version = tick['plan']
+                follow = follower(plans[version][1], params['g0'])
+            n_i = follow.update(tick['error'], dt)
+            state.n_i[0] = n_i
+            state.x_i[0], state.v_i[0], state.u_i[0] = follow.sample(n_i)
+            state.x_i_[0], state.v_i_[0], state.u_i_[0] = follow.sample(
+                n_i + min(1.5 / follow.dt, np.linalg.norm(tick['vel']) / 50 / follow.dt))
+            worst['n_i'] = max(worst['n_i'], abs(n_i - tick['n_i']))
+        kernel.step()
+        worst['target_direction'] = max(worst['target_direction'], np.linalg.norm(commands.target_direction[0] - tick['target_direction']))
+        if not np.isnan(commands.throttle[0]):
+            worst['throttle'] = max(worst['throttle'], abs(commands.throttle[0] - tick['throttle']))
+        for name in ('pitch', 'yaw', 'roll'):
+            worst[name] = max(worst[name], abs(getattr(commands, name)[0] - tick[name]))
+        replayed += 1
+    return replayed, worst
+
+
+def summary(path):
+    ticks, plans, params = load(path)
+    loop_time = ticks['loop_time'][np.isfinite(ticks['loop_time'])] * 1000
+    modes = {name: int(np.count_nonzero(ticks['nav_mode'] == i)) for i, name in enumerate(NAV_MODES)}
+    return ('%d ticks over %.2fs, %d plans, ticks per mode %s, loop time median %.2fms p99 %.2fms max %.2fms' % (
+        len(ticks), ticks['ut'][-1] - ticks['ut'][0], len(plans), modes, np.median(loop_time),
+        np.percentile(loop_time, 99), loop_time.max()))
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1:
+        print(summary(sys.argv[1]))
+        replayed, worst = replay(sys.argv[1])
+        print('replayed %d ticks, largest differences: %s' % (replayed, worst))
+    else:
+        # record a simulated flight, then replay it: the follower and the kernel must reproduce the flight exactly
+        import io
+        import shutil
+        import tempfile
+        import contextlib
+        from GFOLD_sim import fly
+        from demo3_gfold import load_params
+
+        directory = tempfile.mkdtemp()
+        try:
+            params = load_params()
+            params['record_dir'] = directory
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = fly(params)
+            print('flight: %.2fs, landing mass %.1fkg' % (result['ut'], result['mass']))
+            print(summary(result['recording']))
+            start = time.perf_counter()
+            replayed, worst = replay(result['recording'])
+            print('replayed %d ticks in %.3fs, largest differences: %s' % (replayed, time.perf_counter() - start, worst))
+            assert max(worst.values()) < 1e-9
+            rec = recorder(os.path.join(directory, 'bench'), capacity=1024)
+            vessel_d = {name: np.ones(TICK[name].shape) for name in rec.telemetry}
+            start = time.perf_counter()
+            for k in range(20000):
+                row = rec.next()
+                rec.snapshot(vessel_d)
+                row['n_i'] = k
+            rec.close()
+            print('recorder: %.1fus per tick' % ((time.perf_counter() - start) / 20000 * 1e6))
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,183 @@
+import io
+import time
+import threading
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+''' Receding-horizon replanning in the background
+
+ Solves run in a worker process, so neither cvxpy nor the solver ever holds the
+ GIL of the control loop. request() only submits a job (at most one in flight)
+ and take() only reads the latest published plan, so the control loop never
+ waits on the solver.
+
+ A plan is published atomically (one reference swap) once its solve finishes,
+ unless it took longer than latency_budget seconds: the state it was planned
+ from was only predicted lead seconds ahead, so a late plan starts behind the
+ vessel. take() also refuses plans whose start state is older than max_age.
+
+ With service, the address of a running GFOLD_service, the solves go there
+ instead (from a thread, which only waits on the socket): no worker process to
+ start, and nothing to import or compile before the first plan.
+
+ With anytime, a deadline in seconds, every request is solved at several
+ resolutions at once (GFOLD_anytime): the finest plan in by the deadline is
+ published, each finer one arriving later is published as a new version (an
+ upgrade), under the same latency budget.
+
+'''
+
+
+class plan:
+    def __init__(self, version, t0, latency, result, path):
+        self.version = version
+        self.t0 = t0  # ut at which the plan starts (request ut + lead)
+        self.latency = latency  # wall time from request to publish
+        self.result = result  # (tf, x, u, m, s, z) as returned by solver.solve_direct
+        self.path = path  # the same solution on its own grid (solver.path), to warm start the next one
+
+
+def solve_plan(v_data, backend, verbose, engine, tf_search, warm_path, elapsed, cache_dir=None, adaptive=False):
+    # runs in the worker process
+    from GFOLD_run import solver
+    cache = None
+    if cache_dir:
+        import GFOLD_cache
+        cache = GFOLD_cache.open_store(cache_dir)
+    gfold = solver(v_data, backend, verbose, engine)
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = gfold.solve_direct(warm_path=warm_path, elapsed=elapsed, tf_search=tf_search, cache=cache, adaptive=adaptive)
+    return result, gfold.path
+
+
+def solve_remote(remote, v_data, tf_search, warm_path, elapsed, cache_dir=None, adaptive=False):
+    # runs on the replanner's thread, the solve in a GFOLD_service
+    return remote.solve(v_data, warm_path=warm_path, elapsed=elapsed, tf_search=tf_search, cache_dir=cache_dir, adaptive=adaptive)
+
+
+def solve_anytime(planner, v_data, deadline, warm_path, elapsed, tag):
+    # runs on the replanner's thread, the solves in GFOLD_anytime's workers
+    best = planner.solve(v_data, deadline, tag, warm_path=warm_path, elapsed=elapsed)
+    return (best.result, best.path) if best is not None else (None, None)
+
+
+class replanner:
+    def __init__(self, backend='auto', verbose=False, engine='cvxpy', tf_search=False, latency_budget=1.0, max_age=5.0, cache_dir=None,
+                 adaptive=False, service=None, anytime=0.0):
+        self.backend = backend
+        self.verbose = verbose
+        self.engine = engine
+        self.tf_search = tf_search
+        self.latency_budget = latency_budget
+        self.max_age = max_age
+        self.cache_dir = cache_dir  # GFOLD_cache store directory, None for no solution cache
+        self.adaptive = adaptive  # solve on adaptive meshes, see solver.solve_adaptive
+        self.remote = None  # GFOLD_service.client if the solves go to a service at address service
+        self.anytime = None  # GFOLD_anytime.anytime if the solves have a deadline of anytime seconds
+        self.deadline = anytime
+        if anytime > 0:
+            import GFOLD_anytime
+            self.anytime = GFOLD_anytime.anytime(backend=backend, engine=engine, on_upgrade=self.upgrade)
+            self.pool = ThreadPoolExecutor(max_workers=1)
+        elif service is not None:
+            import GFOLD_service
+            self.remote = GFOLD_service.client(service)
+            self.pool = ThreadPoolExecutor(max_workers=1)
+        else:
+            self.pool = ProcessPoolExecutor(max_workers=1)
+        self.lock = threading.Lock()
+        self.pending = None  # future of the solve in flight
+        self.settled = threading.Event()  # set once the solve in flight is published or dropped
+        self.settled.set()
+        self.latest = None  # last published plan
+        self.version = 0
+        self.rejected = 0  # plans dropped for being over the latency budget
+        self.failed = 0
+
+    def warm_up(self, v_data):
+        # start the worker and compile its problems before they are needed (a service has done that)
+        if self.anytime is not None:
+            self.anytime.warm_up(v_data)
+            return
+        if self.remote is not None:
+            self.pool.submit(self.remote.ping)
+            return
+        self.pool.submit(solve_plan, v_data, self.backend, False, self.engine, False, None, 0.0, self.cache_dir, self.adaptive)
+
+    def busy(self):
+        return self.pending is not None and not self.pending.done()
+
+    def request(self, v_data, ut, lead):
+        # plan from v_data, a state predicted lead seconds after ut; returns False if a solve is still running
+        if self.busy():
+            return False
+        previous = self.latest
+        warm_path = previous.path if previous is not None else None
+        elapsed = ut + lead - previous.t0 if previous is not None else 0.0
+        start = time.time()
+        self.settled.clear()
+        if self.anytime is not None:
+            future = self.pool.submit(solve_anytime, self.anytime, v_data, self.deadline, warm_path, elapsed, (ut + lead, start))
+        elif self.remote is not None:
+            future = self.pool.submit(solve_remote, self.remote, v_data, self.tf_search, warm_path, elapsed, self.cache_dir, self.adaptive)
+        else:
+            future = self.pool.submit(solve_plan, v_data, self.backend, self.verbose, self.engine, self.tf_search, warm_path, elapsed,
+                                      self.cache_dir, self.adaptive)
+        future.add_done_callback(lambda f: self.publish(f, ut + lead, start))
+        self.pending = future
+        return True
+
+    def publish(self, future, t0, start):
+        # runs on the executor's thread when the solve is done
+        try:
+            self.store(future, t0, time.time() - start)
+        finally:
+            self.settled.set()
+
+    def store(self, future, t0, latency):
+        try:
+            result, path = future.result()
+        except Exception as e:
+            print('replan error: %s' % e)
+            result = None
+        if result is None:
+            self.failed += 1
+            return
+        self.accept(t0, latency, result, path)
+
+    def accept(self, t0, latency, result, path):
+        # publish a solution that starts at t0 and took latency seconds; False if it is dropped
+        if latency > self.latency_budget:
+            self.rejected += 1
+            print('replan dropped, %.2fs over the %.2fs budget' % (latency, self.latency_budget))
+            return False
+        with self.lock:
+            latest = self.latest
+            if latest is not None and latest.t0 == t0 and latest.result[1].shape[1] >= result[1].shape[1]:
+                return False  # as fine a plan from the same start is out already (an anytime upgrade overtook it)
+            self.version += 1
+            self.latest = plan(self.version, t0, latency, result, path)
+            return True
+
+    def upgrade(self, best):
+        # a finer anytime plan after the deadline, on GFOLD_anytime's thread
+        t0, start = best.tag
+        self.accept(t0, time.time() - start, best.result, best.path)
+
+    def wait(self, timeout=None):
+        # block until the solve in flight is settled (lockstep simulation only, never in the control loop)
+        return self.settled.wait(timeout)
+
+    def take(self, ut, version=0):
+        # newest plan if it is newer than version and not stale, else None
+        latest = self.latest
+        if latest is None or latest.version <= version:
+            return None
+        if ut - latest.t0 > self.max_age:
+            return None
+        return latest
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        if self.anytime is not None:
+            self.anytime.shutdown()
@@ -1,13 +1,60 @@
-import time
+import logging
 import numpy as np
 import EvilPlotting as plot
+import GFOLD_trace
 
 N3 = 160  # p3 precision
 N4 = 80  # p4 precision
+N3_mesh = 48  # p3 precision on an adaptive mesh (solve_adaptive)
+N4_mesh = 40  # p4 precision on an adaptive mesh
+
+
+test_vessel = {
+    'Isp': 250,
+    'G_max': 100,
+    'V_max': 200,
+    'y_gs': np.radians(45),
+    'p_cs': np.radians(45),
+    'm_wet': 5.5e3,
+    'T_max': 168e3,
+    'throt': [0.1, 0.8],
+    'x0': np.array([1500, 150, 200, -50, 30, 20]),
+    'g': np.array([-9.8, 0, 0]),
+    'tf': 40,
+    'straight_fac': 5,
+}
+
+
+def resample_path(path, N, tf, t_shift=0.0, t_old=None, t_new=None):
+    # sample a solution (tf, x, u, m, s, z) on a grid of N nodes spanning tf seconds, starting
+    # t_shift seconds into it; nodes past its end keep the final (landed) values.
+    # t_old / t_new: node times of non-uniform grids (solver.pack_data(N, mesh)[5])
+    tf_old, x, u, m, s, z = path
+    if t_old is None:
+        t_old = np.arange(x.shape[1]) * (tf_old / x.shape[1])
+    t_new = t_shift + (np.arange(N) * (tf / N) if t_new is None else t_new)
+
+    def sample(a):
+        return np.array([np.interp(t_new, t_old, row) for row in a])
+
+    return sample(x), sample(u), sample(z[np.newaxis])[0], sample(s[np.newaxis])[0]
+
+
+def touchdown(t, x):
+    # time of the first node at rest on the target, None if there is none
+    for i in range(x.shape[1]):
+        if (np.linalg.norm(x[0:3, i]) + np.linalg.norm(x[3:6, i])) < 0.1:
+            return t[i]
+    return None
 
 
 class solver:
-    def __init__(self, v_data=None):
+    def __init__(self, v_data=None, backend='auto', verbose=False, engine='cvxpy', callback=None):
+        self.backend = backend  # see GFOLD_backend, 'auto' picks the fastest installed one
+        self.verbose = verbose  # solver logs
+        self.engine = engine  # 'cvxpy' (GFOLD_direct_exec) or 'sparse' (GFOLD_sparse, ECOS/Clarabel only)
+        self.callback = callback  # called with (trace, event) for every phase, see GFOLD_trace
+        self.trace = GFOLD_trace.trace('solver', callback)  # phases of the last solve
         self.g = None
         self.x0 = None
         self.straight_fac = None
@@ -22,10 +69,18 @@ class solver:
         self.G_max = None
         self.alpha = None
         self.Isp_inv = None
+        self.v_data = None
+        self.tf_curve = None  # per-candidate (tf, feasible, fuel, solve time) of the last tf search
+        self.path = None  # last solution on its own grid: (tf, x, u, m, s, z), tf of the p4 grid
+        self.p3_landing = None  # (x1, x2) where the last p3 came to rest: p4 lands on the target, p3 only as close as it can
+        self.mesh_path = None  # last p4 solution on an adaptive mesh: (t, x, u, m, s, z), t its node times
+        self.iterations = {}  # solver iterations per phase of the last solve
+        self.cache_hit = None  # 'hit' / 'warm' / None: what the solution cache gave the last solve_direct
         if v_data is not None:
             self.set_params(v_data)
 
     def set_params(self, v_data):
+        self.v_data = v_data
         self.Isp_inv = 1 / v_data['Isp']
         self.alpha = 1 / 9.80665 / v_data['Isp']
         self.G_max = v_data['G_max']
@@ -41,10 +96,14 @@ class solver:
         self.x0 = v_data['x0']
         self.g = v_data['g']
 
-    def pack_data(self, N):
+    def pack_data(self, N, mesh=None):
+        # mesh: node positions in [0, 1] (first 0, last 1), uniform if None; see GFOLD_mesh
         dt = self.tf_ / N
         alpha_dt = self.alpha * dt
-        t = np.linspace(0, (N - 1) * dt, N)
+        if mesh is None:
+            t = np.linspace(0, (N - 1) * dt, N)
+        else:
+            t = np.asarray(mesh) * ((N - 1) * dt)
         z0_term = self.m_wet - self.alpha * self.r2 * t
         z0_term_inv = (1 / z0_term)
         z0_term_log = np.log(z0_term)
@@ -52,48 +111,172 @@ class solver:
         g = self.g.reshape(3)
         sparse_params = np.array((alpha_dt, self.G_max, self.V_max, self.y_gs_cot, self.p_cs_cos, self.m_wet_log, self.r1, self.r2, self.tf_, self.straight_fac))
         sparse_params = sparse_params.reshape(len(sparse_params), 1)
-        return x0, z0_term_inv, z0_term_log, g, sparse_params
+        return x0, z0_term_inv, z0_term_log, g, sparse_params, t
 
-    def solve_direct(self):
-        print("------solve_direct-------")
+    def engine_function(self):
+        if self.engine == 'sparse':
+            import GFOLD_sparse as solver_sparse
+            return solver_sparse.GFOLD_sparse
         import GFOLD_direct_exec as solver_direct
-        start = time.time()
-        packed_data = self.pack_data(N3)
-        obj_opt, x, u, m, s, z = solver_direct.GFOLD_direct(N3, 'p3', packed_data)
+        return solver_direct.GFOLD_direct
+
+    def last_iterations(self, N, program):
+        if self.engine == 'sparse':
+            import GFOLD_sparse as solver_sparse
+            return solver_sparse.last_iterations.get((N, program))
+        import GFOLD_direct_exec as solver_direct
+        return solver_direct.get_problem(N, program).problem.solver_stats.num_iters
+
+    def solve_p4(self, N=N4, warm=None, mesh=None):
+        # p4 alone on the current tf_, returns the (tf, x, u, m, s, z) path or None; a solution on
+        # a mesh goes to mesh_path and is resampled onto the uniform N4 grid for path
+        packed_data = self.pack_data(N, mesh)
+        obj_opt, x, u, m, s, z = self.engine_function()(N, 'p4', packed_data, self.backend, self.verbose, warm, self.trace)
+        self.iterations['p4'] = self.last_iterations(N, 4)
         if obj_opt is None:
-            print('p3 failed')
             return None
-        tf_m = self.tf_
-        for i in range(x.shape[1]):
-            if (np.linalg.norm(x[0:3, i]) + np.linalg.norm(x[3:6, i])) < 0.1:
-                tf_m = i / x.shape[1] * self.tf_
-                break
-        print('tf_m:' + str(tf_m))
-        self.tf_ = tf_m + 0.1 * self.straight_fac
-        packed_data = self.pack_data(N4)
-        obj_opt, x, u, m, s, z = solver_direct.GFOLD_direct(N4, 'p4', packed_data)
-        if obj_opt is None:
-            print('p4 failed')
+        if mesh is not None:
+            self.mesh_path = (packed_data[5], x, u, m, s, z)
+            x, u, z, s = resample_path((self.tf_, x, u, m, s, z), N4, self.tf_, t_old=packed_data[5])
+            m = np.exp(z)
+        self.path = (self.tf_, x, u, m, s, z)
+        return self.path
+
+    def search_tf(self, N=N4, **kwargs):
+        # fuel-optimal tf by a parallel search (GFOLD_tf_search) of p4 on N nodes, returns the path or None
+        import GFOLD_tf_search
+        result = GFOLD_tf_search.search_tf(self.v_data, N, backend=self.backend, engine=self.engine, **kwargs)
+        self.tf_curve = result['curve']
+        if result['path'] is None:
+            return None
+        self.tf_ = result['tf']
+        self.path = result['path']
+        return self.path
+
+    def solve_direct(self, warm_start=True, warm_path=None, elapsed=0.0, tf_search=False, cache=None, adaptive=False, resolution=(N3, N4)):
+        # warm_start: start p4 from p3's trajectory resampled onto the p4 grid
+        # warm_path: previous solution (another solver's .path) to start p3 from, shifted by elapsed seconds
+        # tf_search: find the fuel-optimal tf instead of estimating it from p3 (see search_tf)
+        # cache: GFOLD_cache.store; a stored solution close enough is returned as is, a farther one
+        #        is the warm start (unless warm_path is given), new solutions are stored
+        # adaptive: solve on coarse adaptive meshes (solve_adaptive) instead of the N3 / N4 grids
+        # resolution: (p3, p4) nodes of the uniform grids (GFOLD_anytime solves several at once)
+        self.trace = trace = GFOLD_trace.trace('solve_direct', self.callback)
+        self.cache_hit = None
+        self.p3_landing = None
+        if cache is not None:
+            with trace.phase('cache_lookup') as info:
+                self.cache_hit, result, path = cache.lookup(self.v_data)
+                info['kind'] = self.cache_hit
+            if self.cache_hit == 'hit':
+                self.tf_, self.path = path[0], path
+                return result
+            if self.cache_hit == 'warm' and warm_path is None:
+                warm_path, elapsed = path, 0.0
+        if adaptive and not tf_search:
+            result = self.solve_adaptive(warm_start, warm_path, elapsed)
+        else:
+            result = self.solve_uncached(warm_start, warm_path, elapsed, tf_search, resolution)
+        if cache is not None and result is not None:
+            with trace.phase('cache_store'):
+                cache.put(self.v_data, result, self.path)
+        return result
+
+    def solve_uncached(self, warm_start, warm_path, elapsed, tf_search, resolution=(N3, N4)):
+        trace = self.trace
+        N3, N4 = resolution
+        with trace.phase('solve_direct', engine=self.engine, tf_search=tf_search, N3=N3, N4=N4) as info:
+            if tf_search:
+                with trace.phase('tf_search', N=N4):
+                    path = self.search_tf(N4, warm_path=warm_path, elapsed=elapsed)
+                if path is None:
+                    info.update(ok=False, failed='tf_search')
+                    return None
+                tf_m = touchdown(np.arange(N4) * (self.tf_ / N4), path[1])
+                if tf_m is None:
+                    tf_m = self.tf_
+                info.update(ok=True, tf=tf_m)
+                return (tf_m,) + path[1:]
+            GFOLD_solve = self.engine_function()
+            with trace.phase('pack_data', N=N3):
+                packed_data = self.pack_data(N3)
+                warm = resample_path(warm_path, N3, self.tf_, elapsed) if warm_path is not None else None
+            obj_opt, x, u, m, s, z = GFOLD_solve(N3, 'p3', packed_data, self.backend, self.verbose, warm, trace)
+            self.iterations['p3'] = self.last_iterations(N3, 3)
+            if obj_opt is None:
+                info.update(ok=False, failed='p3')
+                return None
+            self.p3_landing = x[1:3, -1].copy()
+            tf_3 = self.tf_
+            tf_m = touchdown(packed_data[5], x)
+            if tf_m is None:
+                tf_m = self.tf_
+            trace.mark('tf_m', tf_m=tf_m, miss=float(np.linalg.norm(self.p3_landing)))
+            self.tf_ = tf_m + 0.1 * self.straight_fac
+            warm = resample_path((tf_3, x, u, m, s, z), N4, self.tf_) if warm_start else None
+            if self.solve_p4(N4, warm) is None:
+                info.update(ok=False, failed='p4')
+                return None
+            info.update(ok=True, tf=tf_m)
+            return (tf_m,) + self.path[1:]
+
+    def solve_adaptive(self, warm_start=True, warm_path=None, elapsed=0.0, N3=N3_mesh, N4=N4_mesh, rounds=1):
+        # p3 and p4 on coarse grids whose nodes are moved to where the discretization error is
+        # (GFOLD_mesh): every program is solved, remeshed from its solution and solved again
+        # rounds times. The result is resampled onto solve_direct's uniform grid
+        import GFOLD_mesh
+        trace = self.trace
+        GFOLD_solve = self.engine_function()
+        with trace.phase('solve_adaptive', engine=self.engine, N3=N3, N4=N4, rounds=rounds) as info:
+            tf_3 = self.tf_
+            mesh = None
+            for k in range(rounds + 1):
+                with trace.phase('pack_data', N=N3, round=k):
+                    packed_data = self.pack_data(N3, mesh)
+                    t = packed_data[5]
+                    if k > 0:
+                        warm = resample_path((tf_3, x, u, m, s, z), N3, tf_3, t_old=t_old, t_new=t)
+                    else:
+                        warm = resample_path(warm_path, N3, tf_3, elapsed, t_new=t) if warm_path is not None else None
+                obj_opt, x, u, m, s, z = GFOLD_solve(N3, 'p3', packed_data, self.backend, self.verbose, warm, trace)
+                self.iterations['p3'] = self.last_iterations(N3, 3)
+                if obj_opt is None:
+                    info.update(ok=False, failed='p3')
+                    return None
+                t_old = t
+                if k < rounds:
+                    mesh = GFOLD_mesh.refine(t, u, N3)
+            self.p3_landing = x[1:3, -1].copy()
+            # touchdown as the vessel first rests on the ground; should p4 find that too short, on
+            # the target as solve_direct takes it, at last the whole horizon
+            p3_path = (tf_3, x, u, m, s, z)
+            for tf_m in sorted({tf for tf in (GFOLD_mesh.touchdown(t, x), touchdown(t, x), tf_3) if tf is not None}):
+                trace.mark('tf_m', tf_m=tf_m)
+                self.tf_ = tf_m + 0.1 * self.straight_fac
+                if self.solve_p4_adaptive(p3_path, t, N4, rounds, warm_start):
+                    info.update(ok=True, tf=tf_m, defect=float(GFOLD_mesh.defects(self.mesh_path[0], self.mesh_path[2]).max()))
+                    return (tf_m,) + self.path[1:]
+            info.update(ok=False, failed='p4')
             return None
-        print("------solved in %fs-------" % (time.time() - start))
-        return tf_m, x, u, m, s, z
 
+    def solve_p4_adaptive(self, path, t_old, N4, rounds, warm_start):
+        # p4 on the current tf_, first on a mesh refined from path (a solution at node times t_old),
+        # then rounds times on one refined from its own solution; False if a solve fails
+        import GFOLD_mesh
+        mesh = GFOLD_mesh.refine(t_old, path[2], N4, (N4 - 1) / N4 * self.tf_)
+        for k in range(rounds + 1):
+            t = self.pack_data(N4, mesh)[5]
+            warm = resample_path(path, N4, self.tf_, t_old=t_old, t_new=t) if warm_start else None
+            if self.solve_p4(N4, warm, mesh) is None:
+                return False
+            t_old, x, u, m, s, z = self.mesh_path
+            path = (self.tf_, x, u, m, s, z)
+            if k < rounds:
+                mesh = GFOLD_mesh.refine(t_old, u, N4)
+        return True
 
 if __name__ == '__main__':
-    test_vessel = {
-        'Isp': 250,
-        'G_max': 100,
-        'V_max': 200,
-        'y_gs': np.radians(45),
-        'p_cs': np.radians(45),
-        'm_wet': 5.5e3,
-        'T_max': 168e3,
-        'throt': [0.1, 0.8],
-        'x0': np.array([1500, 150, 200, -50, 30, 20]),
-        'g': np.array([-9.8, 0, 0]),
-        'tf': 40,
-        'straight_fac': 5,
-    }
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     try:
         plot.plot_run3D(*solver(test_vessel).solve_direct(), test_vessel)
     except TypeError:
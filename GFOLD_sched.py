@@ -0,0 +1,134 @@
+import time
+import collections
+import numpy as np
+
+''' Control loop timing
+
+ The loop is driven by the telemetry: tele.wait() blocks on the condition the
+ stream thread notifies once a new physics frame has arrived, so every tick
+ runs once per frame without polling ut. What was missing is knowing when it
+ falls behind, and in which part.
+
+ scheduler times every tick in stages. start() takes the snapshot (its
+ 'received' stamp and frame number), each mark(stage) closes the stage that
+ ran since the previous mark, end() closes the tick. Per stage a histogram on
+ log-spaced bins (1us .. 10s) plus the exact maximum is kept, so the stats of a
+ whole flight cost a few arrays. A tick misses its deadline when it ends more
+ than deadline seconds after its frame arrived (telemetry staleness included);
+ frames that arrived while the loop was busy and were never looked at are
+ counted as skipped. The last misses are kept with their stage times, ut and
+ nav mode: when, and why.
+
+'''
+
+BINS = np.logspace(-6, 1, 71)  # bin edges, seconds
+
+
+class scheduler:
+    def __init__(self, stages=('telemetry', 'guidance', 'planner', 'attitude', 'control_write'), deadline=0.02, keep=50):
+        self.stages = tuple(stages) + ('total',)
+        self.index = {name: i for i, name in enumerate(self.stages)}
+        self.deadline = deadline
+        self.histograms = np.zeros((len(self.stages), len(BINS) + 1), dtype=np.int64)
+        self.sums = np.zeros(len(self.stages))
+        self.maxima = np.zeros(len(self.stages))
+        self.times = np.zeros(len(self.stages))  # this tick's
+        self.ticks = 0
+        self.missed = 0
+        self.skipped = 0
+        self.misses = collections.deque(maxlen=keep)
+        self.frame = None
+        self.received = None
+        self.last = None
+
+    def start(self, snapshot):
+        # a tick for the telemetry snapshot; telemetry counts from its arrival to now
+        now = time.perf_counter()
+        self.times[:] = 0.0
+        self.received = snapshot.get('received', now)
+        if self.frame is not None and snapshot['frame'] > self.frame + 1:
+            self.skipped += snapshot['frame'] - self.frame - 1
+        self.frame = snapshot['frame']
+        self.last = self.received
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.times[self.index[stage]] += now - self.last
+        self.last = now
+
+    def end(self, ut=None, nav_mode=None):
+        self.times[-1] = time.perf_counter() - self.received
+        i = np.searchsorted(BINS, self.times)
+        self.histograms[np.arange(len(self.stages)), i] += 1
+        self.sums += self.times
+        np.maximum(self.maxima, self.times, out=self.maxima)
+        self.ticks += 1
+        if self.times[-1] > self.deadline:
+            self.missed += 1
+            self.misses.append({'ut': ut, 'frame': self.frame, 'nav_mode': nav_mode,
+                                'stages': dict(zip(self.stages, self.times.tolist()))})
+
+    def percentile(self, stage, q):
+        # upper bin edge below which q percent of the stage's times fall
+        counts = np.cumsum(self.histograms[self.index[stage]])
+        if counts[-1] == 0:
+            return 0.0
+        i = int(np.searchsorted(counts, q / 100 * counts[-1]))
+        return min(BINS[min(i, len(BINS) - 1)], self.maxima[self.index[stage]])
+
+    def stats(self):
+        # per stage count, mean, p50, p99, max (seconds); deadline misses and skipped frames
+        ticks = max(self.ticks, 1)
+        stages = {name: {'mean': self.sums[i] / ticks, 'p50': self.percentile(name, 50),
+                         'p99': self.percentile(name, 99), 'max': self.maxima[i]}
+                  for i, name in enumerate(self.stages)}
+        return {'ticks': self.ticks, 'deadline': self.deadline, 'missed': self.missed, 'skipped_frames': self.skipped,
+                'stages': stages, 'misses': list(self.misses)}
+
+    def report(self):
+        return report(self.stats())
+
+
+def report(stats):
+    # scheduler.stats() as text
+    lines = ['%d ticks, %d over the %.0fms deadline, %d frames skipped' % (
+        stats['ticks'], stats['missed'], stats['deadline'] * 1000, stats['skipped_frames'])]
+    for name, s in stats['stages'].items():
+        lines.append('  %-14s mean %7.3fms  p50 <%7.3fms  p99 <%7.3fms  max %7.3fms' % (
+            name, s['mean'] * 1000, s['p50'] * 1000, s['p99'] * 1000, s['max'] * 1000))
+    for miss in stats['misses'][-5:]:
+        worst = max((name for name in miss['stages'] if name != 'total'), key=miss['stages'].get)
+        lines.append('  missed at ut %.2f (%s): %.1fms, mostly %s %.1fms' % (
+            miss['ut'] or 0.0, miss['nav_mode'], miss['stages']['total'] * 1000, worst, miss['stages'][worst] * 1000))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import io
+    import contextlib
+    from GFOLD_sim import fly
+    from demo3_gfold import load_params
+
+    # a few synthetic ticks: one overrunning in guidance, one frame skipped
+    sched = scheduler(deadline=0.005)
+    for frame, slow in ((1, 0.0), (2, 0.008), (4, 0.0)):
+        sched.start({'frame': frame, 'received': time.perf_counter()})
+        for stage in sched.stages[:-1]:
+            if stage == 'guidance':
+                time.sleep(slow)
+            sched.mark(stage)
+        sched.end(frame * 0.02, 'gfold')
+    stats = sched.stats()
+    assert stats['missed'] == 1 and stats['skipped_frames'] == 1 and stats['misses'][0]['stages']['guidance'] >= 0.008
+    start = time.perf_counter()
+    for k in range(10000):
+        sched.start({'frame': 5 + k, 'received': time.perf_counter()})
+        for stage in sched.stages[:-1]:
+            sched.mark(stage)
+        sched.end()
+    print('scheduler: %.1fus per tick of 5 stages' % ((time.perf_counter() - start) / 10000 * 1e6))
+
+    params = load_params()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = fly(params)
+    print(report(result['timing']))
@@ -0,0 +1,270 @@
+import json
+import time
+import socket
+import struct
+import numpy as np
+
+''' Solver service
+
+ A long-running local process that has imported cvxpy and compiled the GFOLD
+ problems before anyone asks for a trajectory:
+
+     python GFOLD_service.py [port]
+
+ serve() compiles the configured sizes (N3 / N4, and the adaptive mesh sizes)
+ for the engine and backend given, then answers requests on a TCP socket on
+ localhost (AF_UNIX is not there on every Windows KSP install). Every client
+ connection gets a thread, solves take turns on one lock (the compiled
+ problems hold their parameter values).
+
+ Messages both ways are a 8 byte prefix (header length, payload length), a JSON
+ header and a payload of float64 arrays, back to back, whose names and shapes
+ the header lists; the trajectories travel as raw bytes, not as text.
+
+ client is all a caller needs: it imports nothing but the standard library and
+ numpy (cvxpy and the solver stay in the service), connects on the first
+ request and reconnects once if the service was restarted. client.solve takes
+ the arguments of solver.solve_direct and returns (result, path) like
+ GFOLD_replan.solve_plan.
+
+'''
+
+PORT = 50600
+PREFIX = struct.Struct('<II')
+
+
+def receive_exactly(sock, size):
+    data = bytearray(size)
+    view = memoryview(data)
+    while size:
+        count = sock.recv_into(view, size)
+        if count == 0:
+            raise ConnectionError('connection closed')
+        view = view[count:]
+        size -= count
+    return data
+
+
+def send_message(sock, header, arrays=None):
+    # header: JSON-able dict; arrays: {name: ndarray}, sent as float64 in that order
+    arrays = arrays or {}
+    header = dict(header, arrays=[(name, list(np.shape(a))) for name, a in arrays.items()])
+    head = json.dumps(header).encode()
+    payload = b''.join(np.ascontiguousarray(a, dtype='<f8').tobytes() for a in arrays.values())
+    sock.sendall(PREFIX.pack(len(head), len(payload)) + head + payload)
+
+
+def receive_message(sock):
+    # (header, {name: ndarray})
+    head_size, payload_size = PREFIX.unpack(receive_exactly(sock, PREFIX.size))
+    header = json.loads(receive_exactly(sock, head_size))
+    payload = np.frombuffer(receive_exactly(sock, payload_size), dtype='<f8')
+    arrays = {}
+    offset = 0
+    for name, shape in header.pop('arrays'):
+        size = int(np.prod(shape))
+        arrays[name] = payload[offset:offset + size].reshape(shape)
+        offset += size
+    return header, arrays
+
+
+def encode_v_data(v_data):
+    return {key: np.asarray(value).tolist() if isinstance(value, (np.ndarray, list, tuple)) else value
+            for key, value in v_data.items()}
+
+
+def decode_v_data(v_data):
+    return {key: np.array(value) if key in ('x0', 'g') else value for key, value in v_data.items()}
+
+
+def path_arrays(path):
+    tf, x, u, m, s, z = path
+    return {'x': x, 'u': u, 'm': m, 's': s, 'z': z}
+
+
+class client:
+    def __init__(self, address=('127.0.0.1', PORT), timeout=30.0):
+        self.address = tuple(address)
+        self.timeout = timeout
+        self.sock = None
+        self.last = None  # reply header of the last request: ok, error, solve_time, cache_hit, ...
+
+    def connect(self):
+        self.sock = socket.create_connection(self.address, self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def request(self, header, arrays=None):
+        # retried once on a new connection if it could not be sent (the service restarted); once sent it is
+        # never sent again: a read timeout means the service is busy with it, and raises
+        for attempt in (0, 1):
+            try:
+                if self.sock is None:
+                    self.connect()
+                send_message(self.sock, header, arrays)
+                break
+            except OSError:
+                self.close()
+                if attempt:
+                    raise
+        try:
+            return receive_message(self.sock)
+        except OSError:
+            self.close()  # the reply of this request must not be read as the next one's
+            raise
+
+    def solve(self, v_data, warm_start=True, warm_path=None, elapsed=0.0, tf_search=False, cache_dir=None, adaptive=False):
+        # solver.solve_direct in the service: (result, path), (None, None) if it failed
+        header = {'op': 'solve', 'v_data': encode_v_data(v_data), 'warm_start': warm_start, 'elapsed': elapsed,
+                  'tf_search': tf_search, 'cache_dir': cache_dir, 'adaptive': adaptive}
+        arrays = None
+        if warm_path is not None:
+            header['warm_tf'] = warm_path[0]
+            arrays = path_arrays(warm_path)
+        self.last, arrays = self.request(header, arrays)
+        if not self.last['ok']:
+            return None, None
+        path = (self.last['tf'], arrays['x'], arrays['u'], arrays['m'], arrays['s'], arrays['z'])
+        return (self.last['tf_m'],) + path[1:], path
+
+    def ping(self):
+        # the service's status: pid, uptime, solves, compiled sizes
+        self.last, _ = self.request({'op': 'ping'})
+        return self.last
+
+    def shutdown(self):
+        self.request({'op': 'shutdown'})
+        self.close()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def parse_address(text):
+    # 'host:port', ':port' or 'port' -> (host, port)
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def available(address=('127.0.0.1', PORT)):
+    # True if a service answers at address
+    try:
+        client(address, timeout=1.0).ping()
+        return True
+    except OSError:
+        return False
+
+
+def serve(port=PORT, engine='cvxpy', backend='auto', sizes=None, host='127.0.0.1'):
+    # compile, then answer requests until a shutdown request
+    import io
+    import os
+    import threading
+    import contextlib
+    import socketserver
+    from GFOLD_run import solver, test_vessel, N3, N4, N3_mesh, N4_mesh
+
+    sizes = sizes or ((N3, 'p3'), (N4, 'p4'), (N3_mesh, 'p3'), (N4_mesh, 'p4'))
+    start = time.time()
+    warm_up = solver(test_vessel, backend, False, engine)
+    for N, pmark in sizes:
+        with contextlib.redirect_stdout(io.StringIO()):
+            warm_up.engine_function()(N, pmark, warm_up.pack_data(N), backend)
+    print('GFOLD service: %s compiled in %.1fs, listening on %s:%d' % (
+        ', '.join('%s N=%d' % (pmark, N) for N, pmark in sizes), time.time() - start, host, port))
+
+    lock = threading.Lock()
+    status = {'pid': os.getpid(), 'started': time.time(), 'solves': 0, 'engine': engine, 'backend': backend,
+              'compiled': [[N, pmark] for N, pmark in sizes]}
+
+    def solve(header, arrays):
+        warm_path = None
+        if 'warm_tf' in header:
+            warm_path = (header['warm_tf'], arrays['x'], arrays['u'], arrays['m'], arrays['s'], arrays['z'])
+        cache = None
+        if header['cache_dir']:
+            import GFOLD_cache
+            cache = GFOLD_cache.open_store(header['cache_dir'])
+        gfold = solver(decode_v_data(header['v_data']), backend, False, engine)
+        solve_start = time.perf_counter()
+        with lock, contextlib.redirect_stdout(io.StringIO()):
+            result = gfold.solve_direct(header['warm_start'], warm_path, header['elapsed'], header['tf_search'], cache, header['adaptive'])
+            status['solves'] += 1
+        reply = {'ok': result is not None, 'solve_time': time.perf_counter() - solve_start, 'cache_hit': gfold.cache_hit}
+        if result is None:
+            return reply, None
+        reply.update(tf_m=float(result[0]), tf=float(gfold.path[0]))
+        return reply, path_arrays(gfold.path)
+
+    class handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            while True:
+                try:
+                    header, arrays = receive_message(self.request)
+                except ConnectionError:
+                    return
+                op = header.get('op')
+                try:
+                    if op == 'solve':
+                        reply, arrays = solve(header, arrays)
+                    elif op == 'ping':
+                        reply, arrays = dict(status, ok=True, uptime=time.time() - status['started']), None
+                    elif op == 'shutdown':
+                        send_message(self.request, {'ok': True})
+                        threading.Thread(target=self.server.shutdown).start()
+                        return
+                    else:
+                        reply, arrays = {'ok': False, 'error': 'unknown op %r' % op}, None
+                except Exception as e:
+                    reply, arrays = {'ok': False, 'error': repr(e)}, None
+                send_message(self.request, reply, arrays)
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    with socketserver.ThreadingTCPServer((host, port), handler) as server:
+        server.daemon_threads = True
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    import sys
+    if '--check' in sys.argv:
+        # start a service, then time a fresh client's first trajectory against an in-process cold start
+        import subprocess
+        service = subprocess.Popen([sys.executable, __file__, str(PORT + 1)])
+        try:
+            address = ('127.0.0.1', PORT + 1)
+            while not available(address):
+                time.sleep(0.2)
+            from GFOLD_run import test_vessel
+            start = time.time()
+            remote = client(address)
+            result, path = remote.solve(test_vessel)
+            first = time.time() - start
+            print('service: first trajectory %.3fs after connecting (solve %.3fs), tf_m %.2f, %d nodes' % (
+                first, remote.last['solve_time'], result[0], path[1].shape[1]))
+            result, path = remote.solve(test_vessel, warm_path=path, elapsed=1.0)
+            assert result is not None and path[1].shape == (6, 80)
+            start = time.time()
+            cold = subprocess.run([sys.executable, '-c', 'from GFOLD_run import solver, test_vessel; solver(test_vessel).solve_direct()'])
+            print('in process: first trajectory %.3fs after starting python' % (time.time() - start))
+            # a reply that is late raises, and the solve is not sent a second time
+            solves = remote.ping()['solves']
+            hasty = client(address)
+            hasty.connect()
+            hasty.sock.settimeout(0.001)
+            try:
+                hasty.solve(test_vessel)
+                raise AssertionError('the reply came within 1ms')
+            except TimeoutError:
+                pass
+            while remote.ping()['solves'] == solves:
+                time.sleep(0.05)
+            time.sleep(1.0)
+            assert remote.ping()['solves'] == solves + 1, 'a timed out solve was sent again'
+            remote.shutdown()
+        finally:
+            service.wait(10)
+    else:
+        serve(int(sys.argv[1]) if len(sys.argv) > 1 else PORT)
@@ -0,0 +1,301 @@
+import time
+import numpy as np
+
+''' Headless stand-in for KSP + kRPC
+
+ A rigid-body rocket over flat ground in the landing target's surface frame
+ (x up, y north, z east, origin at the target), implementing the part of the
+ kRPC API demo3_gfold uses: space_center.ut / active_vessel / ReferenceFrame,
+ vessel position, velocity, rotation, angular velocity, mass, thrust, Isp and
+ control, drawing lines, and streams with update callbacks (GFOLD_telemetry).
+
+ Every reference frame shares the surface axes; the first target frame is
+ fixed at the origin whatever lat/lon it is created from, target frames
+ created after it (divert pads) at their offset from it, the vessel's own
+ frames move with it. Thrust acts along the vessel's y axis (nose) and burns
+ mass at T / (Isp g0); pitch/yaw/roll inputs command torques about the
+ vessel's x/z/y axes through a first order lag. Touching the ground (x <= 0) stops the vessel
+ and records the touchdown velocity.
+
+ conn.step() simulates one physics frame and then calls the stream update
+ callbacks, so run(conn, params, lockstep=True) simulates exactly one frame
+ per control tick, as fast as the controller runs.
+
+'''
+
+G0 = 9.80665
+
+
+def skew(w):
+    return np.array([[0, -w[2], w[1]], [w[2], 0, -w[0]], [-w[1], w[0], 0]])
+
+
+def rotation_exp(w):
+    # rotation matrix of the rotation vector w (Rodrigues)
+    angle = np.linalg.norm(w)
+    if angle < 1e-12:
+        return np.eye(3) + skew(w)
+    k = skew(w / angle)
+    return np.eye(3) + np.sin(angle) * k + (1 - np.cos(angle)) * k @ k
+
+
+def quaternion(R):
+    # (x, y, z, w) of the rotation matrix R
+    w = np.sqrt(max(0.0, 1 + R[0, 0] + R[1, 1] + R[2, 2])) / 2
+    x = np.sqrt(max(0.0, 1 + R[0, 0] - R[1, 1] - R[2, 2])) / 2
+    y = np.sqrt(max(0.0, 1 - R[0, 0] + R[1, 1] - R[2, 2])) / 2
+    z = np.sqrt(max(0.0, 1 - R[0, 0] - R[1, 1] + R[2, 2])) / 2
+    x = np.copysign(x, R[2, 1] - R[1, 2])
+    y = np.copysign(y, R[0, 2] - R[2, 0])
+    z = np.copysign(z, R[1, 0] - R[0, 1])
+    return x, y, z, w
+
+
+def attitude(direction):
+    # vessel-to-surface rotation with the nose (vessel y) along direction
+    y = direction / np.linalg.norm(direction)
+    x = np.cross(y, (0, 0, 1.0) if abs(y[2]) < 0.9 else (0, 1.0, 0))
+    x /= np.linalg.norm(x)
+    z = np.cross(x, y)
+    return np.column_stack((x, y, z))
+
+
+vessel_default = {
+    'x0': np.array([1400, 120, -90, -45, 4, 3]),  # position and velocity relative to the target
+    'direction0': np.array([1, 0, 0]),  # initial nose direction
+    'mass': 10000,
+    'dry_mass': 6000,
+    'max_thrust': 250e3,
+    'Isp': 300,
+    'moment_of_inertia': np.array([40000, 4000, 40000]),  # about the vessel's x, y (roll), z axes
+    'max_torque': np.array([3.2e6, 3.2e5, 3.2e6]),
+    'control_sign': np.array([-1, -1, -1]),  # torque sign of pitch (x), roll (y), yaw (z) inputs
+    'control_lag': 0.1,  # s
+    'drag_area': 1.0,  # Cd * A, m^2
+    'air_density': 1.2,
+    'g0': 9.807,
+    'wind': np.zeros(3),
+    'dt': 0.02,  # physics frame
+}
+
+
+class frame:
+    def __init__(self, origin=lambda: np.zeros(3), velocity=lambda: np.zeros(3)):
+        self.origin = origin
+        self.velocity = velocity
+
+
+class line:
+    # every attribute set is a remote call in kRPC; drawing.calls counts them
+    def __init__(self, drawing, start, end, reference_frame):
+        self.__dict__.update(drawing=drawing, start=start, end=end, reference_frame=reference_frame, color=(1, 1, 1))
+
+    def __setattr__(self, name, value):
+        self.drawing.calls += 1
+        self.__dict__[name] = value
+
+    def remove(self):
+        pass
+
+
+class drawing:
+    def __init__(self):
+        self.lines = []
+        self.calls = 0
+
+    def add_line(self, start, end, reference_frame, visible=True):
+        new = line(self, start, end, reference_frame)
+        self.lines.append(new)
+        self.calls += 1
+        return new
+
+
+class reference_frame_factory:
+    def __init__(self):
+        self.target = None  # body frame position the first target frame was created at
+
+    def create_relative(self, reference_frame, position=(0, 0, 0), **kwargs):
+        # the first target frame is the origin; later ones (divert pads) sit where their position is relative
+        # to it, on the flat ground: height difference, north, east
+        from GFOLD_divert import surface_axes
+        position = np.asarray(position, dtype=float)
+        if self.target is None:
+            self.target = position
+        offset = surface_axes(self.target) @ (position - self.target)
+        offset[0] = np.linalg.norm(position) - np.linalg.norm(self.target)
+        return frame(lambda: offset)
+
+    def create_hybrid(self, position, rotation=None, velocity=None, angular_velocity=None):
+        return position
+
+
+class body:
+    equatorial_radius = 600000.0
+    reference_frame = frame()
+
+    def surface_height(self, lat, lon):
+        return 0.0
+
+
+class orbit:
+    body = body()
+
+
+class control:
+    def __init__(self):
+        self.throttle = 0.0
+        self.pitch = 0.0
+        self.yaw = 0.0
+        self.roll = 0.0
+        self.gear = False
+
+
+class vessel:
+    def __init__(self, config):
+        self.config = config
+        self.r = np.array(config['x0'][0:3], dtype=float)
+        self.v = np.array(config['x0'][3:6], dtype=float)
+        self.R = attitude(np.asarray(config['direction0'], dtype=float))  # vessel to surface
+        self.w = np.zeros(3)  # angular velocity, vessel axes
+        self.torque = np.zeros(3)
+        self._mass = float(config['mass'])
+        self.control = control()
+        self.orbit = orbit()
+        self.reference_frame = frame(lambda: self.r, lambda: self.v)
+        self.surface_reference_frame = frame(lambda: self.r)
+        self.landed = False
+        self.touchdown = None  # (position, velocity) at touchdown
+
+    def flight(self, reference_frame=None):
+        return self
+
+    def position(self, reference_frame):
+        return tuple(self.r - reference_frame.origin())
+
+    def velocity(self, reference_frame):
+        return tuple(self.v - reference_frame.velocity())
+
+    def rotation(self, reference_frame):
+        return quaternion(self.R)
+
+    def angular_velocity(self, reference_frame):
+        return tuple(self.R @ self.w)
+
+    @property
+    def mass(self):
+        return self._mass
+
+    @property
+    def max_thrust(self):
+        return self.config['max_thrust'] if self._mass > self.config['dry_mass'] else 0.0
+
+    @property
+    def specific_impulse(self):
+        return self.config['Isp']
+
+    @property
+    def moment_of_inertia(self):
+        return tuple(self.config['moment_of_inertia'])
+
+    def step(self, dt):
+        if self.landed:
+            return
+        c = self.config
+        ctrl = self.control
+        thrust = float(np.clip(ctrl.throttle, 0, 1)) * self.max_thrust
+        nose = self.R[:, 1]
+        air = self.v - c['wind']
+        drag = -0.5 * c['air_density'] * c['drag_area'] * np.linalg.norm(air) * air
+        a = (thrust * nose + drag) / self._mass + np.array([-c['g0'], 0, 0])
+        self.v += a * dt
+        self.r += self.v * dt
+        self._mass = max(c['dry_mass'], self._mass - thrust / (c['Isp'] * G0) * dt)
+
+        inputs = np.clip((ctrl.pitch, ctrl.roll, ctrl.yaw), -1, 1)
+        target = c['control_sign'] * inputs * c['max_torque']
+        self.torque += (target - self.torque) * min(1.0, dt / c['control_lag'])
+        inertia = np.asarray(c['moment_of_inertia'], dtype=float)
+        self.w += (self.torque - np.cross(self.w, inertia * self.w)) / inertia * dt
+        self.R = self.R @ rotation_exp(self.w * dt)
+
+        if self.r[0] <= 0:
+            self.touchdown = (self.r.copy(), self.v.copy())
+            self.r[0] = 0.0
+            self.v[:] = 0.0
+            self.w[:] = 0.0
+            self.landed = True
+
+
+class space_center:
+    def __init__(self, vessel):
+        self.ut = 0.0
+        self.active_vessel = vessel
+        self.ReferenceFrame = reference_frame_factory()
+
+
+class stream:
+    def __init__(self, conn, value):
+        self.conn = conn
+        self.value = value
+
+    def __call__(self):
+        return self.value()
+
+    def remove(self):
+        pass
+
+
+class sim:
+    # stands in for a krpc connection
+    def __init__(self, config=None):
+        self.config = dict(vessel_default, **(config or {}))
+        self.space_center = space_center(vessel(self.config))
+        self.drawing = drawing()
+        self.callbacks = []
+        self.frames = 0
+
+    def add_stream(self, func, *args, **kwargs):
+        return stream(self, lambda: func(*args, **kwargs))
+
+    def add_stream_update_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def remove_stream_update_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def step(self):
+        dt = self.config['dt']
+        self.space_center.active_vessel.step(dt)
+        self.space_center.ut += dt
+        self.frames += 1
+        for callback in list(self.callbacks):
+            callback()
+
+    def close(self):
+        pass
+
+
+def fly(params, config=None):
+    # one closed-loop landing with demo3_gfold.run, returns its summary plus the touchdown state
+    import demo3_gfold
+    conn = sim(config)
+    start = time.time()
+    result = demo3_gfold.run(conn, params, lockstep=True)
+    result['wall_time'] = time.time() - start
+    result['frames'] = conn.frames
+    result['touchdown'] = conn.space_center.active_vessel.touchdown
+    return result
+
+
+if __name__ == '__main__':
+    import contextlib
+    import io
+    from demo3_gfold import load_params
+    params = load_params()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = fly(params)
+    print('flight %.2fs simulated in %.2fs (%d frames), %d plans, mode %s' % (
+        result['ut'], result['wall_time'], result['frames'], result['plans'], result['nav_mode']))
+    print('error %s, velocity %s, mass %.1fkg' % (np.round(result['error'], 2), np.round(result['vel'], 2), result['mass']))
+    if result['touchdown'] is not None:
+        print('touchdown at %s, %s m/s' % (np.round(result['touchdown'][0], 2), np.round(result['touchdown'][1], 2)))
@@ -0,0 +1,335 @@
+import time
+import numpy as np
+import scipy.sparse as sp
+import GFOLD_backend as backends
+import GFOLD_trace
+from GFOLD_direct_exec import param_values
+
+''' Direct conic assembly of the GFOLD problems, without cvxpy
+
+ Same problems as GFOLD_direct_exec (p3 / p4, same constraints, same objective),
+ written straight into the standard form
+
+     minimize c'x  s.t.  A x = b,  G x + s_ = h,  s_ in K = R+^l x Q^q1 x ... x Q^qk
+
+ that ECOS and Clarabel take. The sparsity pattern only depends on (N, program) and
+ is built once (structure); every nonzero of A, G and entry of b, h, c is
+ coef * pvec[kind], where pvec holds the Parameter values from param_values, so a
+ solve only rewrites the data arrays of fixed CSC matrices.
+
+ Variables are ordered node by node, NV per node: r(3) v(3) u(3) z s t q
+   t: epigraph of the objective norm at that node
+   q: epigraph of (z - z0)^2 for the Taylor-expanded lower thrust bound
+
+'''
+
+NV = 13  # variables per node
+R, V, U, Z, S, T, Q = 0, 3, 6, 9, 10, 11, 12  # offsets inside a node
+
+structure_cache = {}  # (N, program) -> structure
+clarabel_cache = {}  # (N, program) -> clarabel solver, updated in place
+
+
+def param_layout(N):
+    # offset of every Parameter in pvec; pvec[0] is the constant 1
+    layout = {}
+    offset = 0
+    for name, size in (('one', 1), ('y_gs_cot', 1), ('p_cs_cos', 1), ('V_max', 1), ('m_wet_log', 1), ('x0', 6),
+                       ('half_dt', N - 1), ('half_alpha_dt', N - 1), ('dt_g', 3 * (N - 1)),
+                       ('z0_term_log', N), ('mu_1_inv', N), ('mu_2_inv', N), ('weights', N), ('straight_weights', N)):
+        layout[name] = offset
+        offset += size
+    return layout, offset
+
+
+class rows:
+    # rows of a constraint block as triplets; coefficients are coef * pvec[kind]
+    def __init__(self):
+        self.count = 0
+        self.r, self.c, self.coef, self.kind = [], [], [], []  # matrix entries
+        self.rhs_r, self.rhs_coef, self.rhs_kind = [], [], []  # right hand side entries
+
+    def add(self, terms, rhs=()):
+        for col, coef, kind in terms:
+            self.r.append(self.count)
+            self.c.append(col)
+            self.coef.append(coef)
+            self.kind.append(kind)
+        for coef, kind in rhs:
+            self.rhs_r.append(self.count)
+            self.rhs_coef.append(coef)
+            self.rhs_kind.append(kind)
+        self.count += 1
+
+
+class pattern:
+    # fixed-pattern CSC matrix whose data is rewritten from pvec
+    def __init__(self, r, c, coef, kind, shape):
+        nnz = len(r)
+        order = sp.csc_matrix((np.arange(1, nnz + 1, dtype=float), (r, c)), shape=shape)
+        self.matrix = order.copy()
+        self.perm = order.data.astype(int) - 1  # position in the triplets of every CSC entry
+        self.coef = np.asarray(coef, dtype=float)[self.perm]
+        self.kind = np.asarray(kind, dtype=int)[self.perm]
+
+    def update(self, pvec):
+        self.matrix.data[:] = self.coef * pvec[self.kind]
+        return self.matrix
+
+
+class vector:
+    # dense vector assembled as a sum of coef * pvec[kind] entries
+    def __init__(self, r, coef, kind, size):
+        self.r = np.asarray(r, dtype=int)
+        self.coef = np.asarray(coef, dtype=float)
+        self.kind = np.asarray(kind, dtype=int)
+        self.size = size
+
+    def update(self, pvec):
+        return np.bincount(self.r, weights=self.coef * pvec[self.kind], minlength=self.size)
+
+
+class structure:
+    def __init__(self, N, program):
+        self.N = N
+        self.program = program
+        self.n_var = N * NV
+        self.layout, self.n_param = param_layout(N)
+        P = self.layout
+        one = P['one']
+
+        def var(n, k):
+            return n * NV + k
+
+        # ---- equalities A x = b
+        eq = rows()
+        for i in range(6):
+            eq.add([(var(0, i), 1, one)], [(1, P['x0'] + i)])  # initial pos and vel
+        for i in range(3):
+            eq.add([(var(N - 1, V + i), 1, one)])  # don't forget to slow down, buddy!
+        eq.add([(var(N - 1, S), 1, one)])  # thrust at the end must be zero
+        for n in (0, N - 1):  # thrust direction starts and ends straight
+            eq.add([(var(n, U), 1, one), (var(n, S), -1, one)])
+            eq.add([(var(n, U + 1), 1, one)])
+            eq.add([(var(n, U + 2), 1, one)])
+        eq.add([(var(0, Z), 1, one)], [(1, P['m_wet_log'])])  # convexified (7)
+        if program == 3:
+            eq.add([(var(N - 1, R), 1, one)])
+        else:
+            for i in range(3):
+                eq.add([(var(N - 1, R + i), 1, one)])  # force landing point equal to O
+        eq.add([(var(0, Q), 1, one)])  # no thrust bounds on the first and last node
+        eq.add([(var(N - 1, Q), 1, one)])
+        for n in range(N - 1):
+            for i in range(3):
+                eq.add([(var(n + 1, V + i), 1, one), (var(n, V + i), -1, one),
+                        (var(n, U + i), -1, P['half_dt'] + n), (var(n + 1, U + i), -1, P['half_dt'] + n)],
+                       [(1, P['dt_g'] + 3 * n + i)])
+            for i in range(3):
+                eq.add([(var(n + 1, R + i), 1, one), (var(n, R + i), -1, one),
+                        (var(n, V + i), -1, P['half_dt'] + n), (var(n + 1, V + i), -1, P['half_dt'] + n)])
+            eq.add([(var(n + 1, Z), 1, one), (var(n, Z), -1, one),
+                    (var(n, S), 1, P['half_alpha_dt'] + n), (var(n + 1, S), 1, P['half_alpha_dt'] + n)])  # mass decreases
+
+        # ---- linear inequalities G x <= h
+        lp = rows()
+        for n in range(N - 1):
+            lp.add([(var(n, S), 1, P['p_cs_cos']), (var(n, U), -1, one)])  # thrust pointing
+            if n > 0:
+                # mu_2_inv * s <= 1 - (z - z0), upper thrust bound
+                lp.add([(var(n, S), 1, P['mu_2_inv'] + n), (var(n, Z), 1, one)],
+                       [(1, one), (1, P['z0_term_log'] + n)])
+                # mu_1_inv * s >= 1 - (z - z0) + q / 2, lower thrust bound
+                lp.add([(var(n, S), -1, P['mu_1_inv'] + n), (var(n, Z), -1, one), (var(n, Q), 0.5, one)],
+                       [(-1, one), (-1, P['z0_term_log'] + n)])
+
+        # ---- second order cones, h - G x = (t, w) with t >= |w|
+        soc = rows()
+        cones = []
+        for n in range(N - 1):
+            # glideslope cone
+            soc.add([(var(n, R), -1, P['y_gs_cot'])])
+            soc.add([(var(n, R + 1), -1, one)])
+            soc.add([(var(n, R + 2), -1, one)])
+            # velocity
+            soc.add([], [(1, P['V_max'])])
+            for i in range(3):
+                soc.add([(var(n, V + i), -1, one)])
+            # thrust magnitude
+            soc.add([(var(n, S), -1, one)])
+            for i in range(3):
+                soc.add([(var(n, U + i), -1, one)])
+            cones += [3, 4, 4]
+        for n in range(N):
+            # objective epigraph
+            soc.add([(var(n, T), -1, one)])
+            if program == 3:
+                for i in range(3):
+                    soc.add([(var(n, R + i), -1, one)])
+                cones += [4]
+            else:
+                for i in (1, 2):
+                    soc.add([(var(n, V + i), -1, one)])
+                cones += [3]
+        for n in range(1, N - 1):
+            # q >= (z - z0)^2 as (q + 1, 2 (z - z0), q - 1)
+            soc.add([(var(n, Q), -1, one)], [(1, one)])
+            soc.add([(var(n, Z), -2, one)], [(-2, P['z0_term_log'] + n)])
+            soc.add([(var(n, Q), -1, one)], [(-1, one)])
+            cones += [3]
+
+        # ---- objective
+        c_r, c_coef, c_kind = [], [], []
+        for n in range(N):
+            c_r.append(var(n, T))
+            c_coef.append(1)
+            c_kind.append((P['weights'] if program == 3 else P['straight_weights']) + n)
+        if program == 4:
+            c_r.append(var(N - 1, Z))
+            c_coef.append(-N)
+            c_kind.append(one)
+
+        self.dims = {'l': lp.count, 'q': cones}
+        self.n_eq = eq.count
+        self.n_ineq = lp.count + soc.count
+        G_r = lp.r + [lp.count + r for r in soc.r]
+        h_r = lp.rhs_r + [lp.count + r for r in soc.rhs_r]
+        self.A = pattern(eq.r, eq.c, eq.coef, eq.kind, (eq.count, self.n_var))
+        self.b = vector(eq.rhs_r, eq.rhs_coef, eq.rhs_kind, eq.count)
+        self.G = pattern(G_r, lp.c + soc.c, lp.coef + soc.coef, lp.kind + soc.kind, (self.n_ineq, self.n_var))
+        self.h = vector(h_r, lp.rhs_coef + soc.rhs_coef, lp.rhs_kind + soc.rhs_kind, self.n_ineq)
+        # A and G stacked, for Clarabel
+        self.AG = pattern(eq.r + [eq.count + r for r in G_r], eq.c + lp.c + soc.c,
+                          eq.coef + lp.coef + soc.coef, eq.kind + lp.kind + soc.kind,
+                          (eq.count + self.n_ineq, self.n_var))
+        self.c = vector(c_r, c_coef, c_kind, self.n_var)
+
+    def pvec(self, N, packed_data):
+        pvec = np.zeros(self.n_param)
+        pvec[0] = 1
+        for name, value in param_values(N, packed_data).items():
+            offset = self.layout[name]
+            pvec[offset:offset + np.size(value)] = np.ravel(value, order='F')  # dt_g node by node
+        return pvec
+
+    def unpack(self, sol):
+        # primal vector -> x, u, z, s
+        nodes = sol.reshape(self.N, NV).T
+        return nodes[R:V + 3], nodes[U:U + 3], nodes[Z], nodes[S]
+
+
+def get_structure(N, program):
+    key = (N, program)
+    if key not in structure_cache:
+        structure_cache[key] = structure(N, program)
+    return structure_cache[key]
+
+
+def assemble(N, program, packed_data):
+    # standard form (c, G, h, dims, A, b) for ECOS; the matrices are shared, copy them to keep them
+    st = get_structure(N, program)
+    pvec = st.pvec(N, packed_data)
+    return st.c.update(pvec), st.G.update(pvec), st.h.update(pvec), st.dims, st.A.update(pvec), st.b.update(pvec)
+
+
+def solve_ecos(st, pvec, verbose):
+    import ecos
+    opts = backends.BACKENDS['ECOS']
+    result = ecos.solve(st.c.update(pvec), st.G.update(pvec), st.h.update(pvec), st.dims,
+                        st.A.update(pvec), st.b.update(pvec), verbose=verbose, **opts)
+    info = result['info']
+    stats = {'status': info['infostring'], 'solver': 'ECOS', 'iterations': info['iter'],
+             'setup_time': info['timing']['tsetup'], 'solve_time': info['timing']['tsolve']}
+    if info['exitFlag'] not in (0, 10):  # optimal, optimal within reduced tolerance
+        return None, stats
+    return result['x'], stats
+
+
+def solve_clarabel(st, pvec, verbose):
+    import clarabel
+    key = (st.N, st.program)
+    q = st.c.update(pvec)
+    A = st.AG.update(pvec)
+    b = np.concatenate((st.b.update(pvec), st.h.update(pvec)))
+    solver = clarabel_cache.get(key)
+    if solver is not None and solver.is_data_update_allowed():
+        solver.update(q=q, A=A, b=b)
+    else:
+        settings = clarabel.DefaultSettings()
+        for name, value in backends.BACKENDS['CLARABEL'].items():
+            setattr(settings, name, value)
+        settings.verbose = verbose
+        cones = [clarabel.ZeroConeT(st.n_eq), clarabel.NonnegativeConeT(st.dims['l'])]
+        cones += [clarabel.SecondOrderConeT(d) for d in st.dims['q']]
+        P = sp.csc_matrix((st.n_var, st.n_var))
+        solver = clarabel.DefaultSolver(P, q, A.copy(), b, cones, settings)
+        clarabel_cache[key] = solver
+    result = solver.solve()
+    stats = {'status': str(result.status), 'solver': 'CLARABEL', 'iterations': result.iterations,
+             'setup_time': None, 'solve_time': result.solve_time}
+    if str(result.status) not in ('Solved', 'AlmostSolved'):
+        return None, stats
+    return np.array(result.x), stats
+
+
+ENGINES = {'ECOS': solve_ecos, 'CLARABEL': solve_clarabel}
+
+last_iterations = {}  # (N, program) -> iterations of the last solve
+
+
+def GFOLD_sparse(N, pmark, packed_data, backend='auto', verbose=False, warm=None, trace=None):
+    # drop-in for GFOLD_direct; warm is accepted for the same signature, ECOS and Clarabel start cold
+    program = 4 if pmark == 'p4' else 3
+    if backend != 'auto' and backend not in ENGINES:
+        raise ValueError("backend %r is not supported by the sparse engine, use 'auto' or one of %s" % (backend, ', '.join(ENGINES)))
+
+    trace = trace or GFOLD_trace.trace('GFOLD_sparse')
+    with trace.phase('p%d' % program, N=N, engine='sparse') as info:
+        with trace.phase('assemble'):
+            st = get_structure(N, program)
+            pvec = st.pvec(N, packed_data)
+        info.update(variables=st.n_var, eq_constraints=st.n_eq, ineq_constraints=st.n_ineq)
+        if backend == 'auto':
+            backend = next((name for name in backends.rank_backends(N) if name in ENGINES), 'ECOS')
+
+        with trace.phase('solve', warm_start=False) as solve_info:
+            sol, stats = ENGINES[backend](st, pvec, verbose)
+            solve_info.update(stats)
+        last_iterations[(N, program)] = stats['iterations']
+        info.update(backend=backend, status=stats['status'])
+
+        with trace.phase('extract'):
+            if sol is None:
+                return None, None, None, None, None, None
+            x, u, z, s = st.unpack(sol)
+            obj_opt = st.c.update(pvec) @ sol
+            info['objective'] = obj_opt
+            return obj_opt, x, u, np.exp(z), s, z
+
+
+if __name__ == '__main__':
+    import contextlib
+    import io
+    import GFOLD_direct_exec as solver_direct
+    from GFOLD_run import solver, test_vessel
+
+    gfold = solver(test_vessel)
+    for N, pmark in ((40, 'p3'), (40, 'p4'), (160, 'p3'), (80, 'p4')):
+        packed_data = gfold.pack_data(N)
+        with contextlib.redirect_stdout(io.StringIO()):
+            ref = solver_direct.GFOLD_direct(N, pmark, packed_data, 'ECOS')
+        for backend in ENGINES:
+            with contextlib.redirect_stdout(io.StringIO()):
+                GFOLD_sparse(N, pmark, packed_data, backend)  # build the pattern and the solver
+                start = time.time()
+                res = GFOLD_sparse(N, pmark, packed_data, backend)
+            elapsed = time.time() - start
+            assert np.isclose(res[0], ref[0], rtol=1e-4), 'sparse engine changed the optimum'
+            print('N = %d %s %s: %.2fms, optimum %f (cvxpy %f), landing mass %.3f (cvxpy %.3f)' % (
+                N, pmark, backend, elapsed * 1000, res[0], ref[0], res[3][-1], ref[3][-1]))
+
+    try:
+        GFOLD_sparse(40, 'p3', gfold.pack_data(40), 'SCS')
+        raise AssertionError('SCS accepted by the sparse engine')
+    except ValueError as e:
+        print(e)
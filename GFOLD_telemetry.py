@@ -0,0 +1,201 @@
+import time
+import threading
+import numpy as np
+
+''' Streamed telemetry and batched control writes for the control loop
+
+ Every quantity the loop reads is a kRPC stream, so reading it costs no round
+ trip. The server sends the streams of one physics frame in one update message;
+ telemetry builds its snapshot in the connection's update callback, after the
+ whole message has been applied, so a snapshot never mixes two frames. Messages
+ that do not advance ut (nothing new simulated) are not counted as frames.
+
+ controls collects the setter calls of a tick and writes them from its own
+ thread, dropping values that did not change by more than the deadband, so a
+ tick costs no round trip either. flush() writes synchronously (e.g. the final
+ throttle cut).
+
+ Only add_stream, add_stream_update_callback and the stream call() are used, so
+ anything that implements those (GFOLD_sim) can stand in for the connection.
+ With step given (lockstep), wait() calls it to simulate the next frame instead
+ of waiting for the server, and controls write straight away (threaded=False),
+ so every tick's commands are in before the next frame is simulated.
+
+'''
+
+
+class telemetry:
+    def __init__(self, conn, vessel, ref_target, ref_surface, step=None):
+        self.conn = conn
+        self.step = step
+        self.streams = {
+            'ut': conn.add_stream(getattr, conn.space_center, 'ut'),
+            'error': conn.add_stream(vessel.position, ref_target),  # 目标系里的偏差
+            'vel': conn.add_stream(vessel.velocity, ref_target),  # 地面速度
+            'avel': conn.add_stream(vessel.angular_velocity, ref_surface),  # 地面系下角速度
+            'rotation': conn.add_stream(vessel.rotation, ref_surface),
+            'moment_of_inertia': conn.add_stream(getattr, vessel, 'moment_of_inertia'),
+            'mass': conn.add_stream(getattr, vessel, 'mass'),
+            'max_thrust': conn.add_stream(getattr, vessel, 'max_thrust'),
+            'specific_impulse': conn.add_stream(getattr, vessel, 'specific_impulse'),
+        }
+        self.condition = threading.Condition()
+        self.latest = None  # newest snapshot (dict), replaced as a whole
+        self.frame = 0
+        conn.add_stream_update_callback(self.on_update)
+
+    def on_update(self):
+        # runs on the stream thread once an update message has been applied
+        try:
+            values = {name: stream() for name, stream in self.streams.items()}
+        except Exception:  # some stream has no value yet
+            return
+        if self.latest is not None and values['ut'] <= self.latest['ut']:
+            return
+        for name in ('error', 'vel', 'avel', 'rotation', 'moment_of_inertia'):
+            values[name] = np.array(values[name])
+        with self.condition:
+            self.frame += 1
+            values['frame'] = self.frame
+            values['received'] = time.perf_counter()
+            self.latest = values
+            self.condition.notify_all()
+
+    def wait(self, frame=0, timeout=None):
+        # first snapshot newer than frame (None on timeout)
+        if self.step is not None and self.frame <= frame:
+            self.step()
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame > frame, timeout)
+            return self.latest if self.frame > frame else None
+
+    def close(self):
+        self.conn.remove_stream_update_callback(self.on_update)
+        for stream in self.streams.values():
+            stream.remove()
+
+
+class controls:
+    def __init__(self, control, deadband=1e-3, threaded=True):
+        self.control = control  # vessel.control, fetched once (the getter is a round trip too)
+        self.deadband = deadband
+        self.sent = {}
+        self.pending = {}
+        self.commanded = {}  # last value set per control, sent or not
+        self.lock = threading.Lock()  # pending
+        self.write_lock = threading.Lock()  # sent and the writes themselves
+        self.event = threading.Event()
+        self.threaded = threaded
+        self.running = True
+        self.writes = 0
+        if threaded:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def set(self, **values):
+        self.commanded.update(values)
+        with self.lock:
+            self.pending.update(values)
+        if self.threaded:
+            self.event.set()
+        else:
+            self.flush()
+
+    def changed(self, name, value):
+        if name not in self.sent:
+            return True
+        if isinstance(value, (bool, np.bool_)):
+            return value != self.sent[name]
+        return abs(value - self.sent[name]) > self.deadband
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        with self.write_lock:
+            for name, value in pending.items():
+                if self.changed(name, value):
+                    setattr(self.control, name, value)
+                    self.sent[name] = value
+                    self.writes += 1
+
+    def run(self):
+        while self.running:
+            self.event.wait()
+            self.event.clear()
+            self.flush()
+
+    def close(self):
+        self.flush()
+        self.running = False
+        self.event.set()
+
+
+if __name__ == '__main__':
+    # against GFOLD_sim's stand-in: frames from a stream thread, lockstep frames, and the deadband writer
+    import GFOLD_sim
+    conn = GFOLD_sim.sim()
+    vessel = conn.space_center.active_vessel
+    dt = conn.config['dt']
+
+    # streamed: another thread simulates frames the way the kRPC stream thread applies update messages
+    tele = telemetry(conn, vessel, GFOLD_sim.frame(), vessel.surface_reference_frame)
+    assert tele.wait(0, timeout=0.05) is None
+
+    def server(count):
+        for _ in range(count):
+            conn.step()
+            for callback in list(conn.callbacks):  # an update message with nothing newly simulated
+                callback()
+            time.sleep(0.002)
+
+    thread = threading.Thread(target=server, args=(50,))
+    thread.start()
+    seen = []
+    snapshot = tele.wait(0, timeout=1.0)
+    while snapshot is not None:
+        assert np.isclose(snapshot['ut'], snapshot['frame'] * dt), 'a snapshot mixes two frames'
+        seen.append(snapshot['frame'])
+        snapshot = tele.wait(snapshot['frame'], timeout=0.2)
+    thread.join()
+    assert tele.frame == conn.frames == 50, 'updates that did not advance ut were counted'
+    assert seen == sorted(set(seen)) and seen[-1] == 50
+    print('streamed: %d frames, %d seen by the loop' % (tele.frame, len(seen)))
+    tele.close()
+    assert not conn.callbacks
+
+    # lockstep: wait() simulates the next frame itself
+    tele = telemetry(conn, vessel, GFOLD_sim.frame(), vessel.surface_reference_frame, step=conn.step)
+    for frame in range(3):
+        snapshot = tele.wait(tele.frame)
+        assert snapshot['frame'] == frame + 1 and np.isclose(snapshot['ut'], (50 + frame + 1) * dt)
+    tele.close()
+
+    # controls: set() returns without waiting on a slow write, the writer thread drops changes within the deadband
+    class slow_control:
+        def __init__(self):
+            self.__dict__['log'] = []
+
+        def __setattr__(self, name, value):
+            time.sleep(0.02)  # a round trip
+            self.log.append((name, value))
+            self.__dict__[name] = value
+
+    control = slow_control()
+    writer = controls(control, deadband=1e-3)
+    start = time.perf_counter()
+    writer.set(throttle=0.5, gear=True)
+    writer.set(throttle=0.5005)
+    assert time.perf_counter() - start < 0.01, 'set() waited on the write'
+    deadline = time.time() + 2.0
+    while writer.writes < 2 and time.time() < deadline:
+        time.sleep(0.005)
+    time.sleep(0.05)
+    writer.set(throttle=0.5008, gear=True)  # within the deadband of what was sent: dropped
+    time.sleep(0.1)
+    assert writer.writes == 2 and control.throttle in (0.5, 0.5005) and control.gear is True, control.log
+    writer.set(throttle=0.6)
+    writer.close()  # flushes what is pending
+    assert control.throttle == 0.6 and writer.commanded['throttle'] == 0.6
+    writer.thread.join(1.0)
+    assert not writer.thread.is_alive()
+    print('controls: %d writes for 6 values set' % writer.writes)
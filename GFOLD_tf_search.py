@@ -0,0 +1,112 @@
+import os
+import io
+import time
+import contextlib
+import numpy as np
+from concurrent.futures.process import BrokenProcessPool
+from GFOLD_batch import get_pool, discard_pool, submit
+
+''' Time of flight search
+
+ p4 is solved for several candidate tf at once on a process pool: a coarse grid
+ over tf_range first, then rounds of finer grids inside the bracket around the
+ best feasible candidate until it is narrower than tol. The pool is GFOLD_batch's,
+ kept between searches, so every worker keeps its compiled problems
+ (problem_cache / structure_cache live per process).
+
+ The cost of a candidate is the fuel it uses; infeasible candidates (tf too short
+ to stop, or too long to hover) have none. A candidate whose solve raises counts
+ as infeasible and the search goes on; the candidates a dying worker took down
+ with the pool are solved again on a new one, and count as infeasible if that
+ breaks too. warm_path (a previous solution, shifted by elapsed seconds) is
+ resampled onto every candidate's grid to start its p4 from.
+
+'''
+
+
+def evaluate_tf(v_data, tf, N, backend, engine, warm_path=None, elapsed=0.0):
+    # one candidate, runs in a worker: (tf, feasible, fuel, path, solve time)
+    from GFOLD_run import solver, resample_path
+    start = time.time()
+    gfold = solver(dict(v_data, tf=tf), backend, False, engine)
+    warm = resample_path(warm_path, N, tf, elapsed) if warm_path is not None else None
+    with contextlib.redirect_stdout(io.StringIO()):
+        path = gfold.solve_p4(N, warm)
+    if path is None:
+        return tf, False, None, None, time.time() - start
+    m = path[3]
+    return tf, True, float(m[0] - m[-1]), path, time.time() - start
+
+
+def search_tf(v_data, N=80, tf_range=None, grid=None, tol=0.1, max_rounds=6, backend='auto', engine='cvxpy', workers=None,
+              warm_path=None, elapsed=0.0):
+    # returns {'tf', 'fuel', 'path', 'curve': [(tf, feasible, fuel, solve time), ...] sorted by tf}
+    grid = grid or max(workers or os.cpu_count(), 6)  # candidates per round
+    if tf_range is None:
+        tf_range = (0.25 * v_data['tf'], 1.5 * v_data['tf'])
+
+    results = {}  # tf -> (feasible, fuel, path, solve time)
+
+    def run(candidates):
+        todo = [tf for tf in candidates if tf not in results]
+        for attempt in range(2):  # once more on a new pool if a worker died
+            start = time.time()
+            futures = {tf: submit(evaluate_tf, v_data, tf, N, backend, engine, warm_path, elapsed, workers=workers) for tf in todo}
+            pool = get_pool(workers)
+            lost = []
+            for tf, future in futures.items():
+                try:
+                    results[tf] = future.result()[1:]
+                except BrokenProcessPool:
+                    lost.append(tf)
+                except Exception as e:  # no answer for this tf: infeasible as far as the search goes
+                    print('tf %.3f: %r' % (tf, e))
+                    results[tf] = (False, None, None, time.time() - start)
+            if not lost:
+                return
+            discard_pool(pool)
+            todo = lost
+        for tf in todo:
+            print('tf %.3f: lost with a dead worker twice' % tf)
+            results[tf] = (False, None, None, time.time() - start)
+
+    run(np.linspace(tf_range[0], tf_range[1], grid))
+    for _ in range(max_rounds):
+        tfs = sorted(results)
+        feasible = [tf for tf in tfs if results[tf][0]]
+        if not feasible:
+            break
+        i = tfs.index(min(feasible, key=lambda tf: results[tf][1]))
+        lo, hi = tfs[max(i - 1, 0)], tfs[min(i + 1, len(tfs) - 1)]
+        if hi - lo < tol:
+            break
+        run(np.linspace(lo, hi, grid + 2)[1:-1])
+
+    curve = [(tf, results[tf][0], results[tf][1], results[tf][3]) for tf in sorted(results)]
+    feasible = [tf for tf in results if results[tf][0]]
+    if not feasible:
+        return {'tf': None, 'fuel': None, 'path': None, 'curve': curve}
+    best = min(feasible, key=lambda tf: results[tf][1])
+    return {'tf': best, 'fuel': results[best][1], 'path': results[best][2], 'curve': curve}
+
+
+if __name__ == '__main__':
+    from GFOLD_run import test_vessel
+    for engine in ('sparse', 'cvxpy'):
+        start = time.time()
+        result = search_tf(test_vessel, engine=engine)
+        print('%s: tf = %.3fs, fuel %.2fkg, %d candidates in %.2fs' % (
+            engine, result['tf'], result['fuel'], len(result['curve']), time.time() - start))
+    for tf, feasible, fuel, elapsed in result['curve']:
+        print('  tf %7.3f  %s' % (tf, '%.2fkg' % fuel if feasible else 'infeasible'))
+
+    # candidates whose solve raises are infeasible, the search itself returns
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = search_tf(test_vessel, engine='sparse', backend='no such backend', max_rounds=0)
+    assert result['path'] is None and not any(feasible for tf, feasible, fuel, elapsed in result['curve'])
+
+    # a worker dying under the search: its candidates are solved again on a new pool
+    get_pool().submit(os._exit, 1)
+    result = search_tf(test_vessel, engine='sparse')
+    assert result['path'] is not None, result['curve']
+    print('after a dead worker: tf = %.3fs, %d candidates' % (result['tf'], len(result['curve'])))
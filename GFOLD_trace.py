@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+''' Solve traces
+
+ A trace collects the timed phases of one solve (solver.solve_direct, and the
+ GFOLD_direct / GFOLD_sparse calls inside it), each with its arguments: N,
+ backend, solver status, solver_stats (iterations, setup and solve time), the
+ problem size. Phases nest, a phase's args can be filled in while it runs.
+
+ Every finished phase or mark goes to the trace's callback, to every function
+ registered with add_listener, and to the 'gfold' logger at INFO (this replaces
+ the progress prints: logging.basicConfig(level=logging.INFO) shows them again).
+
+ to_jsonl writes one event per line; to_chrome writes the Chrome trace event
+ format (chrome://tracing, Perfetto), phases as complete events in microseconds.
+
+'''
+
+log = logging.getLogger('gfold')
+listeners = []  # called with (trace, event) for every event of every trace
+
+
+def add_listener(function):
+    listeners.append(function)
+
+
+def remove_listener(function):
+    listeners.remove(function)
+
+
+class trace:
+    def __init__(self, name, callback=None):
+        self.name = name
+        self.callback = callback  # called with (trace, event)
+        self.events = []  # {'name', 'ph': 'X' (phase) or 'i' (mark), 'ts', 'dur' (s, from origin), 'args'}
+        self.origin = time.perf_counter()
+        self.start_time = time.time()
+
+    def emit(self, event):
+        self.events.append(event)
+        if log.isEnabledFor(logging.INFO):
+            args = ' '.join('%s=%s' % item for item in event['args'].items())
+            if event['ph'] == 'X':
+                log.info('[%s] %s %.2fms %s', self.name, event['name'], event['dur'] * 1000, args)
+            else:
+                log.info('[%s] %s %s', self.name, event['name'], args)
+        if self.callback is not None:
+            self.callback(self, event)
+        for function in listeners:
+            function(self, event)
+
+    @contextmanager
+    def phase(self, name, **args):
+        # times the with block; yields the args dict so the block can add to it
+        event = {'name': name, 'ph': 'X', 'ts': time.perf_counter() - self.origin, 'args': args, 'tid': threading.get_ident()}
+        try:
+            yield args
+        except Exception as e:
+            args['error'] = repr(e)
+            raise
+        finally:
+            event['dur'] = time.perf_counter() - self.origin - event['ts']
+            self.emit(event)
+
+    def mark(self, name, **args):
+        self.emit({'name': name, 'ph': 'i', 'ts': time.perf_counter() - self.origin, 'dur': 0.0, 'args': args, 'tid': threading.get_ident()})
+
+    def durations(self):
+        # total time per phase name
+        total = {}
+        for event in self.events:
+            if event['ph'] == 'X':
+                total[event['name']] = total.get(event['name'], 0.0) + event['dur']
+        return total
+
+    def to_jsonl(self, path, append=True):
+        with open(path, 'a' if append else 'w', encoding='utf-8') as f:
+            for event in self.events:
+                f.write(json.dumps(dict(event, trace=self.name, start_time=self.start_time), default=str) + '\n')
+
+    def chrome_events(self):
+        pid = os.getpid()
+        origin_us = self.start_time * 1e6
+        events = []
+        for event in sorted(self.events, key=lambda e: e['ts']):
+            chrome = {'name': event['name'], 'cat': self.name, 'ph': event['ph'], 'ts': origin_us + event['ts'] * 1e6,
+                      'pid': pid, 'tid': event['tid'], 'args': event['args']}
+            if event['ph'] == 'X':
+                chrome['dur'] = event['dur'] * 1e6
+            else:
+                chrome['s'] = 't'
+            events.append(chrome)
+        return events
+
+    def to_chrome(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': self.chrome_events(), 'displayTimeUnit': 'ms'}, f, default=str)
+
+
+def solver_stats(problem):
+    # status and solver_stats of a solved cvxpy problem as plain values
+    stats = problem.solver_stats
+    return {'status': problem.status, 'solver': stats.solver_name, 'iterations': stats.num_iters,
+            'setup_time': stats.setup_time, 'solve_time': stats.solve_time}
+
+
+def problem_size(problem):
+    size = problem.size_metrics
+    return {'variables': size.num_scalar_variables, 'eq_constraints': size.num_scalar_eq_constr,
+            'ineq_constraints': size.num_scalar_leq_constr}
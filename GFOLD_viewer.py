@@ -0,0 +1,219 @@
+import time
+import queue
+import multiprocessing
+import numpy as np
+
+''' Live trajectory viewer
+
+ viewer starts a separate process with a matplotlib window (side view, top
+ view and speed over time, all in the target frame) and feeds it through a
+ queue. plan() and state() never wait: a state that does not fit in the queue
+ is dropped (the next one is newer anyway), a plan that does not fit is kept
+ and sent with the next call. Neither matplotlib nor the drawing ever touch the
+ control process.
+
+ The window process drains the queue, then redraws at most fps times a second
+ with blitting: the axes, ticks and the glideslope are drawn once into a
+ cached background, every frame only restores it and draws the animated
+ artists (planned path, flown trail, vessel). A replaced plan only changes the
+ data of the path lines; the background is redrawn only when the new plan
+ does not fit in the axis limits.
+
+'''
+
+
+class viewer:
+    def __init__(self, fps=20, y_gs=None, maxsize=64):
+        self.queue = multiprocessing.Queue(maxsize)
+        self.process = multiprocessing.Process(target=run, args=(self.queue, fps, y_gs), daemon=True)
+        self.process.start()
+        self.pending = None  # plan that did not fit in the queue yet
+        self.dropped = 0  # states dropped on a full queue
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except queue.Full:
+            return False
+
+    def plan(self, version, path):
+        # a new plan, path (tf, x, u, m, s, z) as from solver.solve_direct
+        tf, x = path[0], path[1]
+        self.pending = ('plan', version, float(tf), np.asarray(x[0:6], dtype=np.float32))
+        if self.put(self.pending):
+            self.pending = None
+
+    def state(self, ut, r, v):
+        # the vessel now, r and v in the target frame
+        if self.pending is not None and self.put(self.pending):
+            self.pending = None
+        if not self.put(('state', float(ut), np.asarray(r, dtype=np.float32), np.asarray(v, dtype=np.float32))):
+            self.dropped += 1
+
+    def close(self):
+        self.put(('close',))
+        self.process.join(2)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def run(messages, fps, y_gs, frames=None):
+    # the window process; frames: stop after that many drawn frames (for tests)
+    import matplotlib.pyplot as plt
+
+    fig, (side, top, speed) = plt.subplots(1, 3, figsize=(13, 4.5))
+    side.set_title('side')
+    side.set_xlabel('x1 (m)')
+    side.set_ylabel('altitude (m)')
+    top.set_title('top')
+    top.set_xlabel('x1 (m)')
+    top.set_ylabel('x2 (m)')
+    speed.set_title('speed')
+    speed.set_xlabel('plan time (s)')
+    speed.set_ylabel('m/s')
+    glideslope = []
+    if y_gs is not None:
+        glideslope = side.plot([], [], color='0.8', linewidth=1)  # drawn with the background
+
+    def animated(ax, *args, **kwargs):
+        return ax.plot([], [], *args, animated=True, **kwargs)[0]
+
+    plan_side, plan_top, plan_speed = animated(side, 'b-'), animated(top, 'b-'), animated(speed, 'b-')
+    trail_side, trail_top = animated(side, 'r-', linewidth=1), animated(top, 'r-', linewidth=1)
+    vessel_side, vessel_top, vessel_speed = animated(side, 'ro'), animated(top, 'ro'), animated(speed, 'ro')
+    label = side.text(0.02, 0.95, '', transform=side.transAxes, animated=True, va='top')
+    artists = [plan_side, plan_top, plan_speed, trail_side, trail_top, vessel_side, vessel_top, vessel_speed, label]
+
+    trail = np.zeros((4096, 3), dtype=np.float32)  # flown positions, decimated when full
+    trail_len = 0
+    plan = None  # (version, tf, x, node times, speeds)
+    plan_ut = None  # ut of the plan's t = 0: the newest state when it arrived, else the first state after it
+    state = None
+    background = None
+    limits = np.array([[0, 1], [-1, 1], [-1, 1], [0, 1]], dtype=float)  # x1, altitude, x2, speed ranges shown
+
+    plt.show(block=False)
+
+    def fit(points, speeds):
+        # grow the axis limits to fit; True if they changed (the background must be redrawn)
+        wanted = np.array([[points[:, 1].min(), points[:, 1].max()], [min(points[:, 0].min(), 0), points[:, 0].max()],
+                           [points[:, 2].min(), points[:, 2].max()], [0, speeds.max()]])
+        if np.all(wanted[:, 0] >= limits[:, 0]) and np.all(wanted[:, 1] <= limits[:, 1]):
+            return False
+        span = np.maximum(wanted[:, 1] - wanted[:, 0], 1.0)
+        limits[:, 0] = np.minimum(limits[:, 0], wanted[:, 0] - 0.1 * span)
+        limits[:, 1] = np.maximum(limits[:, 1], wanted[:, 1] + 0.1 * span)
+        return True
+
+    def redraw_background():
+        side.set_xlim(*limits[0])
+        side.set_ylim(*limits[1])
+        top.set_xlim(*limits[0])
+        top.set_ylim(*limits[2])
+        speed.set_ylim(*limits[3])
+        if plan is not None:
+            speed.set_xlim(0, max(plan[1], 1.0))
+        if glideslope:
+            reach = np.abs(limits[0]).max()
+            glideslope[0].set_data([-reach, 0, reach], [reach * np.tan(y_gs), 0, reach * np.tan(y_gs)])
+        fig.canvas.draw()
+        return fig.canvas.copy_from_bbox(fig.bbox)
+
+    drawn = 0
+    period = 1.0 / fps
+    next_frame = time.perf_counter()
+    running = True
+    while running and plt.fignum_exists(fig.number):
+        changed = False
+        while True:
+            try:
+                message = messages.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == 'close':
+                running = False
+                break
+            if message[0] == 'plan':
+                _, version, tf, x = message
+                t = np.arange(x.shape[1]) * (tf / x.shape[1])
+                plan = (version, tf, x, t, np.linalg.norm(x[3:6], axis=0))
+                plan_ut = state[0] if state is not None else None
+                plan_side.set_data(x[1], x[0])
+                plan_top.set_data(x[1], x[2])
+                plan_speed.set_data(t, plan[4])
+                if fit(x[0:3].T, plan[4]) or background is None:
+                    background = None
+            else:
+                _, ut, r, v = message
+                state = (ut, r, v)
+                if plan is not None and plan_ut is None:
+                    plan_ut = ut
+                if trail_len == len(trail):
+                    trail[:len(trail) // 2] = trail[::2]
+                    trail_len = len(trail) // 2
+                trail[trail_len] = r
+                trail_len += 1
+                if fit(r[np.newaxis], np.array([np.linalg.norm(v)])):
+                    background = None
+            changed = True
+        now = time.perf_counter()
+        if not changed or now < next_frame:
+            fig.canvas.flush_events()
+            time.sleep(min(max(next_frame - now, 0.0), period))
+            continue
+        next_frame = now + period
+        if background is None:
+            background = redraw_background()
+        fig.canvas.restore_region(background)
+        trail_side.set_data(trail[:trail_len, 1], trail[:trail_len, 0])
+        trail_top.set_data(trail[:trail_len, 1], trail[:trail_len, 2])
+        if state is not None:
+            ut, r, v = state
+            vessel_side.set_data([r[1]], [r[0]])
+            vessel_top.set_data([r[1]], [r[2]])
+            if plan is not None and plan_ut is not None:
+                vessel_speed.set_data([ut - plan_ut], [np.linalg.norm(v)])
+            label.set_text('plan v%d  altitude %.0fm  speed %.1fm/s' % (plan[0] if plan else 0, r[0], np.linalg.norm(v)))
+        for artist in artists:
+            fig.draw_artist(artist)
+        fig.canvas.blit(fig.bbox)
+        fig.canvas.flush_events()
+        drawn += 1
+        if frames is not None and drawn >= frames:
+            break
+    plt.close(fig)
+
+
+if __name__ == '__main__':
+    import io
+    import contextlib
+    from GFOLD_run import solver, test_vessel
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        path = solver(test_vessel).solve_direct()
+    view = viewer(y_gs=test_vessel['y_gs'])
+    # fly along the plan at 50 frames a second, replacing it halfway, and time the calls the control loop makes
+    tf, x = path[0], path[1]
+    costs = []
+    for k in range(x.shape[1]):
+        for f in np.linspace(0, 1, 7)[:-1]:
+            j = min(k + 1, x.shape[1] - 1)
+            start = time.perf_counter()
+            if k == x.shape[1] // 2 and f == 0:
+                view.plan(2, (tf, x * 1.02))
+            elif k == 0 and f == 0:
+                view.plan(1, path)
+            view.state(k * tf / x.shape[1], x[0:3, k] * (1 - f) + x[0:3, j] * f, x[3:6, k])
+            costs.append(time.perf_counter() - start)
+            time.sleep(0.02)
+    view.close()
+    print('control side: %.1fus per call (max %.1fus), %d states dropped' % (
+        np.mean(costs) * 1e6, np.max(costs) * 1e6, view.dropped))
+
+    # demo3's order within a tick: the state, then the plan solved from it; drawn in this process
+    messages = queue.Queue()
+    messages.put(('state', 3.0, x[0:3, 0].astype(np.float32), x[3:6, 0].astype(np.float32)))
+    messages.put(('plan', 1, float(tf), x[0:6].astype(np.float32)))
+    run(messages, 50, test_vessel['y_gs'], frames=1)
+    print('state then plan: drawn')
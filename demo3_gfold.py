@@ -1,12 +1,19 @@
-import krpc
+import os
 import time
-import simple_pid
 import numpy as np
 import numpy.linalg as npl
 # import EvilPlotting as plot
 
-from GFOLD_run import solver
-from threading import Thread
+from GFOLD_replan import replanner
+from GFOLD_telemetry import telemetry, controls
+from GFOLD_follow import follower
+from GFOLD_service import parse_address
+from GFOLD_viewer import viewer
+from GFOLD_draw import debug_drawing
+from GFOLD_record import recorder
+from GFOLD_control import controller, NAV_MODES
+from GFOLD_sched import scheduler, report
+from GFOLD_divert import diverter, site_position
 
 
 def lerp(vec1, vec2, t):
@@ -43,8 +50,8 @@ def angle_around_axis(v1, v2, axis):
 
 
 # 生成求解器所需的输入
-def vessel_profile1(vessel_info):
-    est_time = 0.5
+def vessel_profile1(vessel_info, params, est_time=0.5):
+    deg2rad = np.pi / 180
     vel_est = vessel_info['vel'] + vessel_info['acceleration'] * est_time
     pos_est = vessel_info['error'] + vessel_info['vel'] * est_time + 0.5 * vessel_info['acceleration'] * est_time * est_time
     return {
@@ -52,64 +59,17 @@ def vessel_profile1(vessel_info):
         'G_max': params['G_max'],
         'V_max': params['V_max'],
         'y_gs': params['y_gs'] * deg2rad,
-        'p_cs': max_tilt * 0.85,
+        'p_cs': params['max_tilt'] * deg2rad * 0.85,
         'm_wet': vessel_info['mass'],
         'T_max': vessel_info['max_thrust'],
-        'throt': throttle_limit,
+        'throt': params['throttle_limit'],
         'x0': np.array([pos_est[0], pos_est[1], pos_est[2], vel_est[0], vel_est[1], vel_est[2]]),
-        'g': np.array([-g0, 0, 0]),
+        'g': np.array([-params['g0'], 0, 0]),
         'tf': params['tf'],
         'straight_fac': params['straight_fac'],
     }
 
 
-def update_lines(x, u):
-    m_u = vessel.max_thrust / vessel.mass
-    for i in range(N - 1):
-        lines[i].start = x[0:3, i]
-        lines[i].end = x[0:3, i + 1]
-    for i in range(N):
-        directions[i].start = x[0:3, i]
-        directions[i].end = x[0:3, i] + u[:, i] * 5 / m_u
-
-
-# 找到路径上最近的点的索引值
-def find_nearest_index(x, r):
-    nearest_mag = npl.norm(x[0:3, 0] - r)
-    nearest_i = 0
-    for i in range(x.shape[1]):
-        mag = npl.norm(x[0:3, i] - r)  # + npl.norm(x[3:6, i] - v) * 0.2
-        if mag < nearest_mag:
-            nearest_mag = mag
-            nearest_i = i
-    v = x[3:6, nearest_i]
-    v_norm = npl.norm(v)
-    v_dir = v / v_norm
-    frac = np.clip(np.dot(r - x[0:3, nearest_i], v_dir) / (gtf / N * v_norm), -0.5, 0.5)
-    return nearest_i + frac
-
-
-# 路径上采样
-def sample_index(index):
-    # if index >= N-1:
-    if index >= N - 1:
-        # return (x[0:3, N-1], x[3:6, N-1], u[:, N-1])
-        return form_v3(0, 0, 0), form_v3(0, 0, 0), form_v3(9.807, 0, 0)
-    elif index <= 0:
-        i = 0
-        frac = index
-    else:
-        i = int(np.floor(index))
-        frac = index - i
-    x_i_s = lerp(gx[:, i], gx[:, i + 1], frac)
-    u_i_s = lerp(gu[:, i], gu[:, i + 1], frac)
-    if index < 0:
-        u_i_s = gu[:, 1].copy()
-        # print('u1234 ' + str(u[:, 0:4]))
-        # print('u_i_s ' + str(u[:, 1]))
-    return x_i_s[0:3].copy(), x_i_s[3:6].copy(), u_i_s.copy()
-
-
 def conic_clamp(target, min_mag, max_mag, max_t):
     # a_mag = npl.norm(target)
     hor_dir = form_v3(0, target[1], target[2])
@@ -134,210 +94,247 @@ def conic_clamp(target, min_mag, max_mag, max_t):
     return hor_dir * a_hor + form_v3(a_ver, 0, 0)
 
 
-# 求解最优路径
-def solve_gfold(v_data):
-    global gfold_path, n_i, nav_mode
-    gfold_path = solver(v_data).solve_direct()
-    n_i = -100
-    if gfold_path is not None:
-        tf, x, u, m, s, z = gfold_path
-        if debug_lines:
-            update_lines(x, u)
-        # print('x0: ' + str(v_data['x0']))
-        # print('tf: ' + str(tf))
-        print('gfold')
-        nav_mode = 'gfold'
-        print(v_data)
-        # plot.plot_run3D(*gfold_path, v_data)
-    conn.krpc.paused = False
-
-
-if __name__ == '__main__':
+def load_params(path='params.txt'):
     params = {}
-    with open('params.txt', 'r', encoding='utf-8') as f:
+    with open(path, 'r', encoding='utf-8') as f:
         for line in f:
             pair = line.split('#')[0].split('=')
             if len(pair) == 2:
                 key = pair[0].strip()
                 value = eval(pair[1])
                 params[key] = value
+    return params
+
 
+# 制导主循环。conn可以是krpc连接，也可以是GFOLD_sim的模拟器；lockstep=True时模拟器每个控制周期才走一个物理帧，
+# 求解期间模拟时间不动（相当于以前暂停游戏求解），用来比实时更快地跑完整个降落
+def run(conn, params, lockstep=False):
     deg2rad = np.pi / 180
-    rad2deg = 180 / np.pi
     g0 = params['g0']
 
-    conn = krpc.connect(name='gfold')
     space_center = conn.space_center
     vessel = space_center.active_vessel
-    flight = vessel.flight()
     body = vessel.orbit.body
 
-    delta_time = 0.01
-
     # target
-    target_lat = params['target_lat'] * deg2rad
-    target_lon = params['target_lon'] * deg2rad
-    target_height = params['target_height']
-    target_axis = target_height + body.surface_height(target_lat * rad2deg, target_lon * rad2deg) + body.equatorial_radius
-    target_body_pos = np.array((np.cos(target_lon) * np.cos(target_lat), np.sin(target_lat), np.sin(target_lon) * np.cos(target_lat))) * target_axis
-
-    # limit
-    max_tilt = params['max_tilt'] * deg2rad
-    max_tilt_sin = np.sin(max_tilt)
-    min_tilt_cos = np.cos(max_tilt)
-    max_tilt_tan = np.tan(max_tilt)
-
-    throttle_limit = params['throttle_limit']
-    throttle_limit_ctrl = params['throttle_limit_ctrl']
-
-    # rotation
-    ctrl_x_rot = simple_pid.PID(Kp=params['ctrl_xz_rot.kp'], Kd=params['ctrl_xz_rot.kd'], Ki=params['ctrl_xz_rot.ki'], differential_on_measurement=False)
-    ctrl_y_avel_kp = params['ctrl_y_avel_kp']
-    ctrl_z_rot = simple_pid.PID(Kp=params['ctrl_xz_rot.kp'], Kd=params['ctrl_xz_rot.kd'], Ki=params['ctrl_xz_rot.ki'], differential_on_measurement=False)
-    k_x = params['k_x']
-    k_v = params['k_v']
-
-    # final
-    final_throttle = params['final_throttle']
-    final_kp = params['final_kp']
+    target_body_pos = site_position(body, params['target_lat'], params['target_lon'], params['target_height'])
+    divert_pos = [site_position(body, *site) for site in params['divert_sites']]  # 备降点
+
+    # 制导和姿态控制（GFOLD_control，预分配的数组，每帧复用）
+    kernel = controller(params)
+    state, commands = kernel.state, kernel.commands
 
     # time
     game_delta_time = 0.02
-    game_prev_time = space_center.ut
-    start_time = time.time()
 
     # references
-    ref_local = vessel.reference_frame
     ref_surface = vessel.surface_reference_frame  # 地面参考系
     ref_body = body.reference_frame
-    ref_target_temp = space_center.ReferenceFrame.create_relative(ref_body, position=target_body_pos)
-    ref_target = space_center.ReferenceFrame.create_hybrid(ref_target_temp, rotation=ref_surface, velocity=ref_target_temp)
 
-    prev_vel = form_vec(vessel.velocity(ref_target))
-    N = 80
+    def target_frame(position):
+        # 原点在目标点，轴向同地面系，速度相对星球
+        ref_target_temp = space_center.ReferenceFrame.create_relative(ref_body, position=position)
+        return space_center.ReferenceFrame.create_hybrid(ref_target_temp, rotation=ref_surface, velocity=ref_target_temp)
+
+    ref_target = target_frame(target_body_pos)
+
+    tele = telemetry(conn, vessel, ref_target, ref_surface, step=conn.step if lockstep else None)
+    ctrl = controls(vessel.control, threaded=not lockstep)
+    vessel_d = tele.wait()
+    game_prev_time = vessel_d['ut']
+    prev_vel = vessel_d['vel']
     gfold_path: [None | tuple] = None
+    follow = None
     n_i = -1
-    error = form_vec(vessel.position(ref_target))
-    debug_lines = params['debug_lines']
-    head_line = None
-    target_line = None
-    target2_line = None
-    if debug_lines:
-        lines = [conn.drawing.add_line((0, 0, 0), (0, 0, 0), ref_target) for i in range(N - 1)]
-        directions = [conn.drawing.add_line((0, 0, 0), (1, 0, 0), ref_target) for i in range(N)]
-        target_line = conn.drawing.add_line((0, 0, 0), (1, 0, 0), ref_target)
-        target_line.color = (0, 0, 1)
-        target2_line = conn.drawing.add_line((0, 0, 0), (1, 0, 0), ref_target)
-        target2_line.color = (0, 0, 1)
-        head_line = conn.drawing.add_line((0, 0, 0), (1, 0, 0), ref_target)
-        head_line.color = (0, 1, 1)
-        for line in directions:
-            line.color = (0, 1, 0)
+    error = vessel_d['error']
+    debug_lines = None
+    if params['debug_lines']:
+        debug_lines = debug_drawing(conn, ref_target, {'target': (0, 0, 1), 'target2': (0, 0, 1), 'head': (0, 1, 1)},
+                                    params['debug_segments'], params['debug_rate'])
 
     nav_mode = 'none'
-    onceFlag = False
+    gfold_version = 0
+    replan_lead = 0.0 if lockstep else params['replan_lead']
+    replan_next = -1.0  # 下次重新规划的时刻（ut）
+    divert_t0 = None  # 备降规划的起点时刻（ut）
+    planner = replanner(params['solver_backend'], params['solver_verbose'], params['solver_engine'], params['tf_search'],
+                        latency_budget=np.inf if lockstep else params['replan_latency_budget'], max_age=params['replan_max_age'],
+                        cache_dir=params['solution_cache'] or None, adaptive=params['adaptive_mesh'],
+                        service=parse_address(params['solver_service']) if params['solver_service'] else None,
+                        anytime=params['anytime_deadline'])
+    planner.warm_up(vessel_profile1(dict(vessel_d, acceleration=np.zeros(3)), params))
+    divert = None
+    if divert_pos:
+        divert = diverter(['%.4f, %.4f' % tuple(site[:2]) for site in params['divert_sites']], min_mass=params['divert_min_mass'],
+                          early_exit=params['divert_early_exit'], backend=params['solver_backend'], engine=params['solver_engine'])
+        divert.warm_up(vessel_profile1(dict(vessel_d, acceleration=np.zeros(3)), params), divert_pos)
+    view = viewer(params['live_view_fps'], params['y_gs'] * deg2rad) if params['live_view'] else None
+    recording = None
+    if params['record_dir']:
+        recording = recorder(os.path.join(params['record_dir'], time.strftime('%Y%m%d-%H%M%S')), params)
+    start_ut = vessel_d['ut']
+    sched = scheduler(deadline=params['control_deadline'])
 
     while True:
-        time.sleep(delta_time)
-        real_time = time.time() - start_time
-        ut = space_center.ut
+        # 等下一个物理帧的遥测快照（同一帧的数据，不再逐个RPC查询）
+        vessel_d = dict(tele.wait(vessel_d['frame']))
+        tick_start = time.perf_counter()
+        sched.start(vessel_d)
+        ut = vessel_d['ut']
         game_delta_time = ut - game_prev_time
-        if game_delta_time < 0.01:  # 意味着游戏中还没有经过一个物理帧，所以不进行计算
-            continue
 
         # 取得一些之后要用的数据
-        vessel_d = {}
-        error = vessel_d['error'] = form_vec(vessel.position(ref_target))  # 目标系里的偏差
-        avel = vessel_d['avel'] = form_vec(vessel.angular_velocity(ref_surface))  # 地面系下角速度（等于目标系角速度
-        vel = vessel_d['vel'] = form_vec(vessel.velocity(ref_target))  # 地面速度
-
-        rotation_local2srf = rotation_mat(form_vec(vessel.rotation(ref_surface)))  # 机体系到地面系旋转矩阵
-        rotation_srf2local = npl.inv(rotation_local2srf)  # 地面系到机体系旋转矩阵
-        moment_of_inertia_local = form_vec(vessel.moment_of_inertia)  # 转动惯量
-        mass = vessel_d['mass'] = vessel.mass
-        max_thrust = vessel_d['max_thrust'] = vessel.max_thrust
-        acceleration = vessel_d['acceleration'] = (vel - prev_vel) / game_delta_time
+        error = vessel_d['error']  # 目标系里的偏差
+        avel = vessel_d['avel']  # 地面系下角速度（等于目标系角速度
+        vel = vessel_d['vel']  # 地面速度
 
-        vessel_d['specific_impulse'] = vessel.specific_impulse
-        # print(game_delta_time)
+        mass = vessel_d['mass']
+        max_thrust = vessel_d['max_thrust']
+        acceleration = vessel_d['acceleration'] = (vel - prev_vel) / game_delta_time
+        if view:
+            view.state(ut, error, vel)
+        if recording:
+            row = recording.next()
+            recording.snapshot(vessel_d)
+            row['wall'] = tick_start
+            row['dt'] = game_delta_time
+            row['nav_mode'] = NAV_MODES.index(nav_mode)
+        state.mode[0] = NAV_MODES.index(nav_mode)
+        state.error[0], state.vel[0], state.avel[0], state.rotation[0] = error, vel, avel, vessel_d['rotation']
+        state.mass[0], state.max_thrust[0], state.dt[0] = mass, max_thrust, game_delta_time
+        sched.mark('telemetry')
+        tick_mode = nav_mode
 
         if nav_mode == 'gfold':  # 跟随gfold路径
-            gtf, gx, gu, gm, gs, gz = gfold_path  # g~: global naming issue
-            # n_i = max(n_i + game_delta_time * 0.2 * N/tf, find_nearest_index(x, error, vel))
-            n_i = max(n_i - game_delta_time * 0.2 * N / gtf, find_nearest_index(gx, error))
-            print("{:.3f}".format(n_i))
-            (x_i, v_i, u_i) = sample_index(n_i)
-            (x_i_, v_i_, u_i_) = sample_index(n_i + min(1.5 * N / gtf, npl.norm(vel) / 50 * N / gtf))
-
-            target_a = u_i + (v_i - vel) * k_v + (x_i - error) * k_x
-            target_a_ = u_i_ + (v_i_ - vel) * k_v + (x_i - error) * k_x
-
-            if debug_lines:
-                target_line.start = error
-                target_line.end = (x_i[0], x_i[1], x_i[2])
-                target2_line.start = error
-                target2_line.end = (x_i_[0], x_i_[1], x_i_[2])
-
-            max_throttle_ctrl = throttle_limit_ctrl[1] * (max_thrust / mass)
-            min_throttle_ctrl = throttle_limit_ctrl[0] * (max_thrust / mass)
-            target_a = conic_clamp(target_a, min_throttle_ctrl, max_throttle_ctrl, max_tilt)
-            target_a_ = conic_clamp(target_a_, min_throttle_ctrl, max_throttle_ctrl, max_tilt)
-            if n_i < 0:
-                target_a = np.array([g0, 0, 0]) + u_i
-            target_direction = target_a_ / npl.norm(target_a_)
-            target_throttle = npl.norm(target_a) / (max_thrust / mass)
+            n_i = follow.update(error, game_delta_time)  # 窗口内找最近点，索引只进不退
+            if params['print_index']:
+                print("{:.3f}".format(n_i))
+            (x_i, v_i, u_i) = follow.sample(n_i)
+            (x_i_, v_i_, u_i_) = follow.sample(n_i + min(1.5 / follow.dt, npl.norm(vel) / 50 / follow.dt))
+            state.n_i[0] = n_i
+            state.x_i[0], state.v_i[0], state.u_i[0] = x_i, v_i, u_i
+            state.x_i_[0], state.v_i_[0], state.u_i_[0] = x_i_, v_i_, u_i_
+        # 制导：gfold跟随路径（位置速度反馈，限制在推力锥内），final直接pid，none逆速度方向
+        kernel.guidance()
+        target_direction = commands.target_direction[0]
+        if not np.isnan(commands.throttle[0]):
+            ctrl.set(throttle=commands.throttle[0])
+
+        if nav_mode == 'gfold':
             if debug_lines:
-                head_line.start = error
-                head_line.end = error + target_direction * 8
-
-            if n_i > 0:
-                vessel.control.throttle = target_throttle
-
-            if (N - n_i) * gtf / N < 10:
-                vessel.control.gear = True
+                debug_lines.set('target', error, x_i)
+                debug_lines.set('target2', error, x_i_)
+                debug_lines.set('head', error, error + target_direction * 8)
+            if recording:
+                row['plan'] = gfold_version
+                row['n_i'] = n_i
+                row['x_i'], row['v_i'], row['u_i'] = x_i, v_i, u_i
+                row['x_i_'], row['v_i_'], row['u_i_'] = x_i_, v_i_, u_i_
+                row['target_a'], row['target_a_'] = commands.target_a[0], commands.target_a_[0]
+            if follow.time_to_go() < 10:
+                ctrl.set(gear=True)
             if npl.norm(error[1:3]) < params['final_radius'] and npl.norm(error[0]) < params['final_height']:
-                vessel.control.gear = True
+                ctrl.set(gear=True)
                 print('final')
                 nav_mode = 'final'
-        elif nav_mode == 'final':  # 最终降落阶段，直接pid
-            max_acc = throttle_limit_ctrl[1] * (max_thrust / mass) - g0
-            max_acc_low = throttle_limit_ctrl[1] * final_throttle * (max_thrust / mass) - g0
-            est_h = error[0] - vel[0] ** 2 / (2 * max_acc)
-            est_h_low = error[0] - vel[0] ** 2 / (2 * max_acc_low)
-            est_h_center = (est_h + est_h_low) / 2
-            vessel.control.throttle = np.clip(lerp(throttle_limit_ctrl[1] * final_throttle, throttle_limit_ctrl[1], -est_h_low / (est_h - est_h_low) * (1 + final_kp)), throttle_limit_ctrl[0], throttle_limit_ctrl[1])
-            error_hor = form_v3(0, error[1], error[2])
-            vel_hor = form_v3(0, vel[1], vel[2])
-            ctrl_hor = -error_hor * 0.03 - vel_hor * 0.06
-            target_direction = ctrl_hor + form_v3(1, 0, 0)
-            target_direction /= npl.norm(target_direction)
-            target_direction = conic_clamp(target_direction, 1, 1, max_tilt)
-        else:
-            target_direction = -vel
-            vessel.control.throttle = 0
-
-        if error[0] < params['start_altitude']:
-            if not onceFlag:
-                onceFlag = True
-                currentCondition = vessel_profile1(vessel_d)
-                conn.krpc.paused = True  # pause game
-                Thread(target=solve_gfold, args=(currentCondition,)).start()
-
-        # 变换到机体坐标系计算姿态控制，以下xyz均指机体系
-        target_direction_local = target_direction @ rotation_srf2local  # 机体系的目标姿态的机体y轴指向
-        avel_local = avel @ rotation_srf2local  # 机体系角速度
-        # pid控制，roll直接消除角速度
-        control_pitch = -np.clip(ctrl_x_rot(angle_around_axis(target_direction_local, form_v3(0, 1, 0), form_v3(1, 0, 0)), game_delta_time), -1, 1)
-        control_yaw = -np.clip(ctrl_z_rot(angle_around_axis(target_direction_local, form_v3(0, 1, 0), form_v3(0, 0, 1)), game_delta_time), -1, 1)
-        control_roll = np.clip(avel_local[1] * ctrl_y_avel_kp, -1, 1)
-        vessel.control.pitch = control_pitch
-        vessel.control.yaw = control_yaw
-        vessel.control.roll = control_roll
+
+        sched.mark('guidance')
+
+        # 后台重新规划，不暂停游戏也不等待求解；最终降落段不再规划
+        if error[0] < params['start_altitude'] and nav_mode != 'final' and ut >= replan_next:
+            if planner.request(vessel_profile1(vessel_d, params, replan_lead), ut, replan_lead):
+                replan_next = ut + params['replan_interval']
+                if lockstep:
+                    planner.wait()
+        plan = planner.take(ut, gfold_version)
+        if plan is not None and nav_mode != 'final':
+            # 换用新的路径（整体替换，控制循环里不会看到一半新一半旧的路径）
+            gfold_path = plan.result
+            gfold_version = plan.version
+            follow = follower(gfold_path, g0)
+            n_i = -100
+            if debug_lines:
+                debug_lines.set_path(gfold_path[1], gfold_path[2], max_thrust / mass)
+            if view:
+                view.plan(plan.version, gfold_path)
+            if recording:
+                recording.plan(plan.version, ut, gfold_path)
+            print('gfold v%d, solved in %.2fs' % (plan.version, plan.latency))
+            if nav_mode == 'none':
+                nav_mode = 'gfold'
+
+        # 主目标无解（还没有任何路径）时并行规划备降点，解出来后换到排第一的那个，目标系和遥测都换过去
+        if divert and planner.failed and gfold_path is None and not divert.requested:
+            divert.request(vessel_profile1(vessel_d, params, replan_lead), target_body_pos, divert_pos)
+            divert_t0 = ut + replan_lead
+            if lockstep:
+                divert.wait()
+        choice = divert.take() if divert else None
+        if choice is not None:
+            if choice['ranked'] and choice['ranked'][0].acceptable:
+                site = choice['ranked'][0]
+                print('divert to %s: landing mass %.1fkg, %d of %d sites reachable, planned in %.2fs' % (
+                    site.name, site.landing_mass, len(choice['ranked']), len(divert_pos), choice['time']))
+                target_body_pos = divert_pos[site.index]
+                ref_target = target_frame(target_body_pos)
+                tele.close()
+                tele = telemetry(conn, vessel, ref_target, ref_surface, step=conn.step if lockstep else None)
+                vessel_d = tele.wait()
+                if debug_lines:
+                    debug_lines.remove()
+                    debug_lines = debug_drawing(conn, ref_target, {'target': (0, 0, 1), 'target2': (0, 0, 1), 'head': (0, 1, 1)},
+                                                params['debug_segments'], params['debug_rate'])
+                # 备降点解出来的路径就是第一条路径（规划时长计入延迟），不用再解一次
+                if planner.accept(divert_t0, choice['time'], site.result, site.path):
+                    replan_next = ut + params['replan_interval']
+                else:
+                    replan_next = -1.0
+            else:
+                print('divert: no reachable site')
+
+        sched.mark('planner')
+
+        # 姿态：目标方向变换到机体系，pitch/yaw用pid，roll直接消除角速度
+        kernel.attitude()
+        sched.mark('attitude')
+        ctrl.set(pitch=commands.pitch[0], yaw=commands.yaw[0], roll=commands.roll[0])
+        if debug_lines:
+            debug_lines.flush(ut)
+        if recording:
+            row['target_direction'] = target_direction
+            recording.controls(ctrl.commanded)
+            row['loop_time'] = time.perf_counter() - tick_start
+        sched.mark('control_write')
+        sched.end(ut - start_ut, tick_mode)
 
         # 终止条件
         if (npl.norm(error[1:3]) < 3 and npl.norm(error[0]) < 1 and npl.norm(vel[1:3]) < 1 and npl.norm(vel[0]) < 3) or (vel[0] > 0 and npl.norm(error[0]) < 1):
-            vessel.control.throttle = 0
+            ctrl.set(throttle=0)
+            break
+        if error[0] < 1 and npl.norm(vel) < 0.01 or ut - start_ut > params['max_flight_time']:  # 已经停在地面上（没落在目标点），或超时
+            ctrl.set(throttle=0)
             break
 
         prev_vel = vel
         game_prev_time = ut
+
+    anytime = planner.anytime.stats() if planner.anytime else None
+    if anytime:
+        print(planner.anytime.report())
+    planner.shutdown()
+    if view:
+        view.close()
+    if recording:
+        recording.close()
+    print(report(sched.stats()))
+    ctrl.close()
+    tele.close()
+    return {'ut': ut - start_ut, 'error': error, 'vel': vel, 'mass': mass, 'nav_mode': nav_mode, 'plans': gfold_version,
+            'recording': recording.path if recording else None, 'timing': sched.stats(), 'anytime': anytime}
+
+
+if __name__ == '__main__':
+    import krpc
+    import logging
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    run(krpc.connect(name='gfold'), load_params())